@@ -0,0 +1,100 @@
+'''
+Mede a latência por comando de "rule add", "rule list all" e "rule remove"
+em bancos de dados de tamanhos crescentes, executando os comandos
+diretamente (sem rede) e codificando a resposta como texto.
+
+$ python benchmarks/command_latency.py --sizes 100 1000 10000 50000
+$ python benchmarks/command_latency.py --storage sqlite
+'''
+
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from os import chdir, devnull, getcwd
+from os.path import abspath, dirname, join
+from sys import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from uuid import uuid4
+
+ROOT = join(dirname(abspath(__file__)), '..')
+path.insert(0, ROOT)
+
+from command import get_server_registry  # noqa: E402
+from models import User  # noqa: E402
+from protocol import encode_response  # noqa: E402
+from session import Session  # noqa: E402
+from storage import STORAGE_BACKENDS, open_storage, set_storage  # noqa: E402
+
+
+def create_database(storage_backend: str, size: int, user_id: str):
+    rules = {
+        str(uuid4()): {
+            'user_id': user_id,
+            'ip': f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}',
+            'action': 'ACCEPT' if i % 2 else 'DENY'
+        }
+        for i in range(size)
+    }
+
+    storage = open_storage(storage_backend, f'{size}.{storage_backend}')
+    storage.replace({'users': {}, 'rules': rules})
+    set_storage(storage)
+
+
+def run_command(command_line: str, session: Session):
+    registry = get_server_registry()
+
+    start = perf_counter()
+    encode_response(*registry.dispatch(command_line, session))
+    return perf_counter() - start
+
+
+def measure(storage_backend: str, size: int, repeat: int):
+    user = User.new_from_dict(str(uuid4()), {
+        'name': 'bench', 'email': 'bench@local', 'password': ''
+    })
+    session = Session(user)
+
+    create_database(storage_backend, size, user.id)
+
+    timings = {'rule add': 0, 'rule list all': 0, 'rule remove': 0}
+
+    for i in range(repeat):
+        address = f'192.168.{i >> 8 & 255}.{i & 255}'
+        timings['rule add'] += run_command(f'rule add {address} ACCEPT', session)
+        timings['rule list all'] += run_command('rule list all', session)
+        timings['rule remove'] += run_command(f'rule remove {address}', session)
+
+    return {name: total / repeat * 1000 for name, total in timings.items()}
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--storage', choices=list(STORAGE_BACKENDS), default='json')
+    args = parser.parse_args()
+
+    cwd = getcwd()
+    results = []
+
+    with TemporaryDirectory() as directory, open(devnull, 'w') as null:
+        chdir(directory)
+
+        try:
+            with redirect_stdout(null):
+                for size in args.sizes:
+                    results.append((size, measure(args.storage, size, args.repeat)))
+        finally:
+            set_storage(None)
+            chdir(cwd)
+
+    print(f'{"regras":>8}{"add ms":>12}{"list ms":>12}{"remove ms":>12}')
+
+    for size, timings in results:
+        print(f'{size:>8}{timings["rule add"]:>12.3f}'
+              f'{timings["rule list all"]:>12.3f}{timings["rule remove"]:>12.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+'''
+Compara o custo de despacho de um comando sem efeito ("ping") pelo
+registro criado uma única vez com o esquema anterior, que instanciava
+todos os comandos e os testava com startswith a cada requisição.
+
+$ python benchmarks/dispatch.py --requests 200000
+'''
+
+from argparse import ArgumentParser
+from os.path import abspath, dirname, join
+from sys import path
+from time import perf_counter
+
+ROOT = join(dirname(abspath(__file__)), '..')
+path.insert(0, ROOT)
+
+from command import (  # noqa: E402
+    Command, FirewallCommand, RequestContext, RuleCommand, UserCommand,
+    get_server_registry, register_server_command
+)
+from command_response_type import CommandResponseType  # noqa: E402
+from session import Session  # noqa: E402
+
+COMMAND_LINE = 'ping'
+
+
+class PingCommand(Command):
+    name = 'ping'
+
+    def run(self, context: RequestContext):
+        return (CommandResponseType.OK, 'pong')
+
+
+def legacy_dispatch(command_line: str, session: Session):
+    available_commands = [
+        UserCommand(),
+        RuleCommand(),
+        FirewallCommand(),
+        PingCommand()
+    ]
+
+    for cmd in available_commands:
+        if command_line.startswith(cmd.name):
+            args = command_line.strip().split(' ')[1:]
+            context = RequestContext(command_line, args, session)
+            return cmd.run(context)
+
+    return (CommandResponseType.ERROR, 'Comando inválido!')
+
+
+def measure(dispatch, requests: int, session: Session):
+    start = perf_counter()
+
+    for _ in range(requests):
+        dispatch(COMMAND_LINE, session)
+
+    return (perf_counter() - start) / requests * 1e6
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200000)
+    args = parser.parse_args()
+
+    register_server_command(PingCommand())
+    registry = get_server_registry()
+    session = Session()
+
+    results = [
+        ('legado', measure(legacy_dispatch, args.requests, session)),
+        ('registro', measure(registry.dispatch, args.requests, session))
+    ]
+
+    print(f'{"despacho":>10}{"us/req":>10}')
+
+    for name, elapsed in results:
+        print(f'{name:>10}{elapsed:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+'''
+Compara o tempo de "firewall start" entre os backends de firewall: regra a
+regra pelos scripts, em lote com iptables-restore, com ipset e com uma
+transação do nftables.
+
+Por padrão os comandos não são executados: cada chamada ao sistema é
+substituída pela execução de "true", medindo o custo de criação de
+processos sem precisar de root. Com --record nenhum processo é criado e
+apenas o tempo de geração dos comandos é medido.
+
+Com --aggregate as regras são agrupadas em prefixos antes de aplicadas,
+como faz o Firewall; --blocklist gera somente regras DROP em sequência,
+como em listas de bloqueio, em vez de alternar ACCEPT e DROP.
+
+$ python benchmarks/firewall_apply.py --rules 100 1000 10000
+$ python benchmarks/firewall_apply.py --rules 50000 --record --blocklist --aggregate
+'''
+
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from os import devnull, system
+from os.path import abspath, dirname, join
+from subprocess import run
+from sys import path
+from time import perf_counter
+
+ROOT = join(dirname(abspath(__file__)), '..')
+path.insert(0, ROOT)
+
+from firewall import FIREWALL_BACKENDS, RecordingRunner  # noqa: E402
+
+
+class SpawnRunner(RecordingRunner):
+    '''
+    Registra os comandos e cria um processo equivalente ("true") para cada
+    um deles.
+    '''
+
+    def run_shell(self, command: str) -> bool:
+        super().run_shell(command)
+        return not system('true')
+
+    def run(self, argv, input: str = None) -> bool:
+        super().run(argv, input)
+        return run(['true'], input=input, text=True).returncode == 0
+
+
+def get_rules(count: int, blocklist: bool = False):
+    return [
+        (
+            f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}',
+            'ACCEPT' if i % 2 and not blocklist else 'DROP'
+        )
+        for i in range(count)
+    ]
+
+
+def count_forward_rules(calls):
+    '''
+    Conta as regras adicionadas à chain FORWARD, que o kernel percorre
+    linearmente para cada pacote.
+    '''
+
+    count = 0
+
+    for call in calls:
+        if call[0] == 'shell':
+            count += '-A FORWARD' in call[1]
+        elif call[0] == 'run' and call[2]:
+            count += call[2].count('-A FORWARD')
+            count += call[2].count('ip saddr vmap')
+        elif call[0] == 'run':
+            count += '-A' in call[1] and 'FORWARD' in call[1]
+
+    return count
+
+
+def measure(backend_name: str, rules, record: bool, aggregate: bool):
+    runner = RecordingRunner() if record else SpawnRunner()
+    backend = FIREWALL_BACKENDS[backend_name](runner)
+
+    start = perf_counter()
+
+    if aggregate:
+        rules = backend.aggregate(rules)
+
+    backend.start(rules)
+    elapsed = perf_counter() - start
+
+    return elapsed, len(rules), len(runner.calls), count_forward_rules(runner.calls)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rules', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--backends', nargs='+', default=list(FIREWALL_BACKENDS))
+    parser.add_argument('--record', action='store_true')
+    parser.add_argument('--aggregate', action='store_true')
+    parser.add_argument('--blocklist', action='store_true')
+    args = parser.parse_args()
+
+    print(f'{"backend":<10}{"regras":>8}{"entradas":>10}{"chamadas":>10}'
+          f'{"FORWARD":>10}{"tempo s":>10}')
+
+    for count in args.rules:
+        rules = get_rules(count, args.blocklist)
+
+        for backend_name in args.backends:
+            with open(devnull, 'w') as null, redirect_stdout(null):
+                elapsed, entries, calls, chain = measure(
+                    backend_name, rules, args.record, args.aggregate
+                )
+
+            print(f'{backend_name:<10}{count:>8}{entries:>10}{calls:>10}'
+                  f'{chain:>10}{elapsed:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+'''
+Gera carga de ponta a ponta contra um servidor local.
+
+Para cada tamanho de banco de dados, inicia o servidor (server/main.py)
+em um subprocesso com o firewall em --dry-run, que registra os comandos
+em vez de executá-los (sem root), e dispara clientes concorrentes, cada um
+com seu usuário, executando uma mistura de "user login", "rule add",
+"rule list", "rule remove" e "firewall start". Reporta a vazão total e a
+latência p50/p99 por comando; com --output, grava os resultados em JSON
+para acompanhamento de regressões.
+
+$ python benchmarks/load.py --sizes 10 1000 10000 100000 --clients 20
+$ python benchmarks/load.py --mode async --storage sqlite --output load.json
+$ python benchmarks/load.py --mix login=1 add=50 remove=40 list=9
+'''
+
+from argparse import ArgumentParser
+from json import dump
+from os.path import abspath, dirname, join
+from random import Random
+from socket import create_connection, socket
+from statistics import quantiles
+from subprocess import DEVNULL, Popen
+from sys import executable, path
+from tempfile import TemporaryDirectory
+from threading import Barrier, Thread
+from time import perf_counter, sleep
+from uuid import uuid4
+
+ROOT = join(dirname(abspath(__file__)), '..')
+path.insert(0, ROOT)
+
+from hashing import PasswordHasher, set_password_hasher  # noqa: E402
+from models import User  # noqa: E402
+from protocol import FramedConnection  # noqa: E402
+from storage import STORAGE_BACKENDS, open_storage  # noqa: E402
+
+PASSWORD = 'senha'
+DEFAULT_MIX = ['login=2', 'add=30', 'list=40', 'remove=25', 'start=3']
+OPERATIONS = ('login', 'add', 'list', 'remove', 'start')
+
+
+def get_free_port():
+    with socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def parse_mix(mix):
+    weights = {}
+
+    for item in mix:
+        operation, _, weight = item.partition('=')
+
+        if operation not in OPERATIONS or not weight.isdigit():
+            raise ValueError(f'Item inválido na mistura: {item}')
+
+        weights[operation] = int(weight)
+
+    return weights
+
+
+def create_database(
+    storage_backend: str,
+    database_name: str,
+    size: int,
+    clients: int
+):
+    '''
+    Cadastra um usuário por cliente e distribui "size" regras entre eles.
+    Os usuários compartilham o mesmo hash, calculado uma única vez.
+    '''
+
+    password = User('', '', PASSWORD).get()['password']
+    users = {
+        str(uuid4()): {
+            'name': f'load {i}', 'email': f'load{i}@local', 'password': password
+        }
+        for i in range(clients)
+    }
+    user_ids = list(users)
+
+    rules = {
+        str(uuid4()): {
+            'user_id': user_ids[i % clients],
+            'ip': f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}',
+            'action': 'ACCEPT' if i % 2 else 'DENY'
+        }
+        for i in range(size)
+    }
+
+    storage = open_storage(storage_backend, database_name)
+    storage.replace({'users': users, 'rules': rules})
+    storage.close()
+
+
+def start_server(args, port: int, database_name: str):
+    process = Popen(
+        [
+            executable, 'main.py',
+            '--port', str(port),
+            '--mode', args.mode,
+            '--storage', args.storage,
+            '--database', database_name,
+            '--bcrypt-rounds', str(args.bcrypt_rounds),
+            '--dry-run'
+        ],
+        cwd=join(ROOT, 'server'),
+        stdout=DEVNULL,
+        stderr=DEVNULL
+    )
+
+    for _ in range(200):
+        try:
+            create_connection(('localhost', port)).close()
+            return process
+        except ConnectionRefusedError:
+            sleep(0.05)
+
+    process.kill()
+    raise RuntimeError('Servidor não iniciou')
+
+
+class LoadClient(Thread):
+    '''
+    Cliente simulado: após o login inicial, aguarda os demais na barreira
+    e executa "operations" comandos sorteados conforme a mistura. Cada
+    "rule remove" remove a regra incluída mais recentemente pelo cliente.
+    '''
+
+    def __init__(
+        self,
+        index: int,
+        port: int,
+        operations: int,
+        weights: dict,
+        barrier: Barrier
+    ):
+        Thread.__init__(self)
+        self.index = index
+        self.port = port
+        self.operations = operations
+        self.weights = weights
+        self.barrier = barrier
+        self.random = Random(index)
+        self.latencies = {}
+        self.failures = 0
+        self.added = []
+        self.next_address = 0
+
+    def request(self, connection: FramedConnection, command: str):
+        start = perf_counter()
+        request_id = connection.send(command)
+        frame = connection.receive()
+        elapsed = perf_counter() - start
+
+        if frame is None or frame[0] != request_id:
+            raise ConnectionError('Resposta inválida do servidor!')
+
+        if b'"code": "0"' not in frame[1]:
+            self.failures += 1
+
+        return elapsed
+
+    def record(self, name: str, elapsed: float):
+        self.latencies.setdefault(name, []).append(elapsed)
+
+    def run_operation(self, connection: FramedConnection, operation: str):
+        if operation == 'remove' and not self.added:
+            operation = 'add'
+
+        if operation == 'login':
+            self.request(connection, 'user logout')
+            self.record('user login', self.request(connection, self.login_command))
+        elif operation == 'add':
+            address = (
+                f'172.{16 + self.index % 16}.{self.next_address >> 8 & 255}.'
+                f'{self.next_address & 255}'
+            )
+            self.next_address += 1
+            self.added.append(address)
+            response = self.request(connection, f'rule add {address} DENY')
+            self.record('rule add', response)
+        elif operation == 'remove':
+            address = self.added.pop()
+            response = self.request(connection, f'rule remove {address}')
+            self.record('rule remove', response)
+        elif operation == 'list':
+            self.record('rule list', self.request(connection, 'rule list'))
+        else:
+            self.record('firewall start', self.request(connection, 'firewall start'))
+
+    @property
+    def login_command(self):
+        return f'user login load{self.index}@local {PASSWORD}'
+
+    def run(self):
+        operations = list(self.weights)
+        weights = [self.weights[operation] for operation in operations]
+
+        with create_connection(('localhost', self.port)) as conn:
+            connection = FramedConnection(conn)
+            self.request(connection, self.login_command)
+            self.barrier.wait()
+
+            chosen = self.random.choices(operations, weights, k=self.operations)
+
+            for operation in chosen:
+                self.run_operation(connection, operation)
+
+
+def summarize(latencies: list, elapsed: float):
+    if len(latencies) > 1:
+        percentiles = quantiles(latencies, n=100, method='inclusive')
+        p50, p99 = percentiles[49], percentiles[98]
+    else:
+        p50 = p99 = latencies[0]
+
+    return {
+        'count': len(latencies),
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': p50 * 1000,
+        'p99_ms': p99 * 1000
+    }
+
+
+def run_size(args, size: int, weights: dict, directory: str):
+    database_name = join(directory, f'{size}.{args.storage}')
+    create_database(args.storage, database_name, size, args.clients)
+
+    port = get_free_port()
+    process = start_server(args, port, database_name)
+
+    barrier = Barrier(args.clients + 1)
+    clients = [
+        LoadClient(i, port, args.operations, weights, barrier)
+        for i in range(args.clients)
+    ]
+
+    try:
+        for client in clients:
+            client.start()
+
+        barrier.wait()
+        start = perf_counter()
+
+        for client in clients:
+            client.join()
+
+        elapsed = perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait()
+
+    by_command = {}
+    for client in clients:
+        for name, values in client.latencies.items():
+            by_command.setdefault(name, []).extend(values)
+
+    all_latencies = [value for values in by_command.values() for value in values]
+
+    return {
+        'size': size,
+        'mode': args.mode,
+        'storage': args.storage,
+        'clients': args.clients,
+        'elapsed': elapsed,
+        'failures': sum(client.failures for client in clients),
+        'total': summarize(all_latencies, elapsed),
+        'commands': {
+            name: summarize(values, elapsed)
+            for name, values in sorted(by_command.items())
+        }
+    }
+
+
+def parse_arguments():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[10, 1000, 10000, 100000]
+    )
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument(
+        '--operations', type=int, default=200, help='comandos por cliente'
+    )
+    parser.add_argument('--mode', choices=['thread', 'async'], default='thread')
+    parser.add_argument('--storage', choices=list(STORAGE_BACKENDS), default='json')
+    parser.add_argument(
+        '--mix',
+        nargs='+',
+        default=DEFAULT_MIX,
+        help=f'pesos das operações ({", ".join(OPERATIONS)}), ex.: add=30 list=40'
+    )
+    parser.add_argument(
+        '--bcrypt-rounds',
+        type=int,
+        default=4,
+        help='custo do bcrypt dos usuários de teste'
+    )
+    parser.add_argument(
+        '--output', default=None, help='arquivo JSON com os resultados'
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    weights = parse_mix(args.mix)
+
+    set_password_hasher(PasswordHasher(rounds=args.bcrypt_rounds))
+
+    results = []
+
+    with TemporaryDirectory() as directory:
+        for size in args.sizes:
+            results.append(run_size(args, size, weights, directory))
+
+    print(
+        f'{"regras":>8}{"comando":>16}{"reqs":>8}'
+        f'{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}'
+    )
+
+    for result in results:
+        rows = [*result['commands'].items(), ('total', result['total'])]
+
+        for name, summary in rows:
+            print(f'{result["size"]:>8}{name:>16}{summary["count"]:>8}'
+                  f'{summary["throughput"]:>10.0f}{summary["p50_ms"]:>10.2f}'
+                  f'{summary["p99_ms"]:>10.2f}')
+
+        if result['failures']:
+            print(f'{"":>8}{result["failures"]} comando(s) com falha')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
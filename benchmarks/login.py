@@ -0,0 +1,91 @@
+'''
+Mede a latência de "user login" (e-mail existente e inexistente) conforme
+o número de usuários cadastrados cresce.
+
+$ python benchmarks/login.py --users 10 100 1000 10000
+'''
+
+from argparse import ArgumentParser
+from os import chdir, getcwd
+from os.path import abspath, dirname, join
+from sys import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+ROOT = join(dirname(abspath(__file__)), '..')
+path.insert(0, ROOT)
+
+from command import get_server_registry  # noqa: E402
+from models import User  # noqa: E402
+from session import Session  # noqa: E402
+from storage import STORAGE_BACKENDS, open_storage, set_storage  # noqa: E402
+
+PASSWORD = 'senha'
+
+
+def create_users(storage_backend: str, count: int):
+    '''
+    Cadastra "count" usuários compartilhando o mesmo hash, para que a
+    preparação não dependa do custo do bcrypt.
+    '''
+
+    password = User('', '', PASSWORD).get()['password']
+    users = {
+        f'user-{i}': {
+            'name': f'user {i}', 'email': f'{i}@local', 'password': password
+        }
+        for i in range(count)
+    }
+
+    storage = open_storage(storage_backend, f'{count}.{storage_backend}')
+    storage.replace({'users': users, 'rules': {}})
+    set_storage(storage)
+
+
+def login(email: str):
+    registry = get_server_registry()
+    session = Session()
+
+    start = perf_counter()
+    registry.dispatch(f'user login {email} {PASSWORD}', session)
+    return perf_counter() - start
+
+
+def measure(storage_backend: str, count: int, repeat: int):
+    create_users(storage_backend, count)
+    User.get_dummy_password_hash()
+
+    existing = sum(login(f'{count - 1}@local') for _ in range(repeat))
+    unknown = sum(login('desconhecido@local') for _ in range(repeat))
+
+    return existing / repeat * 1000, unknown / repeat * 1000
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--storage', choices=list(STORAGE_BACKENDS), default='json')
+    args = parser.parse_args()
+
+    cwd = getcwd()
+    results = []
+
+    with TemporaryDirectory() as directory:
+        chdir(directory)
+
+        try:
+            for count in args.users:
+                results.append((count, *measure(args.storage, count, args.repeat)))
+        finally:
+            set_storage(None)
+            chdir(cwd)
+
+    print(f'{"usuários":>10}{"existente ms":>16}{"inexistente ms":>16}')
+
+    for count, existing, unknown in results:
+        print(f'{count:>10}{existing:>16.1f}{unknown:>16.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+'''
+Compara o custo e o tamanho de uma página de "rule list" em cada
+codificação de resposta: texto formatado para leitura, JSON compacto e
+MessagePack (se o pacote estiver instalado).
+
+$ python benchmarks/response_encoding.py --rules 1000 --limit 1000
+'''
+
+from argparse import ArgumentParser
+from os.path import abspath, dirname, join
+from sys import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from uuid import uuid4
+
+ROOT = join(dirname(abspath(__file__)), '..')
+path.insert(0, ROOT)
+
+from command import get_server_registry  # noqa: E402
+from models import User  # noqa: E402
+from protocol import encode_response, get_available_encodings  # noqa: E402
+from session import Session  # noqa: E402
+from storage import MemoryStorage, set_storage  # noqa: E402
+
+
+def create_database(size: int, user_id: str, directory: str):
+    rules = {
+        str(uuid4()): {
+            'user_id': user_id,
+            'ip': f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}',
+            'action': 'ACCEPT' if i % 2 else 'DENY'
+        }
+        for i in range(size)
+    }
+
+    storage = MemoryStorage(join(directory, 'database.json'))
+    storage.replace({'users': {}, 'rules': rules})
+    set_storage(storage)
+
+    return storage
+
+
+def measure(encoding: str, command_line: str, session: Session, repeat: int):
+    registry = get_server_registry()
+    size = 0
+
+    start = perf_counter()
+
+    for _ in range(repeat):
+        response = registry.dispatch(command_line, session)
+        size = len(encode_response(*response, encoding))
+
+    return (perf_counter() - start) / repeat * 1000, size
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rules', type=int, default=1000)
+    parser.add_argument('--limit', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    user = User.new_from_dict(str(uuid4()), {
+        'name': 'bench', 'email': 'bench@local', 'password': ''
+    })
+    session = Session(user)
+
+    command_line = f'rule list limit={args.limit}'
+
+    with TemporaryDirectory() as directory:
+        storage = create_database(args.rules, user.id, directory)
+
+        try:
+            results = [
+                (encoding, *measure(encoding, command_line, session, args.repeat))
+                for encoding in get_available_encodings()
+            ]
+        finally:
+            set_storage(None)
+            storage.close()
+
+    print(f'{"codificação":>12}{"ms/página":>12}{"bytes":>12}')
+
+    for encoding, elapsed, size in results:
+        print(f'{encoding:>12}{elapsed:>12.3f}{size:>12}')
+
+
+if __name__ == '__main__':
+    main()
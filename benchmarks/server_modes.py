@@ -0,0 +1,161 @@
+'''
+Compara o servidor baseado em threads com o servidor asyncio.
+
+Para cada modo, inicia o servidor em localhost (em um diretório temporário
+com um banco de dados vazio), mantém um número de conexões ociosas abertas e
+dispara clientes concorrentes enviando comandos, reportando vazão, latência
+e quantidade de threads vivas no processo.
+
+$ python benchmarks/server_modes.py --clients 50 --requests 200 --idle 300
+$ python benchmarks/server_modes.py --pipeline 16
+'''
+
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from os import chdir, devnull, getcwd
+from os.path import abspath, dirname, join
+from socket import create_connection, socket
+from statistics import quantiles
+from sys import path
+from tempfile import TemporaryDirectory
+from threading import Thread, active_count
+from time import perf_counter, sleep
+
+ROOT = join(dirname(abspath(__file__)), '..')
+path.insert(0, ROOT)
+path.insert(0, join(ROOT, 'server'))
+
+from server import Server  # noqa: E402
+from async_server import AsyncServer  # noqa: E402
+from protocol import FramedConnection  # noqa: E402
+
+COMMAND = 'user list all'
+
+
+def get_free_port():
+    with socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode: str, port: int, backlog: int):
+    if mode == 'async':
+        server = AsyncServer('localhost', port, backlog)
+    else:
+        server = Server('localhost', port, backlog)
+
+    server.daemon = True
+    server.start()
+
+    for _ in range(100):
+        try:
+            create_connection(('localhost', port)).close()
+            return server
+        except ConnectionRefusedError:
+            sleep(0.05)
+
+    raise RuntimeError(f'Servidor {mode} não iniciou')
+
+
+def run_client(port: int, requests: int, pipeline: int, latencies: list):
+    '''
+    Envia os comandos em lotes de "pipeline" requisições, aguardando as
+    respostas de cada lote antes de enviar o próximo.
+    '''
+
+    with create_connection(('localhost', port)) as conn:
+        connection = FramedConnection(conn)
+
+        for _ in range(0, requests, pipeline):
+            start = perf_counter()
+            request_ids = connection.send_many([COMMAND] * pipeline)
+
+            for _ in request_ids:
+                connection.receive()
+                latencies.append(perf_counter() - start)
+
+
+def run_mode(mode: str, args):
+    port = get_free_port()
+    start_server(mode, port, args.backlog)
+
+    idle = [create_connection(('localhost', port)) for _ in range(args.idle)]
+    sleep(0.2)
+    threads_with_idle = active_count()
+
+    latencies = []
+    clients = [
+        Thread(
+            target=run_client,
+            args=(port, args.requests, args.pipeline, latencies)
+        )
+        for _ in range(args.clients)
+    ]
+
+    start = perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = perf_counter() - start
+
+    for conn in idle:
+        conn.close()
+
+    sleep(0.5)
+
+    percentiles = quantiles(latencies, n=100)
+
+    return {
+        'mode': mode,
+        'requests': len(latencies),
+        'elapsed': elapsed,
+        'throughput': len(latencies) / elapsed,
+        'p50': percentiles[49] * 1000,
+        'p99': percentiles[98] * 1000,
+        'threads': threads_with_idle,
+    }
+
+
+def parse_arguments():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--idle', type=int, default=100)
+    parser.add_argument(
+        '--pipeline',
+        type=int,
+        default=1,
+        help='comandos enviados antes de aguardar as respostas'
+    )
+    parser.add_argument('--backlog', type=int, default=128)
+    parser.add_argument('--modes', nargs='+', default=['thread', 'async'])
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    results = []
+    cwd = getcwd()
+
+    with TemporaryDirectory() as directory, open(devnull, 'w') as null:
+        chdir(directory)
+
+        try:
+            with redirect_stdout(null):
+                for mode in args.modes:
+                    results.append(run_mode(mode, args))
+        finally:
+            chdir(cwd)
+
+    print(f'{"modo":<8}{"reqs":>8}{"req/s":>10}{"p50 ms":>10}'
+          f'{"p99 ms":>10}{"threads":>10}')
+
+    for r in results:
+        print(f'{r["mode"]:<8}{r["requests"]:>8}{r["throughput"]:>10.0f}'
+              f'{r["p50"]:>10.2f}{r["p99"]:>10.2f}{r["threads"]:>10}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+'''
+Mede o tempo e o pico de memória de cada operação de armazenamento usada
+pelos comandos (DatabaseCommand), em bancos de dados gerados com tamanhos
+crescentes. Operações cujo custo cresce com o tamanho do banco aparecem
+como tempos que aumentam na mesma proporção.
+
+O tempo é a média de --repeat chamadas; a memória é o pico alocado
+(tracemalloc) em uma chamada separada, sem interferir na medição do tempo.
+
+$ python benchmarks/storage_ops.py --sizes 100 1000 10000 100000
+$ python benchmarks/storage_ops.py --storage sqlite --output storage.json
+'''
+
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from json import dump
+from os import devnull
+from os.path import abspath, dirname, join
+from sys import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from tracemalloc import get_traced_memory, reset_peak, start, stop
+from uuid import uuid4
+
+ROOT = join(dirname(abspath(__file__)), '..')
+path.insert(0, ROOT)
+
+from command import RequestContext, RuleCommand  # noqa: E402
+from command_response_type import DatabaseTableType  # noqa: E402
+from models import Rule, User  # noqa: E402
+from session import Session  # noqa: E402
+from storage import STORAGE_BACKENDS, open_storage, set_storage  # noqa: E402
+
+USERS = 10
+
+
+def generate_database(size: int, user_ids: list):
+    rules = {
+        str(uuid4()): {
+            'user_id': user_ids[i % len(user_ids)],
+            'ip': f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}',
+            'action': 'ACCEPT' if i % 2 else 'DENY'
+        }
+        for i in range(size)
+    }
+    users = {
+        user_id: {'name': f'user {i}', 'email': f'{i}@local', 'password': ''}
+        for i, user_id in enumerate(user_ids)
+    }
+
+    return {'users': users, 'rules': rules}
+
+
+def get_operations(command: RuleCommand, database_dict: dict, session: Session):
+    '''
+    Retorna as operações medidas como funções que recebem o número da
+    chamada. "remove_rule" remove uma regra diferente a cada chamada.
+    '''
+
+    user_id = session.user.id
+    rules = [
+        (id, rule) for id, rule in database_dict['rules'].items()
+        if rule['user_id'] == user_id
+    ]
+    missing_rule = Rule(user_id, '192.168.0.1', 'DENY')
+
+    def remove_rule(i):
+        context = RequestContext('', [rules[i % len(rules)][1]['ip']], session)
+        return command.remove_rule(context)
+
+    return {
+        'get_table_from_database':
+            lambda i: command.get_table_from_database(DatabaseTableType.RULE),
+        'save_dict_to_database':
+            lambda i: command.save_dict_to_database(database_dict),
+        'check_if_unique_rule_in_database':
+            lambda i: command.check_if_unique_rule_in_database(missing_rule),
+        'get_rules_by_user_id':
+            lambda i: command.storage.get_rules_by_user_id(user_id),
+        'remove_rule': remove_rule
+    }
+
+
+def measure_time(operation, repeat: int, offset: int):
+    start_time = perf_counter()
+
+    for i in range(repeat):
+        operation(offset + i)
+
+    return (perf_counter() - start_time) / repeat
+
+
+def measure_memory(operation, offset: int):
+    start()
+
+    try:
+        baseline = get_traced_memory()[0]
+        reset_peak()
+        operation(offset)
+        return get_traced_memory()[1] - baseline
+    finally:
+        stop()
+
+
+def measure(
+    storage_backend: str,
+    size: int,
+    repeat: int,
+    save_repeat: int,
+    directory: str
+):
+    user_ids = [str(uuid4()) for _ in range(USERS)]
+    database_dict = generate_database(size, user_ids)
+
+    storage = open_storage(
+        storage_backend, join(directory, f'{size}.{storage_backend}')
+    )
+    storage.replace(database_dict)
+    set_storage(storage)
+
+    user = User.new_from_dict(user_ids[0], database_dict['users'][user_ids[0]])
+    command = RuleCommand()
+    results = {}
+
+    try:
+        operations = get_operations(command, database_dict, Session(user))
+
+        for name, operation in operations.items():
+            count = save_repeat if name == 'save_dict_to_database' else repeat
+
+            if name == 'remove_rule':
+                count = min(count, size // USERS - 1)
+
+            if count < 1:
+                continue
+
+            results[name] = {
+                'time_ms': measure_time(operation, count, 0) * 1000,
+                'peak_kb': measure_memory(operation, count) / 1024
+            }
+    finally:
+        set_storage(None)
+        storage.close()
+
+    return results
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000]
+    )
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument(
+        '--save-repeat',
+        type=int,
+        default=3,
+        help='chamadas de save_dict_to_database, que regrava o banco inteiro'
+    )
+    parser.add_argument('--storage', choices=list(STORAGE_BACKENDS), default='json')
+    parser.add_argument(
+        '--output', default=None, help='arquivo JSON com os resultados'
+    )
+    args = parser.parse_args()
+
+    results = []
+
+    with TemporaryDirectory() as directory, open(devnull, 'w') as null:
+        with redirect_stdout(null):
+            for size in args.sizes:
+                results.append({
+                    'size': size,
+                    'storage': args.storage,
+                    'operations': measure(
+                        args.storage, size, args.repeat, args.save_repeat, directory
+                    )
+                })
+
+    print(f'{"regras":>8}  {"operação":<34}{"ms":>12}{"pico KiB":>12}')
+
+    for result in results:
+        for name, values in result['operations'].items():
+            print(f'{result["size"]:>8}  {name:<34}{values["time_ms"]:>12.4f}'
+                  f'{values["peak_kb"]:>12.1f}')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,458 @@
+from abc import ABC, abstractmethod
+from asyncio import (
+    Lock, StreamReader, StreamWriter, get_running_loop, new_event_loop,
+    open_connection, run_coroutine_threadsafe
+)
+from threading import Thread
+from time import monotonic
+from typing import Callable, Dict, List, Optional, Tuple
+from sys import path
+path.append('..')
+from command_response_type import CommandResponseType
+from protocol import (
+    ProtocolError, decode_response, encode_frame, get_available_encodings, read_frame
+)
+
+DEFAULT_POOL_SIZE = 4
+# Conexões ociosas por mais tempo que isso são reabertas antes do uso; deve
+# ser menor que o tempo de expiração das sessões no servidor.
+DEFAULT_MAX_IDLE = 60.0
+# Codificações tentadas na abertura de cada conexão, em ordem de preferência.
+PREFERRED_ENCODINGS = ('msgpack', 'json')
+
+
+class ApiError(Exception):
+    '''
+    Erro retornado pelo servidor para um comando.
+    '''
+
+
+class Page:
+    '''
+    Página de uma listagem, com os registros como dicionários e o cursor
+    da próxima página (None na última).
+    '''
+
+    items: List[dict]
+    next_cursor: Optional[str]
+
+    def __init__(self, items: List[dict], next_cursor: Optional[str]):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @staticmethod
+    def from_data(data: dict, key: str):
+        fields = data['fields']
+        items = [dict(zip(fields, row)) for row in data[key]]
+
+        return Page(items, data['next_cursor'])
+
+
+def check_argument(value: str) -> str:
+    '''
+    Os comandos são separados por espaços: argumentos vazios ou com
+    espaços seriam lidos incorretamente pelo servidor.
+    '''
+
+    if not value or any(char.isspace() for char in value):
+        raise ValueError(f'Argumento inválido: {value!r}')
+
+    return value
+
+
+def format_list_options(**options) -> str:
+    return ''.join(
+        f' {key}={check_argument(str(value))}'
+        for key, value in options.items()
+        if value is not None
+    )
+
+
+class AsyncConnection:
+    '''
+    Conexão com o servidor que aceita várias requisições simultâneas: as
+    respostas são lidas por uma única tarefa e entregues pelo id da
+    requisição.
+    '''
+
+    reader: StreamReader
+    writer: StreamWriter
+    encoding: str
+    pending: Dict[int, tuple]
+    last_used: float
+    closed: bool
+
+    def __init__(self, reader: StreamReader, writer: StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.encoding = 'text'
+        self.next_request_id = 1
+        self.pending = {}
+        self.last_used = monotonic()
+        self.closed = False
+        self.reader_task = get_running_loop().create_task(self.read_responses())
+
+    async def request(self, command: str) -> dict:
+        if self.closed:
+            raise ConnectionError('Conexão encerrada pelo servidor!')
+
+        request_id = self.next_request_id
+        self.next_request_id = (self.next_request_id + 1) % (1 << 32)
+
+        future = get_running_loop().create_future()
+        self.pending[request_id] = (future, self.encoding)
+        self.last_used = monotonic()
+
+        self.writer.write(encode_frame(request_id, command.encode('utf8')))
+        await self.writer.drain()
+
+        return await future
+
+    async def read_responses(self):
+        try:
+            while True:
+                frame = await read_frame(self.reader)
+
+                if frame is None:
+                    break
+
+                request_id, payload = frame
+                future, encoding = self.pending.pop(request_id, (None, None))
+
+                if future is not None and not future.done():
+                    future.set_result(decode_response(payload, encoding))
+        except (OSError, ProtocolError, ValueError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        self.closed = True
+
+        for future, _ in self.pending.values():
+            if not future.done():
+                future.set_exception(
+                    ConnectionError('Conexão encerrada pelo servidor!')
+                )
+
+        self.pending.clear()
+        self.writer.close()
+
+
+class AsyncConnectionPool:
+    '''
+    Conjunto de conexões persistentes e autenticadas, usadas em rodízio.
+    Conexões são abertas sob demanda e reabertas quando encerradas pelo
+    servidor ou ociosas por mais de "max_idle" segundos. O login é feito
+    uma única vez: as demais conexões retomam a sessão pelo token.
+    '''
+
+    addr: Tuple[str, int]
+    email: Optional[str]
+    password: Optional[str]
+    token: Optional[str]
+    max_idle: float
+    connections: List[Optional[AsyncConnection]]
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        email: str = None,
+        password: str = None,
+        token: str = None,
+        size: int = DEFAULT_POOL_SIZE,
+        max_idle: float = DEFAULT_MAX_IDLE
+    ):
+        self.addr = (host, port)
+        self.email = email
+        self.password = password
+        self.token = token
+        self.max_idle = max_idle
+        self.connections = [None] * size
+        self.locks = [Lock() for _ in range(size)]
+        self.auth_lock = Lock()
+        self.next_slot = 0
+
+    def is_usable(self, connection: Optional[AsyncConnection]) -> bool:
+        return connection is not None and not connection.closed and \
+            monotonic() - connection.last_used <= self.max_idle
+
+    async def get_connection(self) -> AsyncConnection:
+        slot = self.next_slot
+        self.next_slot = (slot + 1) % len(self.connections)
+
+        if self.is_usable(self.connections[slot]):
+            return self.connections[slot]
+
+        async with self.locks[slot]:
+            connection = self.connections[slot]
+
+            if not self.is_usable(connection):
+                if connection is not None:
+                    connection.close()
+
+                connection = await self.open_connection()
+                self.connections[slot] = connection
+
+            return connection
+
+    async def open_connection(self) -> AsyncConnection:
+        reader, writer = await open_connection(*self.addr)
+        connection = AsyncConnection(reader, writer)
+
+        try:
+            await self.negotiate_encoding(connection)
+            await self.authenticate(connection)
+        except BaseException:
+            connection.close()
+            raise
+
+        return connection
+
+    async def negotiate_encoding(self, connection: AsyncConnection):
+        '''
+        Escolhe a primeira codificação estruturada suportada pelos dois
+        lados; o servidor pode não ter o pacote msgpack instalado.
+        '''
+
+        available_encodings = get_available_encodings()
+
+        for encoding in PREFERRED_ENCODINGS:
+            if encoding not in available_encodings:
+                continue
+
+            response = await connection.request(f'encoding {encoding}')
+
+            if int(response['code']) == CommandResponseType.OK:
+                connection.encoding = encoding
+                return
+
+        raise ApiError('Nenhuma codificação estruturada disponível no servidor!')
+
+    async def authenticate(self, connection: AsyncConnection):
+        token = self.token
+
+        if token:
+            response = await connection.request(f'user resume {token}')
+
+            if response['code'] == CommandResponseType.OK:
+                return
+
+        if self.email is None:
+            if token:
+                raise ApiError(response['message'])
+
+            return
+
+        async with self.auth_lock:
+            if self.token and self.token != token:
+                response = await connection.request(f'user resume {self.token}')
+
+                if response['code'] == CommandResponseType.OK:
+                    return
+
+            response = await connection.request(
+                f'user login {self.email} {self.password}'
+            )
+
+            if response['code'] != CommandResponseType.OK:
+                raise ApiError(response['message'])
+
+            self.token = response['data']['token']
+
+    def close(self):
+        for connection in self.connections:
+            if connection is not None:
+                connection.close()
+
+        self.connections = [None] * len(self.connections)
+
+
+class ApiMethods(ABC):
+    '''
+    Operações disponíveis no servidor. Cada método monta o comando e o
+    repassa a "execute", implementado pelos clients síncrono e assíncrono.
+    '''
+
+    @abstractmethod
+    def execute(
+        self,
+        command: str,
+        parser: Callable = None,
+        idempotent: bool = False
+    ):
+        raise NotImplementedError
+
+    def create_user(self, name: str, email: str, password: str) -> dict:
+        return self.execute(
+            f'user create {name} {check_argument(email)} {check_argument(password)}'
+        )
+
+    def list_users(
+        self,
+        limit: int = None,
+        cursor: str = None,
+        email: str = None
+    ) -> Page:
+        return self.execute(
+            'user list' + format_list_options(
+                limit=limit, cursor=cursor, email=email
+            ),
+            lambda data: Page.from_data(data, 'users'),
+            idempotent=True
+        )
+
+    def remove_user(self, email_or_id: str) -> str:
+        return self.execute(f'user remove {check_argument(email_or_id)}')
+
+    def add_rule(self, ip: str, action: str) -> dict:
+        return self.execute(f'rule add {check_argument(ip)} {check_argument(action)}')
+
+    def list_rules(
+        self,
+        limit: int = None,
+        cursor: str = None,
+        address: str = None,
+        action: str = None
+    ) -> Page:
+        return self.execute(
+            'rule list' + format_list_options(
+                limit=limit, cursor=cursor, address=address, action=action
+            ),
+            lambda data: Page.from_data(data, 'rules'),
+            idempotent=True
+        )
+
+    def remove_rule(self, address_or_id: str) -> str:
+        return self.execute(f'rule remove {check_argument(address_or_id)}')
+
+    def lint_rules(self, all_users: bool = False) -> List[dict]:
+        command = 'rule lint all' if all_users else 'rule lint'
+        return self.execute(command, idempotent=True)
+
+    def start_firewall(self) -> dict:
+        return self.execute('firewall start', idempotent=True)
+
+    def sync_firewall(self) -> dict:
+        return self.execute('firewall sync', idempotent=True)
+
+    def stop_firewall(self) -> str:
+        return self.execute('firewall stop', idempotent=True)
+
+    def reload_firewall(self) -> str:
+        return self.execute('firewall reload', idempotent=True)
+
+
+class AsyncApiClient(ApiMethods):
+    '''
+    Client assíncrono: os métodos retornam corrotinas. Requisições
+    simultâneas são distribuídas entre as conexões do pool e enviadas sem
+    aguardar as respostas anteriores.
+
+    Se a conexão cair durante a requisição, somente comandos idempotentes
+    (listagens e firewall) são reenviados, em uma nova conexão; os demais
+    lançam ConnectionError, já que podem ter sido executados.
+    '''
+
+    pool: AsyncConnectionPool
+
+    def __init__(
+        self,
+        host: str = 'localhost',
+        port: int = 5000,
+        email: str = None,
+        password: str = None,
+        token: str = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        max_idle: float = DEFAULT_MAX_IDLE
+    ):
+        self.pool = AsyncConnectionPool(
+            host, port, email, password, token, pool_size, max_idle
+        )
+
+    @property
+    def token(self) -> Optional[str]:
+        return self.pool.token
+
+    async def execute(
+        self,
+        command: str,
+        parser: Callable = None,
+        idempotent: bool = False
+    ):
+        for attempt in range(2):
+            connection = await self.pool.get_connection()
+
+            try:
+                response = await connection.request(command)
+                break
+            except ConnectionError:
+                if attempt or not idempotent:
+                    raise
+
+        if response['code'] != CommandResponseType.OK:
+            raise ApiError(response['message'])
+
+        if 'data' not in response:
+            return response['message']
+
+        return parser(response['data']) if parser else response['data']
+
+    async def close(self):
+        self.pool.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class ApiClient(ApiMethods):
+    '''
+    Client síncrono, seguro para uso por várias threads. As requisições
+    são executadas por um AsyncApiClient em um laço de eventos próprio,
+    de modo que chamadas simultâneas compartilham as conexões do pool.
+    '''
+
+    client: AsyncApiClient
+
+    def __init__(self, *args, **kwargs):
+        self.loop = new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.client = self.run(self.create_client(*args, **kwargs))
+
+    async def create_client(self, *args, **kwargs):
+        return AsyncApiClient(*args, **kwargs)
+
+    @property
+    def token(self) -> Optional[str]:
+        return self.client.token
+
+    def run(self, coroutine):
+        return run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def execute(
+        self,
+        command: str,
+        parser: Callable = None,
+        idempotent: bool = False
+    ):
+        return self.run(self.client.execute(command, parser, idempotent))
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+
+        self.run(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
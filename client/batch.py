@@ -0,0 +1,315 @@
+from json import dumps
+from socket import create_connection
+from statistics import quantiles
+from threading import Thread
+from time import perf_counter
+from typing import List, Optional, Tuple
+from sys import path
+path.append('..')
+from command_response_type import CommandResponseType
+from command import get_client_registry
+from protocol import FramedConnection, ProtocolError, decode_response
+
+DEFAULT_PIPELINE = 16
+# As conexões do modo batch recebem os dados estruturados das respostas,
+# de onde é lido, por exemplo, o token de sessão do login.
+BATCH_ENCODING = 'json'
+SESSION_COMMANDS = ('login', 'resume', 'logout')
+
+# Pares (número da linha, comando).
+BatchCommand = Tuple[int, str]
+
+
+class BatchResult:
+    line: int
+    command: str
+    response: dict
+    elapsed: Optional[float]
+
+    def __init__(
+        self,
+        line: int,
+        command: str,
+        response: dict,
+        elapsed: float = None
+    ):
+        self.line = line
+        self.command = command
+        self.response = response
+        self.elapsed = elapsed
+
+    @property
+    def code(self) -> int:
+        return int(self.response['code'])
+
+    def to_json(self) -> str:
+        result = {
+            'line': self.line,
+            'command': self.command,
+            'elapsed_ms': (
+                None if self.elapsed is None else round(self.elapsed * 1000, 3)
+            ),
+            **self.response
+        }
+
+        return dumps(result, ensure_ascii=False)
+
+
+def read_batch_commands(file) -> List[BatchCommand]:
+    '''
+    Lê os comandos do arquivo, um por linha, ignorando linhas vazias e
+    comentários iniciados por "#".
+    '''
+
+    commands = []
+
+    for line_number, line in enumerate(file, 1):
+        line = line.strip()
+
+        if line and not line.startswith('#'):
+            commands.append((line_number, line))
+
+    return commands
+
+
+def is_session_command(command: str) -> bool:
+    tokens = command.split()
+    return len(tokens) > 1 and tokens[0] == 'user' and tokens[1] in SESSION_COMMANDS
+
+
+class BatchClient:
+    '''
+    Executa uma lista de comandos sem interação, sobre uma ou mais
+    conexões, mantendo até "pipeline" comandos em andamento em cada uma.
+
+    Os comandos até o último login/resume/logout são executados em ordem
+    na primeira conexão; os seguintes são divididos em faixas contíguas
+    entre as conexões, que retomam a sessão aberta antes de executá-los.
+    Cada faixa é executada em ordem, mas faixas de conexões diferentes são
+    executadas em paralelo.
+    '''
+
+    addr: Tuple[str, int]
+    connections: int
+    pipeline: int
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        connections: int = 1,
+        pipeline: int = DEFAULT_PIPELINE
+    ):
+        self.addr = (host, port)
+        self.connections = connections
+        self.pipeline = pipeline
+
+    def connect(self) -> FramedConnection:
+        connection = FramedConnection(create_connection(self.addr))
+        self.request(connection, f'encoding {BATCH_ENCODING}')
+        connection.encoding = BATCH_ENCODING
+
+        return connection
+
+    def request(self, connection: FramedConnection, command: str) -> dict:
+        request_id = connection.send(command)
+        response = connection.receive_response(request_id)
+
+        if response is None or int(response['code']) != CommandResponseType.OK:
+            raise ConnectionError(
+                f'Falha ao executar "{command.split()[0]}" no servidor!'
+            )
+
+        return response
+
+    def run_commands(
+        self,
+        connection: FramedConnection,
+        commands: List[BatchCommand],
+        results: dict
+    ):
+        '''
+        Envia os comandos em lotes, completando a janela de "pipeline"
+        comandos em andamento a cada resposta recebida.
+        '''
+
+        pending = {}
+        position = 0
+
+        while position < len(commands) or pending:
+            window = commands[position:position + self.pipeline - len(pending)]
+            position += len(window)
+
+            if window:
+                request_ids = connection.send_many(command for _, command in window)
+                start = perf_counter()
+
+                for request_id, command in zip(request_ids, window):
+                    pending[request_id] = (command, start)
+
+            frame = connection.receive()
+
+            if frame is None:
+                raise ConnectionError('Conexão encerrada pelo servidor!')
+
+            request_id, payload = frame
+            (line, command), start = pending.pop(request_id)
+
+            results[line] = BatchResult(
+                line,
+                command,
+                decode_response(payload, connection.encoding),
+                perf_counter() - start
+            )
+
+    def run_worker(
+        self,
+        connection: Optional[FramedConnection],
+        token: Optional[str],
+        commands: List[BatchCommand],
+        results: dict
+    ):
+        '''
+        Executa uma faixa de comandos. Sem "connection", abre uma nova
+        conexão e retoma nela a sessão do token.
+        '''
+
+        try:
+            if connection is None:
+                connection = self.connect()
+
+                if token:
+                    self.request(connection, f'user resume {token}')
+
+            with connection.conn:
+                self.run_commands(connection, commands, results)
+        except (OSError, ProtocolError):
+            pass
+
+    def get_session_token(self, results: List[BatchResult]) -> Optional[str]:
+        '''
+        Retorna o token da sessão aberta pelos comandos já executados.
+        '''
+
+        token = None
+
+        for result in results:
+            if result.code != CommandResponseType.OK:
+                continue
+
+            action = result.command.split()[1]
+
+            if action == 'login':
+                token = result.response['data']['token']
+            elif action == 'resume':
+                token = result.command.split()[2]
+            else:
+                token = None
+
+        return token
+
+    def run(self, commands: List[BatchCommand]) -> List[BatchResult]:
+        '''
+        Executa os comandos e retorna os resultados na ordem do arquivo.
+        Comandos sem resposta (por queda da conexão) e comandos do modo
+        interativo, como "upload", resultam em falha.
+        '''
+
+        results = {}
+        server_commands = []
+
+        for line, command in commands:
+            if get_client_registry().get_command(command) is not None:
+                results[line] = BatchResult(line, command, {
+                    'code': CommandResponseType.ERROR,
+                    'message': 'Comando disponível apenas no modo interativo!'
+                })
+            else:
+                server_commands.append((line, command))
+
+        session_end = 0
+
+        for index, (_, command) in enumerate(server_commands):
+            if is_session_command(command):
+                session_end = index + 1
+
+        primary = self.connect()
+
+        try:
+            self.run_commands(primary, server_commands[:session_end], results)
+        except (OSError, ProtocolError):
+            primary.conn.close()
+            return self.collect_results(commands, results)
+
+        token = self.get_session_token(
+            [
+                results[line]
+                for line, command in server_commands[:session_end]
+                if is_session_command(command)
+            ]
+        )
+
+        remaining = server_commands[session_end:]
+        slice_size = -(-len(remaining) // self.connections) or 1
+        workers = []
+
+        for start in range(0, len(remaining), slice_size):
+            workers.append(Thread(
+                target=self.run_worker,
+                args=(
+                    None if workers else primary,
+                    token,
+                    remaining[start:start + slice_size],
+                    results
+                )
+            ))
+
+        if not workers:
+            primary.conn.close()
+
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join()
+
+        return self.collect_results(commands, results)
+
+    def collect_results(
+        self,
+        commands: List[BatchCommand],
+        results: dict
+    ) -> List[BatchResult]:
+        return [
+            results.get(line) or BatchResult(line, command, {
+                'code': CommandResponseType.ERROR,
+                'message': 'Sem resposta do servidor!'
+            })
+            for line, command in commands
+        ]
+
+
+def summarize_results(results: List[BatchResult], elapsed: float) -> str:
+    '''
+    Resume a execução: comandos com sucesso e falha, vazão e latência.
+    '''
+
+    failures = sum(result.code != CommandResponseType.OK for result in results)
+    latencies = [result.elapsed for result in results if result.elapsed is not None]
+
+    throughput = len(results) / elapsed if elapsed else 0
+    lines = [
+        f'{len(results)} comando(s): {len(results) - failures} sucesso(s), '
+        f'{failures} falha(s).',
+        f'Tempo total: {elapsed:.3f}s ({throughput:.0f} comandos/s).'
+    ]
+
+    if len(latencies) > 1:
+        percentiles = quantiles(latencies, n=100, method='inclusive')
+        lines.append(
+            f'Latência: p50 {percentiles[49] * 1000:.2f}ms, '
+            f'p99 {percentiles[98] * 1000:.2f}ms, '
+            f'máx. {max(latencies) * 1000:.2f}ms.'
+        )
+
+    return '\n'.join(lines)
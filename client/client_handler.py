@@ -1,55 +1,70 @@
-from json import loads
 from socket import AF_INET, SOCK_STREAM, socket, SocketType
 from threading import Thread
 from sys import path
 path.append('..')
 from command_response_type import CommandResponseType
-from command import get_client_commands
+from command import RequestContext, format_response_data, get_client_registry
+from protocol import FramedConnection
 
 
 class ClientHandler(Thread):
     server_address: str
     socket: SocketType
+    connection: FramedConnection
 
     def __init__(self, host: str, port: int):
         Thread.__init__(self)
         self.server_address = f'{host}:{port}'
         self.addr = (host, port)
 
-    def parse_server_response(self):
-        data = self.socket.recv(1024)
+    def parse_server_response(self, request_id: int):
+        response = self.connection.receive_response(request_id)
 
-        if not data:
+        if response is None:
             return CommandResponseType.ERROR
 
-        response = loads(data.decode('utf8'))
-
         code_labels = {
             str(CommandResponseType.OK): "SUCESSO",
             str(CommandResponseType.ERROR): "FALHA",
         }
 
-        code = response['code']
+        code = str(response['code'])
         label = code_labels[code]
 
-        message = response['message']
+        if 'data' in response:
+            message = format_response_data(response['data'])
+        else:
+            message = response['message']
 
         print(f'{label}\n{"="*15}\n{message}')
         return code
 
     def check_for_available_commands(self, command: str):
-        available_commands = get_client_commands()
+        cmd = get_client_registry().get_command(command)
+
+        if cmd is not None:
+            context = RequestContext(
+                command,
+                command.split()[1:],
+                connection=self.connection
+            )
+            return cmd.run(context)
 
-        for cmd in available_commands:
-            if cmd.check(command):
-                return cmd.run()
+        request_id = self.connection.send(command)
+        code = self.parse_server_response(request_id)
 
-        self.socket.sendall(command.encode('utf8'))
-        return self.parse_server_response()
+        # A resposta de "encoding" usa a codificação anterior; as seguintes,
+        # a nova.
+        tokens = command.split()
+        if tokens[:1] == ['encoding'] and code == str(CommandResponseType.OK):
+            self.connection.encoding = tokens[1]
+
+        return code
 
     def run(self):
         with socket(AF_INET, SOCK_STREAM) as current_socket:
             self.socket = current_socket
+            self.connection = FramedConnection(current_socket)
 
             current_socket.connect(self.addr)
             print(f'Iniciando conexão com {self.server_address}')
@@ -1,7 +1,74 @@
+from argparse import ArgumentParser, FileType
+from sys import exit, stderr
+from time import perf_counter
+
+from batch import (
+    DEFAULT_PIPELINE, BatchClient, read_batch_commands, summarize_results
+)
 from client import Client
 
+
+def parse_arguments():
+    parser = ArgumentParser(description='Client do servidor de regras do iptables')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument(
+        '--batch',
+        type=FileType('r', encoding='utf8'),
+        default=None,
+        help='executa sem interação os comandos do arquivo ("-" para stdin)'
+    )
+    parser.add_argument(
+        '--connections',
+        type=int,
+        default=1,
+        help='conexões usadas em paralelo no modo batch'
+    )
+    parser.add_argument(
+        '--pipeline',
+        type=int,
+        default=DEFAULT_PIPELINE,
+        help='comandos em andamento por conexão no modo batch'
+    )
+
+    return parser.parse_args()
+
+
+def run_batch(args):
+    '''
+    Executa os comandos do arquivo, imprimindo um resultado JSON por linha
+    e o resumo da execução em stderr. Retorna o código de saída: 1 se
+    algum comando falhar.
+    '''
+
+    with args.batch as file:
+        commands = read_batch_commands(file)
+
+    client = BatchClient(args.host, args.port, args.connections, args.pipeline)
+
+    start = perf_counter()
+    try:
+        results = client.run(commands)
+    except OSError as error:
+        print(f'Não foi possível conectar ao servidor: {error}', file=stderr)
+        return 1
+    elapsed = perf_counter() - start
+
+    for result in results:
+        print(result.to_json())
+
+    print(summarize_results(results, elapsed), file=stderr)
+
+    return int(any(result.code for result in results))
+
+
 if __name__ == '__main__':
+    args = parse_arguments()
+
+    if args.batch is not None:
+        exit(run_batch(args))
+
     print('Inicializando o client...')
 
-    client = Client('localhost', 5000)
+    client = Client(args.host, args.port)
     client.start()
@@ -1,32 +1,76 @@
+from itertools import islice
+from json import dumps
+from time import perf_counter
 from types import FunctionType
-from typing import Dict, List
-from json import dumps, loads
+from typing import Dict, List, Optional
 from os import system
 
 from command_response_type import CommandResponseType, DatabaseTableType
-from models import User, Rule
+from firewall import get_address_actions, get_firewall
+from hashing import HasherBusyError
+from metrics import get_metrics
+from models import RuleImport, User, Rule
+from protocol import FramedConnection, ResponseData, get_available_encodings
+from rule_index import (
+    CONFLICT, OVERLAP, SHADOWED, find_rule_conflicts, get_rule_range,
+    normalize_network
+)
+from session import Session, get_session_manager
+from storage import DuplicateRecordError, get_storage
+from tracing import get_tracer
+
+BUSY_MESSAGE = 'Servidor ocupado, tente novamente em instantes!'
+RULE_ACTIONS = ('ACCEPT', 'DENY')
+IMPORT_CHUNK_LINES = 1000
+IMPORT_RULE_LIMIT = 200000
+IMPORT_ERROR_LIMIT = 20
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Maior quantidade de requisições (ou de segundos) de um "admin profile".
+MAX_PROFILE_LENGTH = 3600
+# Campos de cada linha das páginas de listagem estruturadas, enviados uma
+# única vez por página em vez de repetidos em cada registro.
+USER_FIELDS = ('id', 'name', 'email')
+RULE_FIELDS = ('id', 'ip', 'action')
+
+
+def format_response_data(data):
+    '''
+    Formata para exibição os dados de uma resposta estruturada.
+    '''
+
+    return dumps(data, ensure_ascii=False, indent=2)
+
+
+class RequestContext:
+    '''
+    Dados de uma requisição: os argumentos após o nome do comando e a
+    sessão da conexão que a enviou. Os comandos são compartilhados entre
+    as conexões e guardam o estado de cada requisição somente aqui.
+    '''
 
-IFACE_LAN = 'enp0s8'
-IFACE_WAN = 'enp0s3'
-USER_LOGGED_IN = None
-
-
-class Command:
-    name: str
     command_line: str
-
-    def check(self, command_line: str):
+    args: List[str]
+    session: Optional[Session]
+    connection: Optional[FramedConnection]
+
+    def __init__(
+        self,
+        command_line: str,
+        args: List[str],
+        session: Session = None,
+        connection: FramedConnection = None
+    ):
         self.command_line = command_line
+        self.args = args
+        self.session = session
+        self.connection = connection
 
-        return command_line.startswith(self.name)
-
-    def get_args(self):
-        if not self.command_line:
-            return []
 
-        return self.command_line.strip().split(" ")[1:]
+class Command:
+    name: str
 
-    def run(self):
+    def run(self, context: RequestContext):
         return CommandResponseType.OK
 
 
@@ -46,25 +90,52 @@ class HelpCommand(Command):
             "$ user login <email> <senha>\n",
             "- Sair de conta cadastrada em servidor:",
             "$ user logout\n",
-            "- Listar todos usuários:",
-            "$ user list all\n",
+            "- Retomar sessão a partir do token recebido no login:",
+            "$ user resume <token>\n",
+            "- Listar usuários, uma página por vez (filtro por trecho do e-mail):",
+            "$ user list [all] [limit=<n>] [cursor=<c>] [email=<trecho>]\n",
             "- Remover usuário:",
             "$ user remove <email ou ID>\n",
             "- Criar nova regra de firewall:",
             "$ rule add <ip address> <action>, action deve ser ACCEPT ou DENY\n",
-            "- Listar regras do firewall:",
-            "$ rule list all\n",
+            "  O endereço pode ser uma rede (ex.: 10.0.0.0/24); em sobreposições",
+            "  vale a regra mais específica.\n",
+            "- Listar regras do firewall, uma página por vez "
+            "(filtro por rede e ação):",
+            "$ rule list [all] [limit=<n>] [cursor=<c>] "
+            "[address=<rede>] [action=<action>]\n",
             "- Remover regras do firewall:",
             "$ rule remove <ID>\n",
+            "- Importar regras de um arquivo com linhas <ip address>,<action>:",
+            "$ upload <arquivo>\n",
+            "- Apontar regras redundantes ou conflitantes",
+            "  (all inclui as regras de outros usuários):",
+            "$ rule lint [all]\n",
             "- Aplicar regras do firewall",
             "$ firewall start\n",
+            "- Aplicar somente as regras alteradas desde o último start",
+            "$ firewall sync\n",
+            "- Recarregar os scripts do firewall",
+            "$ firewall reload\n",
             "- Remover regras do firewall",
-            "$ firewall stop"
+            "$ firewall stop\n",
+            "- Codificação das respostas (json/msgpack enviam somente os dados):",
+            "$ encoding <text|json|msgpack>\n",
+            "Comandos admin: somente para os e-mails passados ao servidor "
+            "com --admin.",
+            "- Mostrar métricas do servidor "
+            "(requisições, banco de dados e firewall):",
+            "$ admin stats\n",
+            "- Perfilar as próximas N requisições ou as dos próximos N segundos:",
+            "$ admin profile <N|Ns|stop>\n",
+            "- Registrar no log os trechos das requisições mais lentas "
+            "que o limite:",
+            "$ admin trace [<ms>|off]"
         ]
 
         return '\n'.join(help_text_lines)
 
-    def run(self):
+    def run(self, context: RequestContext):
         content = self.get_help_text()
         print(content)
 
@@ -74,7 +145,7 @@ class HelpCommand(Command):
 class ClearCommand(Command):
     name = "clear"
 
-    def run(self):
+    def run(self, context: RequestContext):
         system('clear')
         return CommandResponseType.OK
 
@@ -82,52 +153,147 @@ class ClearCommand(Command):
 class ExitCommand(Command):
     name = "exit"
 
-    def run(self):
+    def run(self, context: RequestContext):
         return CommandResponseType.STOP
 
 
+class UploadCommand(Command):
+    '''
+    Envia um arquivo de regras ao servidor em blocos de linhas, por meio
+    de "rule import begin", "rule import data" e "rule import commit", sem
+    carregar o arquivo inteiro em memória.
+    '''
+
+    name = "upload"
+
+    def request(self, connection: FramedConnection, command_line: str):
+        request_id = connection.send(command_line)
+        response = connection.receive_response(request_id)
+
+        if response is None:
+            return (CommandResponseType.ERROR, 'Resposta inválida do servidor!')
+
+        if 'data' in response:
+            return (int(response['code']), format_response_data(response['data']))
+
+        return (int(response['code']), response['message'])
+
+    def upload(self, connection: FramedConnection, file):
+        code, message = self.request(connection, 'rule import begin')
+
+        if code != CommandResponseType.OK:
+            return (code, message)
+
+        while True:
+            lines = list(islice(file, IMPORT_CHUNK_LINES))
+
+            if not lines:
+                break
+
+            code, message = self.request(
+                connection,
+                'rule import data\n' + ''.join(lines)
+            )
+
+            if code != CommandResponseType.OK:
+                self.request(connection, 'rule import abort')
+                return (code, message)
+
+            if message:
+                print(message)
+
+        return self.request(connection, 'rule import commit')
+
+    def run(self, context: RequestContext):
+        if len(context.args) != 1:
+            print('Número de argumentos inválido!')
+            return CommandResponseType.ERROR
+
+        try:
+            file = open(file=context.args[0], mode='r', encoding='utf8')
+        except OSError:
+            print('Não foi possível abrir o arquivo!')
+            return CommandResponseType.ERROR
+
+        with file:
+            code, message = self.upload(context.connection, file)
+
+        print(message)
+        return code
+
+
 class DatabaseCommand(Command):
-    database_name = 'database.json'
     available_actions: Dict[str, FunctionType]
 
-    def get_database_content(self):
+    @property
+    def storage(self):
+        return get_storage()
+
+    def get_table_from_database(self, table: DatabaseTableType):
         '''
-        Abre o arquivo de banco de dados e retorna uma string contendo o
-        que foi salvo.
+        Retorna uma tabela do banco de dados mantido em memória.
         '''
 
-        with open(file=self.database_name, mode='r') as file:
-            content = '\n'.join(file.readlines())
-            return content
+        return self.storage.get_table(table)
 
-    def get_table_from_database(self, table: DatabaseTableType):
+    def apply_rule_changes(self, user_id: str, added=(), removed=()):
         '''
-        Retorna uma tabela do banco de dados.
+        Com a aplicação automática habilitada, envia ao firewall as regras
+        incluídas/removidas se o usuário for o dono das regras aplicadas.
         '''
 
-        content = self.get_database_content()
-        available_tables = {
-            DatabaseTableType.USER: "users",
-            DatabaseTableType.RULE: "rules"
-        }
+        firewall = get_firewall()
 
-        selected_table = available_tables.get(table)
-        if not selected_table:
-            return None
+        if not (firewall.auto_apply and firewall.owner_id == user_id):
+            return True
+
+        return firewall.apply_changes(
+            get_address_actions(dict(added)),
+            get_address_actions(dict(removed))
+        )
+
+    def parse_list_options(self, args: List[str], allowed: List[str]):
+        '''
+        Lê as opções "chave=valor" dos comandos de listagem. O sinalizador
+        "all" no início é aceito por compatibilidade. Lança ValueError com
+        a descrição do erro se alguma opção for inválida.
+        '''
+
+        if args and args[0] == 'all':
+            args = args[1:]
+
+        options = {}
 
-        return loads(content).get(selected_table)
+        for arg in args:
+            key, separator, value = arg.partition('=')
+
+            if not (separator and value) or key not in ('limit', 'cursor', *allowed):
+                raise ValueError(f'Opção inválida: {arg}!')
+
+            options[key] = value
+
+        limit = options.get('limit', str(DEFAULT_PAGE_SIZE))
+
+        if not (limit.isdigit() and 1 <= int(limit) <= MAX_PAGE_SIZE):
+            raise ValueError(f'O limite deve estar entre 1 e {MAX_PAGE_SIZE}!')
+
+        options['limit'] = int(limit)
+        return options
+
+    def format_page(self, content: str, next_cursor: Optional[str]):
+        if next_cursor is None:
+            return content
+
+        return f'{content}\nPróxima página: cursor={next_cursor}'
 
     def save_dict_to_database(self, database_dict):
         '''
-        Salva um objeto representando o novo estado do banco de dados no
-        arquivo .json.
+        Substitui o estado do banco de dados pelo objeto passado.
         '''
 
-        with open(file=self.database_name, mode='w') as file:
-            content_json = dumps(database_dict, indent=2)
-            file.write(content_json)
+        self.storage.replace(database_dict)
 
-    def run(self):
+    def run(self, context: RequestContext):
         '''
         Método principal para realizar operações relacionadas ao banco de
         dados. (Usuário/Regras)
@@ -135,7 +301,7 @@ class DatabaseCommand(Command):
 
         code = CommandResponseType.ERROR
 
-        args = self.get_args()
+        args = context.args
         if not (args and len(args) >= 1):
             message = "Não há argumentos suficientes!"
             return (code, message)
@@ -147,7 +313,7 @@ class DatabaseCommand(Command):
             return (code, message)
 
         selected_action = self.available_actions[command_action]
-        return selected_action(args)
+        return selected_action(context)
 
 
 class UserCommand(DatabaseCommand):
@@ -159,7 +325,8 @@ class UserCommand(DatabaseCommand):
             'list': self.list_users,
             'remove': self.remove_user,
             'login': self.login_user,
-            'logout': self.logout_user
+            'logout': self.logout_user,
+            'resume': self.resume_session
         }
 
     def check_if_unique_user_in_database(self, user: User):
@@ -167,40 +334,30 @@ class UserCommand(DatabaseCommand):
         Verifica se um usuário já foi cadastrado com o e-mail passado.
         '''
 
-        users = self.get_table_from_database(DatabaseTableType.USER)
-
-        for id in users:
-            usr = users[id]
-            email = usr['email']
-
-            if email == user.email:
-                return False
-
-        return True
+        return self.storage.find_user_by_email(user.email) is None
 
     def add_user_to_database(self, user: User):
         '''
-        Abre o arquivo .json de banco de dados e atualiza a seção de 'users'
-        com o novo usuário.
+        Adiciona o novo usuário à seção de 'users' do banco de dados.
         '''
 
         code = CommandResponseType.ERROR
 
-        db = {}
-
-        content = self.get_database_content()
-        db.update(loads(content))
+        message = 'Usuário já cadastrado com este e-mail!'
 
         if not self.check_if_unique_user_in_database(user):
-            message = 'Usuário já cadastrado com este e-mail!'
             return (code, message)
 
-        db['users'].update({user.id: user.get()})
-
-        self.save_dict_to_database(db)
+        try:
+            self.storage.insert_record(DatabaseTableType.USER, user.id, user.get())
+        except DuplicateRecordError:
+            return (code, message)
 
         code = CommandResponseType.OK
-        message = 'Usuário criado com sucesso!'
+        message = ResponseData(
+            {'id': user.id, 'name': user.name, 'email': user.email},
+            lambda data: 'Usuário criado com sucesso!'
+        )
 
         return (code, message)
 
@@ -219,23 +376,46 @@ class UserCommand(DatabaseCommand):
                 users
             ))
 
-    def get_users_from_database(self):
+    def format_user_page(self, page: dict):
+        users = {
+            id: {'name': name, 'email': email}
+            for id, name, email in page['users']
+        }
+        return self.format_page(
+            self.parse_user_list_as_string(users), page['next_cursor']
+        )
+
+    def get_users_from_database(
+        self,
+        limit: int,
+        after: str = None,
+        email: str = None
+    ):
         '''
-        Retorna usuários no banco de dados na seção 'users'.
+        Retorna uma página de usuários do banco de dados e o cursor da
+        próxima página (o e-mail do último usuário), se houver.
         '''
 
-        users = self.get_table_from_database(DatabaseTableType.USER)
+        users = self.storage.list_users(limit + 1, after, email)
+        next_cursor = None
 
-        if not users:
-            return None
+        if len(users) > limit:
+            users = users[:limit]
+            next_cursor = users[-1][1]['email']
 
-        return self.parse_user_list_as_string(users)
+        return {
+            'fields': USER_FIELDS,
+            'users': [(id, user['name'], user['email']) for id, user in users],
+            'next_cursor': next_cursor
+        }
 
-    def create_user(self, args: List[str]):
+    def create_user(self, context: RequestContext):
         '''
         Método principal chamado para adicionar um usuário no banco de dados.
         '''
 
+        args = context.args
+
         code = CommandResponseType.ERROR
 
         if len(args) < 3:
@@ -245,60 +425,65 @@ class UserCommand(DatabaseCommand):
         password = args.pop()
         email = args.pop()
         name = ' '.join(args)
-        user = User(name, email, password)
+
+        try:
+            user = User(name, email, password)
+        except HasherBusyError:
+            return (code, BUSY_MESSAGE)
 
         return self.add_user_to_database(user)
 
-    def list_users(self, args: List[str]):
+    def list_users(self, context: RequestContext):
         '''
         Método principal chamado para listar usuários no banco de dados.
         '''
 
-        code = CommandResponseType.ERROR
+        args = context.args
 
-        if len(args) != 1:
-            message = "Número de argumentos inválido!"
-            return (code, message)
+        code = CommandResponseType.ERROR
 
-        flag = args.pop()
-        if flag != 'all':
-            message = "Sinalizador inválido!"
-            return (code, message)
+        try:
+            options = self.parse_list_options(args, ['email'])
+        except ValueError as error:
+            return (code, str(error))
 
-        users = self.get_users_from_database()
-        if users is None:
-            message = "Não foi possível obter usuários do banco de dados!"
-            return (code, message)
+        page = self.get_users_from_database(
+            options['limit'],
+            options.get('cursor'),
+            options.get('email')
+        )
 
         code = CommandResponseType.OK
-        return (code, users)
+        return (code, ResponseData(page, self.format_user_page))
 
     def check_if_user_exists(self, email: str, password: str):
         '''
-        Verifica se um usuário existe no banco de dados.
+        Verifica se um usuário existe no banco de dados. O usuário é
+        localizado pelo índice de e-mail e apenas o seu hash é verificado;
+        para e-mails desconhecidos a verificação é feita contra um hash
+        fictício, para que a resposta leve o mesmo tempo nos dois casos.
         '''
 
-        users = self.get_table_from_database(DatabaseTableType.USER)
+        result = self.storage.find_user_by_email(email)
 
-        for id in users:
-            usr = users[id]
-
-            same_email = email == usr['email']
-            same_password = User.check_password(password, usr['password'])
+        if not result:
+            User.check_password(password, User.get_dummy_password_hash())
+            return False
 
-            validation = same_email and same_password
+        id, usr = result
 
-            if validation:
-                result = User.new_from_dict(id, usr)
-                return result
+        if not User.check_password(password, usr['password']):
+            return False
 
-        return False
+        return User.new_from_dict(id, usr)
 
-    def remove_user(self, args: List[str]):
+    def remove_user(self, context: RequestContext):
         '''
         Método principal chamado para remover um usuário do banco de dados.
         '''
 
+        args = context.args
+
         code = CommandResponseType.ERROR
 
         if len(args) != 1:
@@ -307,81 +492,113 @@ class UserCommand(DatabaseCommand):
 
         email_or_id = args.pop()
 
-        content = self.get_database_content()
-        database = loads(content)
-        user_list = database.get("users")
-
-        for user_id in user_list:
-            user = user_list[user_id]
-
-            if email_or_id in [user_id, user.get("email")]:
+        if self.storage.get_record(DatabaseTableType.USER, email_or_id):
+            user_id = email_or_id
+        else:
+            result = self.storage.find_user_by_email(email_or_id)
 
-                if USER_LOGGED_IN:
-                    logged_user_id = USER_LOGGED_IN.id
-                    if user_id == logged_user_id:
-                        message = 'Não é possível remover um usuário logado!'
-                        return (code, message)
+            if not result:
+                message = "Usuário não encontrado!"
+                return (code, message)
 
-                user_list.pop(user_id)
+            user_id = result[0]
 
-                database['users'] = user_list
+        if get_session_manager().is_user_logged_in(user_id):
+            message = 'Não é possível remover um usuário logado!'
+            return (code, message)
 
-                self.save_dict_to_database(database)
+        self.storage.remove_record(DatabaseTableType.USER, user_id)
 
-                code = CommandResponseType.OK
-                message = "Usuário removido com sucesso!"
-                return (code, message)
-
-        message = "Usuário não encontrado!"
+        code = CommandResponseType.OK
+        message = "Usuário removido com sucesso!"
         return (code, message)
 
-    def login_user(self, args: List[str]):
+    def login_user(self, context: RequestContext):
         '''
         Realiza o login de usuário após esse fornecer o email e senha corretos.
         '''
 
-        global USER_LOGGED_IN
+        args = context.args
+
         code = CommandResponseType.ERROR
 
         if len(args) != 2:
             message = "Número de argumentos inválido!"
             return (code, message)
 
-        if USER_LOGGED_IN:
+        if context.session.user:
             message = 'Usuário já logado!'
             return (code, message)
 
         email, password = args
-        result = self.check_if_user_exists(email, password)
+
+        try:
+            result = self.check_if_user_exists(email, password)
+        except HasherBusyError:
+            return (code, BUSY_MESSAGE)
 
         if not result:
             message = 'E-mail ou senha inválidos!'
             return (code, message)
 
-        USER_LOGGED_IN = result
+        get_session_manager().login(context.session, result)
+
+        code = CommandResponseType.OK
+        message = ResponseData(
+            {'user_id': result.id, 'token': context.session.token},
+            lambda data: 'Login realizado com sucesso!\n' +
+            f'Token de sessão: {data["token"]}'
+        )
+
+        return (code, message)
+
+    def resume_session(self, context: RequestContext):
+        '''
+        Retoma uma sessão aberta anteriormente, a partir do token recebido
+        no login.
+        '''
+
+        args = context.args
+
+        code = CommandResponseType.ERROR
+
+        if len(args) != 1:
+            message = "Número de argumentos inválido!"
+            return (code, message)
+
+        if context.session.user:
+            message = 'Usuário já logado!'
+            return (code, message)
+
+        token = args.pop()
+
+        if not get_session_manager().resume(context.session, token):
+            message = 'Sessão inválida ou expirada!'
+            return (code, message)
 
         code = CommandResponseType.OK
-        message = 'Login realizado com sucesso!'
+        message = 'Sessão retomada com sucesso!'
 
         return (code, message)
 
-    def logout_user(self, args: List[str]):
+    def logout_user(self, context: RequestContext):
         '''
         Desloga um usuário de sua conta.
         '''
 
-        global USER_LOGGED_IN
+        args = context.args
+
         code = CommandResponseType.ERROR
 
         if args:
             message = 'Quantia de argumentos inválidos!'
             return (code, message)
 
-        if not USER_LOGGED_IN:
+        if not context.session.user:
             message = 'Usuário não está logado!'
             return (code, message)
 
-        USER_LOGGED_IN = None
+        get_session_manager().logout(context.session)
 
         code = CommandResponseType.OK
         message = 'Logout realizado com sucesso!'
@@ -397,51 +614,128 @@ class RuleCommand(DatabaseCommand):
             'add': self.add_rule,
             'list': self.list_rules,
             'remove': self.remove_rule,
+            'import': self.import_rules,
+            'lint': self.lint_rules,
+        }
+        self.import_actions = {
+            'begin': self.begin_import,
+            'data': self.stage_import,
+            'commit': self.commit_import,
+            'abort': self.abort_import,
         }
 
-    def check_if_unique_rule_in_database(self, rule: Rule):
-        rules = self.get_table_from_database(DatabaseTableType.RULE)
-        user_id = USER_LOGGED_IN.id
-
-        for id in rules:
-            r = rules[id]
-
-            if r['user_id'] != user_id:
-                continue
-
-            address = r['ip']
+    def normalize_address(self, address: str):
+        '''
+        Retorna o endereço no formato em que é gravado nas regras, ou o
+        próprio texto se ele não for um endereço válido.
+        '''
 
-            if address == rule.ip:
-                return False
+        try:
+            return normalize_network(address)
+        except ValueError:
+            return address
 
-        return True
+    def check_if_unique_rule_in_database(self, rule: Rule):
+        result = self.storage.find_rule_by_address(rule.user_id, rule.ip)
+        return result is None
 
     def add_rule_to_database(self, rule: Rule):
         '''
-        Abre o arquivo .json de banco de dados e atualiza a seção de 'rules'
-        com a nova regra.
+        Adiciona a nova regra à seção de 'rules' do banco de dados.
         '''
 
         code = CommandResponseType.ERROR
 
-        content = self.get_database_content()
-        db = loads(content)
+        message = 'Já existe uma regra para este endereço!'
 
         if not self.check_if_unique_rule_in_database(rule):
-            message = 'Já existe uma regra para este endereço!'
             return (code, message)
 
-        db['rules'].update({rule.id: rule.get()})
-        self.save_dict_to_database(db)
+        overlapping = self.storage.find_overlapping_rules(rule.ip)
+
+        try:
+            self.storage.insert_record(DatabaseTableType.RULE, rule.id, rule.get())
+        except DuplicateRecordError:
+            return (code, message)
 
         code = CommandResponseType.OK
+        result = {
+            'id': rule.id,
+            'ip': rule.ip,
+            'action': rule.action,
+            'warnings': self.get_overlap_warnings(rule, overlapping),
+            'applied': self.apply_rule_changes(
+                rule.user_id, added=[(rule.id, rule.get())]
+            )
+        }
+
+        return (code, ResponseData(result, self.format_rule_created))
+
+    def format_rule_created(self, result: dict):
         message = 'Regra criada com sucesso!'
 
-        return (code, message)
+        if result['warnings']:
+            message += '\n' + '\n'.join(result['warnings'])
+
+        if not result['applied']:
+            message += '\nNão foi possível aplicar a regra no firewall!'
 
-    def parse_rule_list_as_string(self, rules: Dict[str, str]):
+        return message
+
+    def describe_rule(self, rule: dict):
+        return f'{rule["ip"]} {rule["action"]}'
+
+    def get_overlap_warnings(self, rule: Rule, overlapping: Dict[str, dict]):
+        '''
+        Descreve como a nova regra se relaciona com as regras que a contêm
+        ou que estão contidas nela, do próprio usuário ou de outros.
         '''
-        Retorna uma lista de regras do banco de dados formatada para
+
+        rules = {**overlapping, rule.id: rule.get()}
+        contained = {SHADOWED: 0, CONFLICT: 0, OVERLAP: 0}
+        warnings = []
+
+        for kind, id, other_id in find_rule_conflicts(rules):
+            if other_id == rule.id:
+                contained[kind] += 1
+            elif id == rule.id and kind == SHADOWED:
+                other = self.describe_rule(rules[other_id])
+                warnings.append(
+                    f'Aviso: a regra é redundante, já coberta por {other}.'
+                )
+            elif id == rule.id and kind == CONFLICT:
+                other = self.describe_rule(rules[other_id])
+                warnings.append(f'Aviso: a regra é uma exceção a {other}.')
+            elif id == rule.id and kind == OVERLAP:
+                other = rules[other_id]
+                warnings.append(
+                    f'Aviso: a regra está contida em {self.describe_rule(other)} ' +
+                    f'do usuário {other["user_id"]}.'
+                )
+
+        if contained[SHADOWED]:
+            warnings.append(
+                f'Aviso: a regra torna redundante(s) {contained[SHADOWED]} regra(s) '
+                'com a mesma ação.'
+            )
+
+        if contained[CONFLICT]:
+            warnings.append(
+                f'Aviso: a regra contém {contained[CONFLICT]} regra(s) com ação '
+                'diferente, que continuam valendo como exceções.'
+            )
+
+        if contained[OVERLAP]:
+            warnings.append(
+                f'Aviso: a regra contém {contained[OVERLAP]} regra(s) de outros '
+                'usuários.'
+            )
+
+        return warnings
+
+    def parse_rule_list_as_string(self, rules: List[tuple]):
+        '''
+        Retorna uma lista de regras (id, endereço, ação) formatada para
         leitura pelo usuário.
         '''
 
@@ -449,44 +743,68 @@ class RuleCommand(DatabaseCommand):
             '\n'.join(map(
                 lambda x:
                 f'ID: {x[0]}\n' +
-                f'Endereço IP: {x[1]["ip"]}\n' +
-                f'Ação: {x[1]["action"]}\n',
+                f'Endereço IP: {x[1]}\n' +
+                f'Ação: {x[2]}\n',
                 rules
             ))
 
-    def get_rules_by_user_id(self, user_id):
-        rules = self.get_table_from_database(DatabaseTableType.RULE)
+    def format_rule_page(self, page: dict):
+        return self.format_page(
+            self.parse_rule_list_as_string(page['rules']), page['next_cursor']
+        )
 
-        if not rules:
-            rules = {}
+    def encode_cursor(self, id: str, rule: dict):
+        return f'{get_rule_range(rule["ip"])[0]}:{id}'
 
-        available_rule_ids = list(
-            filter(
-                lambda x: rules[x]['user_id'] == user_id,
-                rules
-            )
-        )
+    def decode_cursor(self, cursor: str):
+        '''
+        Retorna a posição (início da faixa, id) codificada no cursor, ou
+        None se o cursor for inválido.
+        '''
+
+        start, separator, id = cursor.partition(':')
 
-        result = [[i, rules[i]] for i in available_rule_ids]
+        if not separator:
+            return None
 
-        return self.parse_rule_list_as_string(result)
+        try:
+            return int(start), id
+        except ValueError:
+            return None
 
-    def get_rules_from_database(self):
+    def get_rules_from_database(
+        self,
+        user_id: str,
+        limit: int,
+        after=None,
+        network: str = None,
+        action: str = None
+    ):
         '''
-        Retorna as regras do banco de dados na seção 'rules'.
+        Retorna uma página das regras do usuário no banco de dados e o
+        cursor da próxima página, se houver.
         '''
 
-        user_id = USER_LOGGED_IN.id
+        rules = self.storage.list_rules(user_id, limit + 1, after, network, action)
+        next_cursor = None
 
-        rules = self.get_rules_by_user_id(user_id)
+        if len(rules) > limit:
+            rules = rules[:limit]
+            next_cursor = self.encode_cursor(*rules[-1])
 
-        return rules
+        return {
+            'fields': RULE_FIELDS,
+            'rules': [(id, rule['ip'], rule['action']) for id, rule in rules],
+            'next_cursor': next_cursor
+        }
 
-    def add_rule(self, args: List[str]):
+    def add_rule(self, context: RequestContext):
         '''
         Método principal chamado para adicionar uma regra no banco de dados.
         '''
 
+        args = context.args
+
         code = CommandResponseType.ERROR
 
         if len(args) != 2:
@@ -494,272 +812,868 @@ class RuleCommand(DatabaseCommand):
             return (code, message)
 
         ip, action = args
-        available_actions = ["ACCEPT", "DENY"]
 
-        if action not in available_actions:
+        if action not in RULE_ACTIONS:
             message = "Ação inválida!"
             return (code, message)
 
-        if not USER_LOGGED_IN:
+        try:
+            ip = normalize_network(ip)
+        except ValueError:
+            message = "Endereço IP inválido!"
+            return (code, message)
+
+        if not context.session.user:
             message = "É preciso estar logado para definir regras no iptables!"
             return (code, message)
 
-        id = USER_LOGGED_IN.id
+        id = context.session.user.id
         rule = Rule(id, ip, action)
 
         return self.add_rule_to_database(rule)
 
-    def list_rules(self, args: List[str]):
+    def parse_import_line(self, line: str):
         '''
-        Método principal chamado para listar regras no banco de dados.
+        Converte uma linha "<ip address>,<action>" em (endereço, ação).
+        Lança ValueError com a descrição do erro se a linha for inválida.
+        '''
+
+        fields = [field.strip() for field in line.split(',')]
+
+        if len(fields) != 2:
+            raise ValueError('formato inválido, esperado <ip address>,<action>')
+
+        address, action = fields
+
+        try:
+            address = normalize_network(address)
+        except ValueError:
+            raise ValueError(f'endereço IP inválido "{address}"') from None
+
+        if action not in RULE_ACTIONS:
+            raise ValueError(f'ação inválida "{action}"')
+
+        return address, action
+
+    def format_import_errors(self, errors: List[str]):
+        message = '\n'.join(errors[:IMPORT_ERROR_LIMIT])
+
+        if len(errors) > IMPORT_ERROR_LIMIT:
+            message += f'\n... e mais {len(errors) - IMPORT_ERROR_LIMIT} erro(s).'
+
+        return message
+
+    def begin_import(self, context: RequestContext):
+        '''
+        Inicia uma importação, carregando uma única vez os endereços já
+        cadastrados pelo usuário para a verificação de duplicatas.
+        '''
+
+        user_id = context.session.user.id
+        existing_addresses = {
+            rule['ip'] for rule in self.storage.get_rules_by_user_id(user_id).values()
+        }
+
+        context.session.rule_import = RuleImport(user_id, existing_addresses)
+
+        code = CommandResponseType.OK
+        message = 'Importação iniciada!'
+        return (code, message)
+
+    def stage_import(self, context: RequestContext):
+        '''
+        Valida um bloco de linhas do arquivo e guarda as regras válidas na
+        sessão até o commit. Retorna os erros encontrados no bloco.
         '''
 
+        rule_import = context.session.rule_import
+        _, _, data = context.command_line.partition('\n')
+        errors = []
+
+        for line in data.splitlines():
+            rule_import.line_count += 1
+            line_number = rule_import.line_count
+            line = line.strip()
+
+            if not line or line.startswith('#'):
+                continue
+
+            try:
+                address, action = self.parse_import_line(line)
+            except ValueError as error:
+                errors.append(f'Linha {line_number}: {error}')
+                continue
+
+            if address in rule_import.existing_addresses:
+                errors.append(
+                    f'Linha {line_number}: já existe uma regra para {address}'
+                )
+            elif address in rule_import.rules:
+                first_line = rule_import.rules[address][0]
+                errors.append(
+                    f'Linha {line_number}: {address} repetido da linha {first_line}'
+                )
+            elif len(rule_import.rules) >= IMPORT_RULE_LIMIT:
+                errors.append(
+                    f'Linha {line_number}: limite de {IMPORT_RULE_LIMIT} regras '
+                    'atingido'
+                )
+            else:
+                rule_import.rules[address] = (line_number, action)
+
+        rule_import.error_count += len(errors)
+
+        code = CommandResponseType.OK
+        return (code, ResponseData(errors, self.format_import_errors))
+
+    def commit_import(self, context: RequestContext):
+        '''
+        Grava todas as regras recebidas em uma única transação.
+        '''
+
+        rule_import = context.session.rule_import
+        context.session.rule_import = None
+
+        rows = [
+            (rule.id, rule.get())
+            for rule in (
+                Rule(rule_import.user_id, address, action)
+                for address, (_, action) in rule_import.rules.items()
+            )
+        ]
+
         code = CommandResponseType.ERROR
 
-        if len(args) != 1:
+        try:
+            self.storage.insert_records(DatabaseTableType.RULE, rows)
+        except DuplicateRecordError:
+            message = (
+                'Regras alteradas durante a importação, '
+                'nenhuma regra foi importada!'
+            )
+            return (code, message)
+
+        rules = self.storage.get_rules_by_user_id(rule_import.user_id)
+
+        code = CommandResponseType.OK
+        result = {
+            'imported': len(rows),
+            'error_lines': rule_import.error_count,
+            'conflicts': len(find_rule_conflicts(rules)),
+            'applied': self.apply_rule_changes(rule_import.user_id, added=rows)
+        }
+
+        return (code, ResponseData(result, self.format_import_result))
+
+    def format_import_result(self, result: dict):
+        message = f'{result["imported"]} regra(s) importada(s), ' + \
+            f'{result["error_lines"]} linha(s) com erro.'
+
+        if result['conflicts']:
+            message += (
+                f'\n{result["conflicts"]} regra(s) redundante(s) ou '
+                'conflitante(s), veja "rule lint".'
+            )
+
+        if not result['applied']:
+            message += '\nNão foi possível aplicar as regras no firewall!'
+
+        return message
+
+    def abort_import(self, context: RequestContext):
+        context.session.rule_import = None
+
+        code = CommandResponseType.OK
+        message = 'Importação cancelada!'
+        return (code, message)
+
+    def import_rules(self, context: RequestContext):
+        '''
+        Método principal chamado para importar regras em lote. O client
+        envia "begin", blocos de linhas com "data" e por fim "commit".
+        '''
+
+        args = context.args
+
+        code = CommandResponseType.ERROR
+
+        if not args:
             message = "Número de argumentos inválido!"
             return (code, message)
 
-        flag = args.pop()
-        if flag != 'all':
+        action = args[0]
+        if action not in self.import_actions:
+            message = "Ação inválida!"
+            return (code, message)
+
+        if not context.session.user:
+            message = "É preciso estar logado para definir regras no iptables!"
+            return (code, message)
+
+        rule_import = context.session.rule_import
+
+        if action != 'begin' and not (
+            rule_import and rule_import.user_id == context.session.user.id
+        ):
+            message = "Nenhuma importação em andamento!"
+            return (code, message)
+
+        return self.import_actions[action](context)
+
+    def lint_rules(self, context: RequestContext):
+        '''
+        Método principal chamado para apontar regras redundantes ou
+        conflitantes, do usuário ou de toda a tabela.
+        '''
+
+        args = context.args
+
+        code = CommandResponseType.ERROR
+
+        if len(args) > 1 or (args and args[0] != 'all'):
             message = "Sinalizador inválido!"
             return (code, message)
 
-        if not USER_LOGGED_IN:
+        if not context.session.user:
             message = 'É necessário estar logado para ver regras do iptables!'
             return (code, message)
 
-        rules = self.get_rules_from_database()
-        if rules is None:
-            message = "Não foi possível obter regras do banco de dados!"
+        user_id = context.session.user.id
+
+        if args:
+            rules = self.get_table_from_database(DatabaseTableType.RULE)
+        else:
+            rules = self.storage.get_rules_by_user_id(user_id)
+
+        findings = [
+            {
+                'kind': kind,
+                'rule': {'id': id, **rules[id]},
+                'other': {'id': other_id, **rules[other_id]}
+            }
+            for kind, id, other_id in find_rule_conflicts(rules)
+        ]
+
+        code = CommandResponseType.OK
+        return (code, ResponseData(
+            findings,
+            lambda findings: self.format_lint_findings(findings, user_id)
+        ))
+
+    def format_lint_findings(self, findings: List[dict], user_id: str):
+        if not findings:
+            return 'Nenhuma regra redundante ou conflitante encontrada!'
+
+        lines = []
+
+        for finding in findings:
+            rule, other = finding['rule'], finding['other']
+
+            if finding['kind'] == SHADOWED:
+                description = (
+                    f'redundante, já coberta por {self.describe_rule(other)}'
+                )
+            elif finding['kind'] == CONFLICT:
+                description = f'exceção a {self.describe_rule(other)}'
+            else:
+                description = f'sobrepõe {self.describe_rule(other)} ' + \
+                    f'do usuário {other["user_id"]}'
+
+            owner = ''
+
+            if rule['user_id'] != user_id:
+                owner = f' (usuário {rule["user_id"]})'
+
+            lines.append(f'{self.describe_rule(rule)}{owner}: {description}')
+
+        return f'{len(lines)} ocorrência(s) encontrada(s):\n' + '\n'.join(lines)
+
+    def list_rules(self, context: RequestContext):
+        '''
+        Método principal chamado para listar regras no banco de dados.
+        '''
+
+        args = context.args
+
+        code = CommandResponseType.ERROR
+
+        try:
+            options = self.parse_list_options(args, ['address', 'action'])
+        except ValueError as error:
+            message = str(error)
             return (code, message)
 
+        after = options.get('cursor')
+        if after is not None:
+            after = self.decode_cursor(after)
+
+            if after is None:
+                message = "Cursor inválido!"
+                return (code, message)
+
+        network = options.get('address')
+        if network is not None:
+            try:
+                network = normalize_network(network)
+            except ValueError:
+                message = "Endereço IP inválido!"
+                return (code, message)
+
+        action = options.get('action')
+        if action is not None and action not in RULE_ACTIONS:
+            message = "Ação inválida!"
+            return (code, message)
+
+        if not context.session.user:
+            message = 'É necessário estar logado para ver regras do iptables!'
+            return (code, message)
+
+        page = self.get_rules_from_database(
+            context.session.user.id,
+            options['limit'],
+            after,
+            network,
+            action
+        )
+
         code = CommandResponseType.OK
-        return (code, rules)
+        return (code, ResponseData(page, self.format_rule_page))
 
-    def remove_rule(self, args: List[str]):
+    def remove_rule(self, context: RequestContext):
         '''
         Método principal chamado para remover uma regra do banco de dados.
         '''
 
+        args = context.args
+
         code = CommandResponseType.ERROR
 
         if len(args) != 1:
             message = "Número de argumentos inválido!"
             return (code, message)
 
-        if not USER_LOGGED_IN:
+        if not context.session.user:
             message = 'É necessário estar logado para remover regras do iptables!'
             return (code, message)
 
         address_or_id = args.pop()
+        user_id = context.session.user.id
 
-        content = self.get_database_content()
-        database = loads(content)
-        rule_list = database.get("rules")
+        rule = self.storage.get_record(DatabaseTableType.RULE, address_or_id)
 
-        user_id = USER_LOGGED_IN.id
-
-        for rule_id in rule_list:
-            rule = rule_list[rule_id]
-            if rule['user_id'] != user_id:
-                continue
+        if rule and rule['user_id'] == user_id:
+            rule_id = address_or_id
+        else:
+            result = self.storage.find_rule_by_address(
+                user_id,
+                self.normalize_address(address_or_id)
+            )
 
-            if address_or_id in [rule_id, rule.get("ip")]:
-                rule_list.pop(rule_id)
+            if not result:
+                message = "Regra não encontrada!"
+                return (code, message)
 
-                database['rules'] = rule_list
+            rule_id, rule = result
 
-                self.save_dict_to_database(database)
+        self.storage.remove_record(DatabaseTableType.RULE, rule_id)
 
-                code = CommandResponseType.OK
-                message = "Regra removida com sucesso!"
-                return (code, message)
+        code = CommandResponseType.OK
+        message = "Regra removida com sucesso!"
 
-        message = "Regra não encontrada!"
+        if not self.apply_rule_changes(user_id, removed=[(rule_id, rule)]):
+            message += '\nNão foi possível remover a regra do firewall!'
         return (code, message)
 
 
 class FirewallCommand(DatabaseCommand):
     name = "firewall"
 
-    def run_script_file(self, filename: str, args=None):
+    @property
+    def firewall(self):
+        return get_firewall()
+
+    def __init__(self):
+        self.available_actions = {
+            'start': self.start,
+            'stop': self.stop,
+            'sync': self.sync,
+            'reload': self.reload
+        }
+
+    def get_user_address_actions(self, user_id: str):
+        '''
+        Retorna as regras do usuário em pares (endereço, ação).
+        '''
+
+        rule_list = self.storage.get_rules_by_user_id(user_id)
+
+        if rule_list is None:
+            return None
+
+        return get_address_actions(rule_list)
+
+    def start(self, context: RequestContext):
         '''
-        Abre um arquivo na pasta "./scripts" e executa de acordo com os
-        argumentos passados.
+        Método principal para permitir compartilhamento de pacotes e
+        executar regras salvas no banco de dados no iptables.
         '''
 
-        if args is None:
-            args = []
+        code = CommandResponseType.ERROR
 
-        with open(filename, mode='r') as file:
-            commands = file.readlines()
+        user_id = context.session.user.id
+        rules = self.get_user_address_actions(user_id)
 
-            for line in commands:
-                if not line.strip():
-                    continue
+        if rules is None:
+            message = "Não foi possível obter regras cadastradas no banco de dados!"
+            return (code, message)
 
-                command = line.format(*args)
-                print(f"$ {command}")
-                error = system(command)
+        started = perf_counter()
+        result = self.firewall.start(user_id, rules)
+        elapsed = perf_counter() - started
 
-                if error:
-                    return False
+        if not result:
+            message = "Houve algum erro durante a execução dos scripts!"
+            return (code, message)
 
-        return True
+        rule_count, entry_count = self.firewall.get_entry_counts()
 
-    def clear_iptables_rules(self):
-        '''
-        Limpa as regras definidas no iptables.
-        '''
+        code = CommandResponseType.OK
+        result = {
+            'rules': rule_count,
+            'prefixes': entry_count,
+            'elapsed_ms': round(elapsed * 1000, 3)
+        }
 
-        file = '../scripts/clear_iptables_rules.script'
-        result = self.run_script_file(file)
+        return (code, ResponseData(result, self.format_start_result))
 
-        return result
+    def format_start_result(self, result: dict):
+        message = (
+            'Regras de firewall aplicadas com sucesso!\n'
+            f'{result["rules"]} regra(s) agrupada(s) em '
+            f'{result["prefixes"]} prefixo(s).'
+        )
 
-    def enable_internet_via_nat(self):
-        '''
-        Permite a conversão de ip privado para público através do masquerade.
-        '''
+        if result['prefixes'] < result['rules']:
+            fewer = result['rules'] - result['prefixes']
+            message += f'\n{fewer} entrada(s) a menos no kernel.'
 
-        file = "../scripts/enable_internet_via_nat.script"
-        result = self.run_script_file(file)
-        return result
+        elif result['prefixes'] > result['rules']:
+            more = result['prefixes'] - result['rules']
+            message += (
+                f'\n{more} entrada(s) a mais no kernel: o backend não aceita '
+                'prefixos sobrepostos e as exceções dividem as redes que as '
+                'contêm.'
+            )
+
+        return message
 
-    def enable_ip_forwarding(self, enable: bool):
+    def stop(self, context: RequestContext):
         '''
-        Permite o encaminhamento de pacotes.
+        Método principal para parar compartilhamento de pacotes e limpar
+        regras executadas no iptables.
         '''
 
-        file = "../scripts/change_ip_forwarding.script"
-        args = [int(enable)]
-        result = self.run_script_file(file, args)
+        code = CommandResponseType.ERROR
 
-        return result
+        if not self.firewall.stop():
+            message = "Houve algum erro durante a execução dos scripts!"
+            return (code, message)
+
+        code = CommandResponseType.OK
+        message = 'Regras de firewall redefinidas com sucesso!'
 
-    def set_address_permission_in_iptables(self, address: str, action: str):
+        return (code, message)
+
+    def sync(self, context: RequestContext):
         '''
-        Aplica uma regra individual a um endereço, permitindo ou não seu acesso
-        à internet.
+        Aplica somente as diferenças entre as regras do usuário e as regras
+        já aplicadas no kernel.
         '''
 
-        file = "../scripts/address_action_to_server.script"
-        args = [IFACE_LAN, IFACE_WAN, address, action]
-        result = self.run_script_file(file, args)
+        code = CommandResponseType.ERROR
 
-        return result
+        user_id = context.session.user.id
 
-    def apply_rules_to_iptables(self, rule_list):
-        '''
-        Aplica as regras definidas no banco de dados para cada endereço,
-        permitindo ou restringindo o acesso à internet.
-        '''
+        if self.firewall.owner_id != user_id:
+            message = "O firewall não foi iniciado com as regras deste usuário!"
+            return (code, message)
 
-        user_id = USER_LOGGED_IN.id
+        rules = self.get_user_address_actions(user_id)
 
-        for rule_id in rule_list:
-            rule = rule_list[rule_id]
-            if rule['user_id'] != user_id:
-                continue
+        started = perf_counter()
+        result = self.firewall.sync(rules)
+        elapsed = perf_counter() - started
 
-            ip, action = rule.get("ip"), rule.get("action")
+        if result is None:
+            message = "Houve algum erro durante a execução dos scripts!"
+            return (code, message)
 
-            if action == "DENY":
-                action = "DROP"
+        added, removed = result
+        rule_count, entry_count = self.firewall.get_entry_counts()
 
-            result = self.set_address_permission_in_iptables(ip, action)
-            if not result:
-                return False
+        code = CommandResponseType.OK
+        result = {
+            'added': added,
+            'removed': removed,
+            'rules': rule_count,
+            'prefixes': entry_count,
+            'elapsed_ms': round(elapsed * 1000, 3)
+        }
+
+        return (code, ResponseData(result, self.format_sync_result))
 
-        return True
+    def format_sync_result(self, result: dict):
+        return (
+            f'Firewall sincronizado: {result["added"]} prefixo(s) adicionado(s), '
+            f'{result["removed"]} removido(s).\n'
+            f'{result["rules"]} regra(s) agrupada(s) em '
+            f'{result["prefixes"]} prefixo(s).'
+        )
 
-    def start(self):
+    def reload(self, context: RequestContext):
         '''
-        Método principal para permitir compartilhamento de pacotes e
-        executar regras salvas no banco de dados no iptables.
+        Relê e compila os scripts usados para aplicar as regras.
         '''
 
         code = CommandResponseType.ERROR
 
-        self.enable_internet_via_nat()
-        self.enable_ip_forwarding(True)
+        try:
+            result = self.firewall.backend.reload()
+        except (OSError, ValueError):
+            result = False
 
-        rule_list = self.get_table_from_database(DatabaseTableType.RULE)
+        if not result:
+            message = "Não foi possível recarregar os scripts do firewall!"
+            return (code, message)
 
-        if rule_list is None:
-            message = "Não foi possível obter regras cadastradas no banco de dados!"
+        code = CommandResponseType.OK
+        message = 'Scripts do firewall recarregados com sucesso!'
+
+        return (code, message)
+
+    def run(self, context: RequestContext):
+        code = CommandResponseType.ERROR
+
+        args = context.args
+        if not (args and len(args) >= 1):
+            message = "Não há argumentos suficientes!"
             return (code, message)
 
-        result = self.apply_rules_to_iptables(rule_list)
+        action = args.pop(0)
+        if action not in self.available_actions or args:
+            message = "Ação inválida!"
+            return (code, message)
 
-        if not result:
-            message = "Houve algum erro durante a execução dos scripts!"
+        if not context.session.user:
+            message = 'É preciso estar logado para executar regras do iptables!'
             return (code, message)
 
+        return self.available_actions[action](context)
+
+
+class EncodingCommand(Command):
+    '''
+    Define a codificação das respostas seguintes da conexão: "text" para
+    leitura ou "json"/"msgpack" com os dados estruturados, sem formatação.
+    '''
+
+    name = "encoding"
+
+    def run(self, context: RequestContext):
+        code = CommandResponseType.ERROR
+
+        args = context.args
+        if len(args) != 1:
+            message = "Número de argumentos inválido!"
+            return (code, message)
+
+        encoding = args[0]
+        available_encodings = get_available_encodings()
+
+        if encoding not in available_encodings:
+            options = ', '.join(available_encodings)
+            message = f'Codificação indisponível! Opções: {options}'
+            return (code, message)
+
+        context.session.encoding = encoding
+
         code = CommandResponseType.OK
-        message = 'Regras de firewall aplicadas com sucesso!'
+        message = f'Codificação definida: {encoding}'
 
         return (code, message)
 
-    def stop(self):
+
+class AdminCommand(Command):
+    '''
+    Operações de observação do servidor, restritas aos usuários cujos
+    e-mails foram passados ao servidor (set_admin_emails). Sem nenhum, o
+    comando fica desativado. O profile grava somente no diretório fixado
+    na inicialização do servidor, com nomes gerados pelo próprio servidor.
+    '''
+
+    name = "admin"
+
+    def __init__(self):
+        self.available_actions = {
+            'stats': self.stats,
+            'profile': self.profile,
+            'trace': self.trace
+        }
+
+    def format_latency(self, summary: dict):
+        return f'{summary["count"]} em média de {summary["average_ms"]:.2f}ms, ' + \
+            f'p50 até {summary["p50_ms"]:g}ms, p99 até {summary["p99_ms"]:g}ms'
+
+    def format_stats(self, stats: dict):
+        lines = [
+            f'Tempo de atividade: {stats["uptime"]:.0f}s, ' +
+            f'{stats["active_connections"]} conexão(ões) ativa(s).',
+            'Requisições:'
+        ]
+
+        for request in stats['requests']:
+            name = f'{request["command"]} {request["action"]}'.strip()
+            lines.append(
+                f'  {name}: {self.format_latency(request)}, '
+                f'{request["errors"]} erro(s)'
+            )
+
+        sections = [('Banco de dados:', 'database'), ('Firewall:', 'firewall')]
+
+        for title, key in sections:
+            lines.append(title)
+
+            for operation, summary in stats[key].items():
+                lines.append(f'  {operation}: {self.format_latency(summary)}')
+
+        bcrypt = stats['bcrypt']
+        lines.append(
+            f'bcrypt: {bcrypt["queue_depth"]} na fila, '
+            f'{bcrypt["completed"]} concluído(s), '
+            f'{bcrypt["rejected"]} recusado(s), '
+            f'espera média de {bcrypt["average_wait"] * 1000:.2f}ms'
+        )
+
+        return '\n'.join(lines)
+
+    def format_tracing(self, status: dict):
+        if status['threshold_ms'] is None:
+            lines = ['Rastreamento desativado.']
+        else:
+            threshold = status['threshold_ms']
+            lines = [f'Registrando requisições acima de {threshold:g}ms.']
+
+        if status['profile_error']:
+            lines.append(
+                f'Erro ao gravar o último profiling: {status["profile_error"]}'
+            )
+        elif status['profiling']:
+            lines.append(
+                f'Profiling em andamento: {status["profiled"]} requisição(ões) em '
+                f'{status["profile_file"]}'
+            )
+        elif status['profile_file']:
+            lines.append(
+                f'Último profiling: {status["profiled"]} requisição(ões) em '
+                f'{status["profile_file"]}'
+            )
+
+        return '\n'.join(lines)
+
+    def stats(self, context: RequestContext):
+        if len(context.args) != 1:
+            return (CommandResponseType.ERROR, 'Ação inválida!')
+
+        code = CommandResponseType.OK
+        return (code, ResponseData(get_metrics().get_stats(), self.format_stats))
+
+    def profile(self, context: RequestContext):
         '''
-        Método principal para parar compartilhamento de pacotes e limpar
-        regras executadas no iptables.
+        Inicia o cProfile para as próximas N requisições ("admin profile
+        100") ou para as recebidas nos próximos N segundos ("admin profile
+        30s"). As estatísticas são gravadas em um arquivo no servidor.
         '''
 
         code = CommandResponseType.ERROR
+        tracer = get_tracer()
 
-        results = [
-            self.enable_ip_forwarding(False),
-            self.clear_iptables_rules()
-        ]
+        if len(context.args) != 2:
+            message = (
+                'Informe a quantidade de requisições ou a duração '
+                '(ex.: 100 ou 30s)!'
+            )
+            return (code, message)
 
-        if not all(results):
-            message = "Houve algum erro durante a execução dos scripts!"
+        value = context.args[1]
+
+        if value == 'stop':
+            if tracer.profiler is None:
+                return (code, 'Nenhum profiling em andamento!')
+
+            tracer.profiler.finish()
+            data = ResponseData(tracer.get_status(), self.format_tracing)
+            return (CommandResponseType.OK, data)
+
+        count = value[:-1] if value.endswith('s') else value
+
+        if not (count.isdigit() and 0 < int(count) <= MAX_PROFILE_LENGTH):
+            message = f'Informe um valor entre 1 e {MAX_PROFILE_LENGTH}!'
+            return (code, message)
+
+        if value.endswith('s'):
+            filename = tracer.start_profiler(seconds=int(count))
+        else:
+            filename = tracer.start_profiler(requests=int(count))
+
+        if filename is None:
+            directory = tracer.profile_directory
+            message = f'Não é possível gravar arquivos em {directory}!'
             return (code, message)
 
         code = CommandResponseType.OK
-        message = 'Regras de firewall redefinidas com sucesso!'
+        return (code, ResponseData(tracer.get_status(), self.format_tracing))
 
-        return (code, message)
+    def trace(self, context: RequestContext):
+        code = CommandResponseType.ERROR
+        tracer = get_tracer()
 
-    def run(self):
+        if len(context.args) > 2:
+            return (code, 'Informe o limite em milissegundos ou "off"!')
+
+        if len(context.args) == 2:
+            value = context.args[1]
+
+            if value == 'off':
+                tracer.threshold = None
+            elif value.isdigit():
+                tracer.threshold = int(value) / 1000
+            else:
+                return (code, 'Informe o limite em milissegundos ou "off"!')
+
+        code = CommandResponseType.OK
+        return (code, ResponseData(tracer.get_status(), self.format_tracing))
+
+    def run(self, context: RequestContext):
         code = CommandResponseType.ERROR
 
-        args = self.get_args()
-        if not (args and len(args) >= 1):
-            message = "Não há argumentos suficientes!"
+        args = context.args
+        if not args or args[0] not in self.available_actions:
+            message = "Ação inválida!"
             return (code, message)
 
-        available_actions = {
-            'start': self.start,
-            'stop': self.stop
-        }
+        user = context.session.user
 
-        action = args.pop(0)
-        if action not in available_actions or args:
-            message = "Ação inválida!"
+        if not user:
+            message = 'É preciso estar logado para ver as métricas do servidor!'
             return (code, message)
 
-        if not USER_LOGGED_IN:
-            message = 'É preciso estar logado para executar regras do iptables!'
+        if user.email not in get_admin_emails():
+            message = 'Somente administradores do servidor podem usar este comando!'
+            return (code, message)
+
+        return self.available_actions[args[0]](context)
+
+
+class CommandRegistry:
+    '''
+    Tabela de despacho criada uma única vez por processo: o primeiro token
+    da linha de comando indexa diretamente o comando responsável, cuja
+    instância é compartilhada por todas as requisições.
+    '''
+
+    commands: Dict[str, Command]
+
+    def __init__(self, commands: List[Command] = ()):
+        self.commands = {}
+
+        for command in commands:
+            self.register(command)
+
+    def register(self, command: Command):
+        '''
+        Registra um novo comando, substituindo outro de mesmo nome.
+        '''
+
+        self.commands[command.name] = command
+        return command
+
+    def get_command(self, command_line: str):
+        tokens = command_line.split(maxsplit=1)
+
+        if not tokens:
+            return None
+
+        return self.commands.get(tokens[0])
+
+    def dispatch(self, command_line: str, session: Session = None):
+        '''
+        Executa o comando correspondente à linha recebida.
+        '''
+
+        tokens = command_line.split()
+        command = self.commands.get(tokens[0]) if tokens else None
+
+        if command is None:
+            code = CommandResponseType.ERROR
+            message = "Comando inválido!"
             return (code, message)
 
-        return available_actions[action]()
+        context = RequestContext(command_line, tokens[1:], session)
+        return command.run(context)
+
+
+_client_registry = None
+_server_registry = None
+
+
+def get_client_registry() -> CommandRegistry:
+    global _client_registry
+
+    if _client_registry is None:
+        _client_registry = CommandRegistry([
+            ClearCommand(),
+            HelpCommand(),
+            ExitCommand(),
+            UploadCommand()
+        ])
+
+    return _client_registry
+
+
+def get_server_registry() -> CommandRegistry:
+    global _server_registry
+
+    if _server_registry is None:
+        _server_registry = CommandRegistry([
+            UserCommand(),
+            RuleCommand(),
+            FirewallCommand(),
+            EncodingCommand(),
+            AdminCommand()
+        ])
+
+    return _server_registry
+
+
+def register_server_command(command: Command):
+    '''
+    Disponibiliza um novo comando no servidor.
+    '''
+
+    return get_server_registry().register(command)
+
+
+_admin_emails = frozenset()
+
 
+def set_admin_emails(emails: List[str]):
+    '''
+    Define os e-mails dos usuários autorizados a usar o comando "admin".
+    '''
 
-def get_client_commands():
-    return [
-        ClearCommand(),
-        HelpCommand(),
-        ExitCommand()
-    ]
+    global _admin_emails
+    _admin_emails = frozenset(emails)
 
 
-def get_server_commands():
-    return [
-        UserCommand(),
-        RuleCommand(),
-        FirewallCommand()
-    ]
+def get_admin_emails() -> frozenset:
+    return _admin_emails
@@ -0,0 +1,1468 @@
+from abc import ABC, abstractmethod
+from ipaddress import IPv4Address, summarize_address_range
+from os import listdir, system
+from os.path import abspath, dirname, join, splitext
+from shlex import split
+from string import Formatter
+from subprocess import DEVNULL, run
+from threading import RLock
+from time import perf_counter, sleep
+from typing import Dict, List, Optional, Tuple
+
+from metrics import get_metrics
+from rule_index import (
+    MAX_ADDRESS, RuleIndex, format_network, format_range, get_network_range,
+    get_prefix_length, get_supernet_ranges
+)
+from tracing import trace_span
+
+IFACE_LAN = 'enp0s8'
+IFACE_WAN = 'enp0s3'
+IP_FORWARD_FILE = '/proc/sys/net/ipv4/ip_forward'
+SCRIPTS_DIRECTORY = join(dirname(abspath(__file__)), 'scripts')
+SHELL_OPERATORS = {'|', '||', '&&', ';', '>', '>>', '<'}
+
+# Pares (endereço, ação do iptables) a serem aplicados, na ordem das regras.
+AddressAction = Tuple[str, str]
+
+# Ordem dos endereços que não são IPv4 válidos nos backends ordenados:
+# antes de todos os prefixos, como se fossem os mais específicos.
+UNPARSED_ORDER = 33
+# Alterações em mais de 1/FULL_AGGREGATION_RATIO das regras de uma vez
+# reagrupam todas as regras, em vez de uma rede por regra alterada.
+FULL_AGGREGATION_RATIO = 8
+
+
+def get_address_actions(rule_list: Dict[str, dict]) -> List[AddressAction]:
+    '''
+    Converte regras do banco de dados em pares (endereço, ação) no formato
+    aceito pelo iptables.
+    '''
+
+    result = []
+
+    for rule in rule_list.values():
+        ip, action = rule.get("ip"), rule.get("action")
+
+        if action == "DENY":
+            action = "DROP"
+
+        result.append((ip, action))
+
+    return result
+
+
+def parse_rules(
+    rules: List[AddressAction]
+) -> Tuple[List[Tuple[int, int, str]], List[AddressAction]]:
+    '''
+    Separa as regras em faixas (início, fim, ação) e nas regras cujos
+    endereços não são IPv4 válidos.
+    '''
+
+    intervals = []
+    unparsed = []
+
+    for address, action in rules:
+        try:
+            start, end = get_network_range(address)
+        except ValueError:
+            unparsed.append((address, action))
+            continue
+
+        intervals.append((start, end, action))
+
+    return intervals, unparsed
+
+
+def aggregate_rules(rules: List[AddressAction]) -> List[AddressAction]:
+    '''
+    Reduz as regras ao menor conjunto de prefixos sem sobreposição: cada
+    endereço recebe a ação da regra mais específica que o contém e faixas
+    vizinhas com a mesma ação são agrupadas. Como os prefixos resultantes
+    não se sobrepõem, a ordem de aplicação é indiferente em todos os
+    backends. Endereços que não são IPv4 válidos são mantidos como estão.
+    '''
+
+    intervals, unparsed = parse_rules(rules)
+
+    return [*aggregate_ranges(intervals), *unparsed]
+
+
+def aggregate_ranges(
+    intervals: List[Tuple[int, int, str]],
+    region: Tuple[int, int] = (0, MAX_ADDRESS),
+    inherited: Optional[str] = None
+) -> List[AddressAction]:
+    '''
+    Agrupa, como o aggregate_rules, as faixas contidas na rede "region".
+    Os endereços da rede não cobertos por nenhuma faixa recebem a ação
+    "inherited", a da regra mais específica que contém a rede, se houver.
+    '''
+
+    if inherited is not None:
+        intervals = [(*region, inherited), *intervals]
+
+    # Redes CIDR são aninhadas ou disjuntas: ordenando pelo início (e as
+    # maiores primeiro), cada rede está contida nas que estão na pilha. A
+    # ordenação é estável: a rede herdada fica antes de uma regra igual.
+    intervals = sorted(intervals, key=lambda interval: (interval[0], -interval[1]))
+
+    ranges = []
+    stack = []
+    position = 0
+
+    def add_range(start: int, end: int, action: str):
+        if start > end:
+            return
+
+        if ranges and ranges[-1][2] == action and ranges[-1][1] + 1 == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end, action])
+
+    for start, end, action in intervals:
+        while stack and stack[-1][0] < start:
+            stack_end, stack_action = stack.pop()
+            add_range(position, stack_end, stack_action)
+            position = max(position, stack_end + 1)
+
+        if stack:
+            add_range(position, start - 1, stack[-1][1])
+
+        position = start
+        stack.append((end, action))
+
+    while stack:
+        stack_end, stack_action = stack.pop()
+        add_range(position, stack_end, stack_action)
+        position = max(position, stack_end + 1)
+
+    return [
+        (format_network(network), action)
+        for start, end, action in ranges
+        for network in summarize_address_range(IPv4Address(start), IPv4Address(end))
+    ]
+
+
+def aggregate_nested_rules(rules: List[AddressAction]) -> List[AddressAction]:
+    '''
+    Reduz as regras mantendo a precedência da regra mais específica, para
+    os backends em que vale a primeira regra que casa com o pacote: redes
+    irmãs com a mesma ação são unidas na rede que as contém e regras
+    contidas em outra com a mesma ação são descartadas. Os prefixos podem
+    se sobrepor e são retornados dos mais específicos para os menos
+    específicos, com as exceções antes das redes que as contêm; nunca há
+    mais prefixos que regras. Endereços que não são IPv4 válidos são
+    mantidos como estão, antes dos demais.
+    '''
+
+    intervals, unparsed = parse_rules(rules)
+    nodes = merge_nested_ranges(intervals)
+
+    return [
+        *unparsed,
+        *((format_range(start, end), action)
+          for start, end, action in prune_nested_nodes(nodes))
+    ]
+
+
+def merge_nested_ranges(
+    intervals: List[Tuple[int, int, str]],
+    region_length: int = 0
+) -> Dict[Tuple[int, int], str]:
+    '''
+    Primeira etapa do aggregate_nested_rules: retorna as redes, como
+    pares (início, tamanho do prefixo), e suas ações depois de unir as
+    redes irmãs com a mesma ação. Somente redes com prefixo maior que
+    "region_length" são unidas, de modo que as faixas de uma rede com esse
+    prefixo podem ser agrupadas sem as demais.
+    '''
+
+    nodes = {}
+    starts_by_length = [[] for _ in range(33)]
+
+    for start, end, action in intervals:
+        length = get_prefix_length(start, end)
+
+        if (start, length) not in nodes:
+            starts_by_length[length].append(start)
+
+        nodes[(start, length)] = action
+
+    # Das redes menores para as maiores: duas metades com a mesma ação
+    # equivalem à rede que as contém, cuja própria ação deixa de valer.
+    for length in range(32, region_length, -1):
+        size = 1 << (32 - length)
+
+        for start in starts_by_length[length]:
+            action = nodes.get((start, length))
+            sibling = (start ^ size, length)
+
+            if action is None or nodes.get(sibling) != action:
+                continue
+
+            del nodes[(start, length)], nodes[sibling]
+            parent = (start & ~size, length - 1)
+
+            if parent not in nodes:
+                starts_by_length[length - 1].append(parent[0])
+
+            nodes[parent] = action
+
+    return nodes
+
+
+def prune_nested_nodes(
+    nodes: Dict[Tuple[int, int], str],
+    inherited: Optional[str] = None
+) -> List[Tuple[int, int, str]]:
+    '''
+    Segunda etapa do aggregate_nested_rules: descarta as redes contidas em
+    outra com a mesma ação (ou, sem nenhuma, com a ação "inherited") e
+    retorna as demais como faixas, das mais específicas para as menos
+    específicas.
+    '''
+
+    # Ordenando pelo início (e as maiores primeiro), a pilha contém as
+    # redes mantidas que contêm a atual; a do topo é a que vale para ela.
+    result = []
+    stack = []
+
+    for (start, length), action in sorted(nodes.items()):
+        while stack and stack[-1][0] < start:
+            stack.pop()
+
+        if (stack[-1][1] if stack else inherited) == action:
+            continue
+
+        end = start | (MAX_ADDRESS >> length)
+        stack.append((end, action))
+        result.append((length, start, end, action))
+
+    result.sort(key=lambda entry: (-entry[0], entry[1]))
+
+    return [(start, end, action) for _, start, end, action in result]
+
+
+def get_entry_order(address: str) -> int:
+    '''
+    Retorna a ordem do prefixo nas cadeias dos backends ordenados, em que
+    os prefixos maiores (mais específicos) vêm primeiro.
+    '''
+
+    try:
+        return get_prefix_length(*get_network_range(address))
+    except ValueError:
+        return UNPARSED_ORDER
+
+
+def find_action(
+    actions: Dict[str, str],
+    index: RuleIndex,
+    network: Tuple[int, int]
+) -> Optional[str]:
+    '''
+    Retorna a ação da rede mais específica do índice que contém a rede
+    passada, sem contar ela mesma, ou None se não houver nenhuma.
+    '''
+
+    for network_range in reversed(get_supernet_ranges(*network)[:-1]):
+        ids = index.ids_by_range.get(network_range)
+
+        if ids:
+            return actions[next(iter(ids))]
+
+    return None
+
+
+def set_indexed(
+    actions: Dict[str, str],
+    index: RuleIndex,
+    address: str,
+    action: Optional[str]
+):
+    '''
+    Inclui, altera ou (com "action" None) remove um endereço do dicionário
+    de ações e do índice correspondente.
+    '''
+
+    if action is None:
+        if actions.pop(address, None) is not None:
+            index.remove(address)
+
+        return
+
+    if address not in actions:
+        index.add(address, address)
+
+    actions[address] = action
+
+
+class CommandRunner:
+    '''
+    Executa os comandos do firewall no sistema.
+    '''
+
+    def run_shell(self, command: str) -> bool:
+        print(f"$ {command}")
+        return not system(command)
+
+    def run(self, argv: List[str], input: str = None) -> bool:
+        print(f"$ {' '.join(argv)}")
+        result = run(argv, input=input, text=True, stdout=DEVNULL)
+        return result.returncode == 0
+
+    def write_file(self, filename: str, content: str) -> bool:
+        print(f"$ echo {content} > {filename}")
+
+        try:
+            with open(filename, mode='w') as file:
+                file.write(content)
+        except OSError:
+            return False
+
+        return True
+
+
+class RecordingRunner(CommandRunner):
+    '''
+    Registra os comandos em vez de executá-los. Permite testar e medir a
+    aplicação das regras sem privilégios de root; "delay" simula o tempo
+    de execução de cada chamada.
+    '''
+
+    calls: list
+    delay: float
+
+    def __init__(self, delay: float = 0):
+        self.calls = []
+        self.delay = delay
+        self.lock = RLock()
+
+    def record(self, *call) -> bool:
+        if self.delay:
+            sleep(self.delay)
+
+        with self.lock:
+            self.calls.append(call)
+
+        return True
+
+    def run_shell(self, command: str) -> bool:
+        return self.record('shell', command)
+
+    def run(self, argv: List[str], input: str = None) -> bool:
+        return self.record('run', argv, input)
+
+    def write_file(self, filename: str, content: str) -> bool:
+        return self.record('write', filename, content)
+
+    def get_inputs(self, program: str) -> List[str]:
+        '''
+        Retorna o conteúdo enviado a cada execução de um programa (por
+        exemplo, os payloads do "nft" ou do "iptables-restore").
+        '''
+
+        with self.lock:
+            return [
+                call[2] for call in self.calls
+                if call[0] == 'run' and call[1][0] == program
+            ]
+
+
+class FirewallBackend(ABC):
+    '''
+    Forma de aplicar no kernel as regras cadastradas no banco de dados.
+    '''
+
+    runner: CommandRunner
+
+    # Nas cadeias do iptables vale a primeira regra que casa com o pacote:
+    # os prefixos podem se sobrepor, desde que os mais específicos venham
+    # antes. Os demais backends recebem prefixos sem sobreposição.
+    ordered = False
+
+    def __init__(self, runner: CommandRunner = None):
+        self.runner = runner or CommandRunner()
+
+    def aggregate(self, rules: List[AddressAction]) -> List[AddressAction]:
+        '''
+        Agrupa as regras nos prefixos aplicados pelo backend.
+        '''
+
+        if self.ordered:
+            return aggregate_nested_rules(rules)
+
+        return aggregate_rules(rules)
+
+    @abstractmethod
+    def start(self, rules: List[AddressAction]) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def stop(self) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def apply_changes(
+        self,
+        added: List[AddressAction],
+        removed: List[AddressAction],
+        positions: List[int] = None
+    ) -> bool:
+        '''
+        Aplica apenas as diferenças em relação ao estado atual do kernel.
+        Nos backends ordenados, "positions" traz a posição (em prefixos, a
+        partir de 0) em que cada prefixo incluído deve ser inserido, já
+        contando as inclusões anteriores.
+        '''
+
+        raise NotImplementedError
+
+    def reload(self) -> bool:
+        '''
+        Recarrega arquivos de configuração usados pelo backend, se houver.
+        '''
+
+        return True
+
+
+class ScriptTemplate:
+    '''
+    Script da pasta "scripts" compilado uma única vez em uma lista de
+    passos: comandos (argv, executados sem shell) ou escritas em arquivo
+    (linhas no formato "echo {} > arquivo").
+    '''
+
+    steps: list
+    appends: int
+
+    def __init__(self, content: str):
+        self.steps = [
+            self.compile_line(line)
+            for line in content.splitlines()
+            if line.strip()
+        ]
+        self.appends = sum(
+            1 for kind, *step in self.steps if kind == 'run' and '-A' in step[0]
+        )
+
+    @staticmethod
+    def number_fields(line: str) -> str:
+        '''
+        Troca os campos "{}" por índices explícitos ("{0}", "{1}", ...), para
+        que cada argumento possa ser formatado separadamente.
+        '''
+
+        result = []
+        index = 0
+
+        for text, field, spec, conversion in Formatter().parse(line):
+            result.append(text.replace('{', '{{').replace('}', '}}'))
+
+            if field is None:
+                continue
+
+            if field == '':
+                field = str(index)
+                index += 1
+
+            conversion = f'!{conversion}' if conversion else ''
+            spec = f':{spec}' if spec else ''
+            result.append(f'{{{field}{conversion}{spec}}}')
+
+        return ''.join(result)
+
+    def compile_line(self, line: str):
+        tokens = split(self.number_fields(line))
+
+        if len(tokens) == 4 and tokens[0] == 'echo' and tokens[2] == '>':
+            return ('write', tokens[3], tokens[1])
+
+        if set(tokens) & SHELL_OPERATORS:
+            return ('shell', line)
+
+        return ('run', tokens)
+
+    def render(self, args, delete: bool = False, position: int = None):
+        '''
+        Gera os passos com os argumentos aplicados. Com "delete", as
+        inclusões de regras (-A) são trocadas por remoções (-D). Com
+        "position", por inserções (-I) na posição da cadeia ocupada pela
+        execução de número "position" do script, contada a partir de 0.
+        '''
+
+        index = 0
+
+        for kind, *step in self.steps:
+            if kind == 'write':
+                filename, content = step
+                yield kind, filename.format(*args), content.format(*args)
+
+            elif kind == 'shell':
+                yield kind, step[0].format(*args)
+
+            else:
+                argv = [token.format(*args) for token in step[0]]
+
+                if delete:
+                    argv = ['-D' if token == '-A' else token for token in argv]
+
+                elif position is not None and '-A' in argv:
+                    append = argv.index('-A')
+                    rule_number = position * self.appends + index + 1
+                    chain = argv[append + 1]
+                    argv[append:append + 2] = ['-I', chain, str(rule_number)]
+                    index += 1
+
+                yield kind, argv
+
+
+class ScriptBackend(FirewallBackend):
+    '''
+    Executa os scripts da pasta "scripts", uma vez para cada regra. Os
+    scripts são lidos e compilados ao criar o backend (e no "firewall
+    reload"), sem acesso a arquivos nem shell ao aplicar as regras.
+    '''
+
+    scripts_directory: str
+    scripts: Dict[str, ScriptTemplate]
+
+    ordered = True
+
+    def __init__(
+        self,
+        runner: CommandRunner = None,
+        scripts_directory: str = SCRIPTS_DIRECTORY
+    ):
+        FirewallBackend.__init__(self, runner)
+        self.scripts_directory = scripts_directory
+        self.reload()
+
+    def reload(self) -> bool:
+        '''
+        Lê e compila novamente todos os scripts.
+        '''
+
+        scripts = {}
+
+        for filename in listdir(self.scripts_directory):
+            name, extension = splitext(filename)
+            if extension != '.script':
+                continue
+
+            with open(join(self.scripts_directory, filename), mode='r') as file:
+                scripts[name] = ScriptTemplate(file.read())
+
+        self.scripts = scripts
+        return True
+
+    def run_script(
+        self,
+        name: str,
+        args=None,
+        delete: bool = False,
+        position: int = None
+    ):
+        '''
+        Executa um script compilado de acordo com os argumentos passados.
+        '''
+
+        if args is None:
+            args = []
+
+        for kind, *step in self.scripts[name].render(args, delete, position):
+            if kind == 'write':
+                result = self.runner.write_file(*step)
+            elif kind == 'shell':
+                result = self.runner.run_shell(*step)
+            else:
+                result = self.runner.run(*step)
+
+            if not result:
+                return False
+
+        return True
+
+    def clear_iptables_rules(self):
+        '''
+        Limpa as regras definidas no iptables.
+        '''
+
+        return self.run_script('clear_iptables_rules')
+
+    def enable_internet_via_nat(self):
+        '''
+        Permite a conversão de ip privado para público através do masquerade.
+        '''
+
+        return self.run_script('enable_internet_via_nat')
+
+    def enable_ip_forwarding(self, enable: bool):
+        '''
+        Permite o encaminhamento de pacotes.
+        '''
+
+        return self.run_script('change_ip_forwarding', [int(enable)])
+
+    def set_address_permission_in_iptables(
+        self,
+        address: str,
+        action: str,
+        position: int = None
+    ):
+        '''
+        Aplica uma regra individual a um endereço, permitindo ou não seu acesso
+        à internet. Com "position", a regra é inserida nessa posição da
+        cadeia em vez de acrescentada ao fim.
+        '''
+
+        args = [IFACE_LAN, IFACE_WAN, address, action]
+        return self.run_script('address_action_to_server', args, position=position)
+
+    def remove_address_permission_in_iptables(self, address: str, action: str):
+        '''
+        Remove as regras aplicadas a um endereço, executando o mesmo script
+        com a operação de remoção (-D) no lugar da inclusão (-A).
+        '''
+
+        args = [IFACE_LAN, IFACE_WAN, address, action]
+        return self.run_script('address_action_to_server', args, delete=True)
+
+    def start(self, rules: List[AddressAction]) -> bool:
+        # As regras são acrescentadas às cadeias: sem limpá-las antes, um
+        # novo início duplicaria as regras deixadas no kernel.
+        if not self.clear_iptables_rules():
+            return False
+
+        self.enable_internet_via_nat()
+        self.enable_ip_forwarding(True)
+
+        for address, action in rules:
+            if not self.set_address_permission_in_iptables(address, action):
+                return False
+
+        return True
+
+    def stop(self) -> bool:
+        results = [
+            self.enable_ip_forwarding(False),
+            self.clear_iptables_rules()
+        ]
+
+        return all(results)
+
+    def apply_changes(
+        self,
+        added: List[AddressAction],
+        removed: List[AddressAction],
+        positions: List[int] = None
+    ) -> bool:
+        '''
+        Inclui as novas regras antes de remover as antigas: como os comandos
+        são executados um a um, remover primeiro deixaria os endereços sem
+        filtro até a inclusão das regras que os substituem.
+        '''
+
+        if positions is None:
+            positions = [None] * len(added)
+
+        for (address, action), position in zip(added, positions):
+            if not self.set_address_permission_in_iptables(address, action, position):
+                return False
+
+        for address, action in removed:
+            if not self.remove_address_permission_in_iptables(address, action):
+                return False
+
+        return True
+
+
+class IptablesRestoreBackend(FirewallBackend):
+    '''
+    Gera o estado completo das tabelas nat e filter e o aplica com uma
+    única chamada ao iptables-restore. Cada tabela é substituída em um
+    único commit atômico, sem deixar regras aplicadas pela metade em caso
+    de erro.
+    '''
+
+    ordered = True
+
+    def render_table(self, table: str, chains: List[str], rules: List[str]):
+        lines = [f'*{table}']
+        lines.extend(f':{chain} ACCEPT [0:0]' for chain in chains)
+        lines.extend(rules)
+        lines.append('COMMIT')
+
+        return lines
+
+    def render_nat_table(self, enable_nat: bool):
+        rules = []
+
+        if enable_nat:
+            rules.append(f'-A POSTROUTING -o {IFACE_LAN} -j MASQUERADE')
+
+        return self.render_table(
+            'nat',
+            ['PREROUTING', 'INPUT', 'OUTPUT', 'POSTROUTING'],
+            rules
+        )
+
+    def render_address_rules(
+        self,
+        rules: List[AddressAction],
+        positions: List[int] = None
+    ):
+        '''
+        Gera as duas regras (uma por sentido) de cada endereço. Com
+        "positions", as regras são inseridas (-I) nas posições passadas,
+        em prefixos, em vez de acrescentadas ao fim da cadeia.
+        '''
+
+        lines = []
+
+        for index, (address, action) in enumerate(rules):
+            first = second = '-A FORWARD'
+
+            if positions is not None:
+                rule_number = positions[index] * 2 + 1
+                first = f'-I FORWARD {rule_number}'
+                second = f'-I FORWARD {rule_number + 1}'
+
+            lines.append(
+                f'{first} -i {IFACE_LAN} -o {IFACE_WAN} -s {address} -j {action}'
+            )
+            lines.append(
+                f'{second} -o {IFACE_LAN} -i {IFACE_WAN} -s {address} -j {action}'
+            )
+
+        return lines
+
+    def render_filter_table(self, rules: List[AddressAction]):
+        return self.render_table(
+            'filter',
+            ['INPUT', 'FORWARD', 'OUTPUT'],
+            self.render_address_rules(rules)
+        )
+
+    def render_payload(self, rules: List[AddressAction], enable_nat: bool = True):
+        lines = [
+            *self.render_nat_table(enable_nat),
+            *self.render_filter_table(rules)
+        ]
+
+        return '\n'.join(lines) + '\n'
+
+    def restore(self, payload: str, flush: bool = True) -> bool:
+        argv = ['iptables-restore']
+
+        if not flush:
+            argv.append('--noflush')
+
+        return self.runner.run(argv, payload)
+
+    def apply_changes(
+        self,
+        added: List[AddressAction],
+        removed: List[AddressAction],
+        positions: List[int] = None
+    ) -> bool:
+        '''
+        Adiciona e remove as regras alteradas em um único commit da tabela
+        filter, sem limpar as demais. As inclusões vêm antes das remoções,
+        para que as posições passadas valham para a cadeia atual.
+        '''
+
+        deleted_rules = [
+            line.replace('-A FORWARD', '-D FORWARD', 1)
+            for line in self.render_address_rules(removed)
+        ]
+
+        lines = [
+            '*filter',
+            *self.render_address_rules(added, positions),
+            *deleted_rules,
+            'COMMIT'
+        ]
+
+        return self.restore('\n'.join(lines) + '\n', flush=False)
+
+    def start(self, rules: List[AddressAction]) -> bool:
+        payload = self.render_payload(rules)
+
+        if not self.restore(payload):
+            return False
+
+        return self.runner.write_file(IP_FORWARD_FILE, '1')
+
+    def stop(self) -> bool:
+        payload = '\n'.join([
+            *self.render_nat_table(False),
+            *self.render_filter_table([]),
+            *self.render_table('mangle', [
+                'PREROUTING', 'INPUT', 'FORWARD', 'OUTPUT', 'POSTROUTING'
+            ], [])
+        ]) + '\n'
+
+        results = [
+            self.runner.write_file(IP_FORWARD_FILE, '0'),
+            self.restore(payload)
+        ]
+
+        return all(results)
+
+
+class IpsetBackend(IptablesRestoreBackend):
+    '''
+    Carrega os endereços em dois conjuntos hash:net do ipset (ACCEPT e
+    DROP) com um único "ipset restore" e os referencia por um número
+    constante de regras no FORWARD, mantendo o custo por pacote constante
+    independentemente da quantidade de endereços. Endereços em ACCEPT têm
+    prioridade sobre DROP.
+    '''
+
+    ordered = False
+
+    set_names = {
+        'ACCEPT': 'iptables-cli-accept',
+        'DROP': 'iptables-cli-drop'
+    }
+
+    def render_set_payload(self, rules: List[AddressAction]):
+        '''
+        Preenche conjuntos temporários e os troca pelos definitivos com
+        "swap", de modo que os conjuntos em uso nunca ficam parcialmente
+        preenchidos.
+        '''
+
+        lines = []
+
+        for name in self.set_names.values():
+            lines.append(f'create {name} hash:net family inet -exist')
+            lines.append(f'create {name}-new hash:net family inet -exist')
+            lines.append(f'flush {name}-new')
+
+        for address, action in rules:
+            lines.append(f'add {self.set_names[action]}-new {address} -exist')
+
+        for name in self.set_names.values():
+            lines.append(f'swap {name}-new {name}')
+            lines.append(f'destroy {name}-new')
+
+        return '\n'.join(lines) + '\n'
+
+    def render_address_rules(
+        self,
+        rules: List[AddressAction],
+        positions: List[int] = None
+    ):
+        lines = []
+
+        for action, name in self.set_names.items():
+            lines.append(
+                f'-A FORWARD -i {IFACE_LAN} -o {IFACE_WAN} '
+                f'-m set --match-set {name} src -j {action}'
+            )
+            lines.append(
+                f'-A FORWARD -o {IFACE_LAN} -i {IFACE_WAN} '
+                f'-m set --match-set {name} src -j {action}'
+            )
+
+        return lines
+
+    def start(self, rules: List[AddressAction]) -> bool:
+        if not self.runner.run(['ipset', 'restore'], self.render_set_payload(rules)):
+            return False
+
+        return super().start(rules)
+
+    def apply_changes(
+        self,
+        added: List[AddressAction],
+        removed: List[AddressAction],
+        positions: List[int] = None
+    ) -> bool:
+        '''
+        Inclusões e remoções de regras são apenas operações nos conjuntos;
+        as regras do FORWARD permanecem as mesmas. O "ipset restore" não é
+        atômico: as inclusões vêm antes das remoções, como no ScriptBackend.
+        '''
+
+        lines = [
+            *(
+                f'add {self.set_names[action]} {address} -exist'
+                for address, action in added
+            ),
+            *(
+                f'del {self.set_names[action]} {address} -exist'
+                for address, action in removed
+            )
+        ]
+
+        return self.runner.run(['ipset', 'restore'], '\n'.join(lines) + '\n')
+
+    def stop(self) -> bool:
+        if not super().stop():
+            return False
+
+        payload = ''.join(
+            f'create {name} hash:net family inet -exist\ndestroy {name}\n'
+            for name in self.set_names.values()
+        )
+
+        return self.runner.run(['ipset', 'restore'], payload)
+
+
+class NftablesBackend(FirewallBackend):
+    '''
+    Compila todas as regras em uma tabela própria do nftables, com um mapa
+    de veredictos (endereço -> accept/drop) consultado por uma única regra
+    em cada sentido. A tabela é recriada em uma única transação do
+    "nft -f", sem janela de aplicação parcial.
+    '''
+
+    table = 'inet iptables_cli'
+    verdict_map = 'address_verdicts'
+    verdicts = {
+        'ACCEPT': 'accept',
+        'DROP': 'drop'
+    }
+
+    def render_elements(self, rules: List[AddressAction]):
+        return ', '.join(
+            f'{address} : {self.verdicts[action]}' for address, action in rules
+        )
+
+    def render_payload(self, rules: List[AddressAction]):
+        lines = [
+            # Garante que a tabela exista antes de removê-la na mesma
+            # transação.
+            f'table {self.table}',
+            f'delete table {self.table}',
+            f'table {self.table} {{',
+            f'    map {self.verdict_map} {{',
+            '        type ipv4_addr : verdict',
+            '        flags interval'
+        ]
+
+        if rules:
+            lines.append(f'        elements = {{ {self.render_elements(rules)} }}')
+
+        lines.extend([
+            '    }',
+            '    chain forward {',
+            '        type filter hook forward priority 0; policy accept;',
+            f'        iifname "{IFACE_LAN}" oifname "{IFACE_WAN}" '
+            f'ip saddr vmap @{self.verdict_map}',
+            f'        oifname "{IFACE_LAN}" iifname "{IFACE_WAN}" '
+            f'ip saddr vmap @{self.verdict_map}',
+            '    }',
+            '    chain postrouting {',
+            '        type nat hook postrouting priority srcnat; policy accept;',
+            f'        oifname "{IFACE_LAN}" masquerade',
+            '    }',
+            '}'
+        ])
+
+        return '\n'.join(lines) + '\n'
+
+    def run_transaction(self, payload: str) -> bool:
+        return self.runner.run(['nft', '-f', '-'], payload)
+
+    def start(self, rules: List[AddressAction]) -> bool:
+        if not self.run_transaction(self.render_payload(rules)):
+            return False
+
+        return self.runner.write_file(IP_FORWARD_FILE, '1')
+
+    def stop(self) -> bool:
+        payload = f'table {self.table}\ndelete table {self.table}\n'
+
+        results = [
+            self.runner.write_file(IP_FORWARD_FILE, '0'),
+            self.run_transaction(payload)
+        ]
+
+        return all(results)
+
+    def apply_changes(
+        self,
+        added: List[AddressAction],
+        removed: List[AddressAction],
+        positions: List[int] = None
+    ) -> bool:
+        lines = []
+        element = f'element {self.table} {self.verdict_map}'
+
+        if removed:
+            addresses = ', '.join(address for address, _ in removed)
+            lines.append(f'delete {element} {{ {addresses} }}')
+
+        if added:
+            lines.append(f'add {element} {{ {self.render_elements(added)} }}')
+
+        return self.run_transaction('\n'.join(lines) + '\n')
+
+
+FIREWALL_BACKENDS = {
+    'script': ScriptBackend,
+    'restore': IptablesRestoreBackend,
+    'ipset': IpsetBackend,
+    'nftables': NftablesBackend
+}
+
+
+class Firewall:
+    '''
+    Acompanha o estado aplicado no kernel (dono, regras e prefixos
+    agrupados) para que alterações nas regras sejam enviadas como
+    diferenças, sem limpar e reaplicar tudo. Com "auto_apply", inclusões e
+    remoções de regras do dono do firewall são aplicadas imediatamente.
+
+    As regras e os prefixos aplicados também ficam indexados por faixa de
+    endereços: cada regra alterada reagrupa somente a rede que a contém,
+    sem reagrupar as demais regras.
+    '''
+
+    backend: FirewallBackend
+    auto_apply: bool
+    owner_id: Optional[str]
+    rules: Optional[Dict[str, str]]
+    applied: Optional[Dict[str, str]]
+    rule_index: RuleIndex
+    applied_index: RuleIndex
+    order_counts: List[int]
+
+    def __init__(self, backend: FirewallBackend = None, auto_apply: bool = False):
+        self.backend = backend or ScriptBackend()
+        self.auto_apply = auto_apply
+        self.owner_id = None
+        self.lock = RLock()
+        self.set_state(None, None)
+
+    def is_running(self) -> bool:
+        return self.applied is not None
+
+    def get_entry_counts(self) -> Tuple[int, int]:
+        '''
+        Retorna a quantidade de regras do dono e de prefixos aplicados no
+        kernel após o agrupamento.
+        '''
+
+        with self.lock:
+            if not self.is_running():
+                return 0, 0
+
+            return len(self.rules), len(self.applied)
+
+    def start(self, owner_id: str, rules: List[AddressAction]) -> bool:
+        '''
+        Aplica as regras no kernel. Com o firewall já em execução, envia
+        somente as diferenças em relação aos prefixos aplicados.
+        '''
+
+        with self.lock:
+            if self.is_running():
+                if self.apply_rules(dict(rules)) is None:
+                    return False
+
+                self.owner_id = owner_id
+                return True
+
+            aggregated = self.backend.aggregate(rules)
+
+            started = perf_counter()
+            with trace_span('script'):
+                result = self.backend.start(aggregated)
+            get_metrics().observe_firewall('start', perf_counter() - started)
+
+            self.owner_id = owner_id
+
+            if result:
+                self.set_state(dict(rules), aggregated)
+            else:
+                self.set_state(None, None)
+
+            return result
+
+    def stop(self) -> bool:
+        with self.lock:
+            started = perf_counter()
+            with trace_span('script'):
+                result = self.backend.stop()
+            get_metrics().observe_firewall('stop', perf_counter() - started)
+
+            self.owner_id = None
+            self.set_state(None, None)
+
+            return result
+
+    def set_state(
+        self,
+        rules: Optional[Dict[str, str]],
+        applied: Optional[List[AddressAction]]
+    ):
+        '''
+        Registra as regras e os prefixos aplicados no kernel, reconstruindo
+        os índices e a contagem de prefixos de cada ordem. Deve ser chamado
+        com o lock adquirido.
+        '''
+
+        self.rules = rules
+        self.applied = dict(applied) if applied is not None else None
+        self.rule_index = RuleIndex()
+        self.applied_index = RuleIndex()
+        self.order_counts = [0] * (UNPARSED_ORDER + 1)
+
+        for address in self.rules or ():
+            self.rule_index.add(address, address, bulk=True)
+
+        for address in self.applied or ():
+            self.applied_index.add(address, address, bulk=True)
+            self.order_counts[get_entry_order(address)] += 1
+
+    def set_rule(self, address: str, action: Optional[str]):
+        '''
+        Inclui, altera ou (com "action" None) remove uma regra do estado.
+        '''
+
+        set_indexed(self.rules, self.rule_index, address, action)
+
+    def set_applied(self, address: str, action: Optional[str]):
+        '''
+        Inclui, altera ou (com "action" None) remove um prefixo aplicado.
+        '''
+
+        set_indexed(self.applied, self.applied_index, address, action)
+
+    def get_positions(self, added: List[AddressAction]) -> Optional[List[int]]:
+        '''
+        Nos backends ordenados, retorna a posição na cadeia (em prefixos, a
+        partir de 0) em que cada prefixo incluído deve ser inserido: logo
+        após os mais específicos, já aplicados ou incluídos antes dele. As
+        remoções são feitas depois das inclusões, sem alterar as posições.
+        Deve ser chamado com o lock adquirido.
+        '''
+
+        if not self.backend.ordered:
+            return None
+
+        counts = list(self.order_counts)
+        positions = []
+
+        for address, _ in added:
+            order = get_entry_order(address)
+            positions.append(sum(counts[order + 1:]))
+            counts[order] += 1
+
+        return positions
+
+    def send_changes(
+        self,
+        added: List[AddressAction],
+        removed: List[AddressAction]
+    ) -> bool:
+        '''
+        Envia os prefixos incluídos e removidos ao backend e, em caso de
+        sucesso, atualiza a contagem de prefixos de cada ordem. Deve ser
+        chamado com o lock adquirido.
+        '''
+
+        if not (added or removed):
+            return True
+
+        positions = self.get_positions(added)
+
+        started = perf_counter()
+        with trace_span('script'):
+            result = self.backend.apply_changes(added, removed, positions)
+        get_metrics().observe_firewall('apply', perf_counter() - started)
+
+        if not result:
+            return False
+
+        for address, _ in added:
+            self.order_counts[get_entry_order(address)] += 1
+
+        for address, _ in removed:
+            self.order_counts[get_entry_order(address)] -= 1
+
+        return True
+
+    def get_changes(self, rules: List[AddressAction]):
+        '''
+        Compara os prefixos desejados com os aplicados. Deve ser chamado
+        com o lock adquirido.
+        '''
+
+        desired = dict(rules)
+
+        added = [
+            (address, action) for address, action in rules
+            if self.applied.get(address) != action
+        ]
+        removed = [
+            (address, action) for address, action in self.applied.items()
+            if desired.get(address) != action
+        ]
+
+        return added, removed
+
+    def apply_rules(self, rules: Dict[str, str]):
+        '''
+        Agrupa todas as regras e envia ao kernel somente os prefixos
+        alterados. Retorna a quantidade de prefixos adicionados e
+        removidos, ou None em caso de erro. Deve ser chamado com o lock
+        adquirido.
+        '''
+
+        aggregated = self.backend.aggregate(list(rules.items()))
+        added, removed = self.get_changes(aggregated)
+
+        if not self.send_changes(added, removed):
+            return None
+
+        self.set_state(rules, aggregated)
+
+        return len(added), len(removed)
+
+    def get_rule_intervals(
+        self,
+        network: Tuple[int, int]
+    ) -> List[Tuple[int, int, str]]:
+        '''
+        Retorna as faixas (início, fim, ação) das regras contidas na rede.
+        '''
+
+        return [
+            (*self.rule_index.ranges[address], self.rules[address])
+            for address in self.rule_index.iterate(network=network)
+        ]
+
+    def get_nested_region(
+        self,
+        network: Tuple[int, int],
+        old_action: Optional[str]
+    ) -> Tuple[Tuple[int, int], List[AddressAction]]:
+        '''
+        Reagrupa, para os backends ordenados, a menor rede que contém a
+        regra alterada (de faixa "network") e cuja ação após a união das
+        redes irmãs não mudou: as redes de fora dela não são afetadas.
+        Retorna a rede e seus novos prefixos.
+        '''
+
+        changed = network
+        start, end = network
+
+        while True:
+            length = get_prefix_length(start, end)
+            intervals = self.get_rule_intervals((start, end))
+
+            old_intervals = [
+                interval for interval in intervals if interval[:2] != changed
+            ]
+
+            if old_action is not None:
+                old_intervals.append((*changed, old_action))
+
+            nodes = merge_nested_ranges(intervals, length)
+            old_nodes = merge_nested_ranges(old_intervals, length)
+
+            node = (start, length)
+
+            if length == 0 or nodes.get(node) == old_nodes.get(node):
+                break
+
+            start, end = get_supernet_ranges(start, end)[-2]
+
+        # A rede continua aplicada (ou não) como antes: se não estava
+        # aplicada, sua ação é a mesma herdada das redes que a contêm.
+        if length > 0 and (start, end) not in self.applied_index.ids_by_range:
+            nodes.pop((start, length), None)
+
+        inherited = find_action(self.applied, self.applied_index, (start, end))
+        entries = [
+            (format_range(entry_start, entry_end), action)
+            for entry_start, entry_end, action in prune_nested_nodes(nodes, inherited)
+        ]
+
+        return (start, end), entries
+
+    def get_flat_region(
+        self,
+        network: Tuple[int, int]
+    ) -> Tuple[Tuple[int, int], List[AddressAction]]:
+        '''
+        Reagrupa, para os backends sem sobreposição, a menor rede que
+        contém a regra alterada (de faixa "network") e os prefixos
+        aplicados que a contêm, e que não ficou com uma única ação: as
+        faixas de fora dela não são afetadas. Retorna a rede e seus novos
+        prefixos.
+        '''
+
+        for network_range in get_supernet_ranges(*network):
+            if network_range in self.applied_index.ids_by_range:
+                network = network_range
+                break
+
+        while True:
+            inherited = find_action(self.rules, self.rule_index, network)
+            entries = aggregate_ranges(
+                self.get_rule_intervals(network), network, inherited
+            )
+
+            uniform = len(entries) == 1 and entries[0][0] == format_range(*network)
+
+            if not uniform or network == (0, MAX_ADDRESS):
+                return network, entries
+
+            network = get_supernet_ranges(*network)[-2]
+
+    def update_region(
+        self,
+        address: str,
+        old_action: Optional[str],
+        original: Dict[str, Optional[str]]
+    ):
+        '''
+        Atualiza os prefixos aplicados após a alteração da regra do
+        endereço, reagrupando somente a rede afetada. As ações anteriores
+        dos prefixos alterados são registradas em "original". Deve ser
+        chamado com o lock adquirido.
+        '''
+
+        try:
+            network = get_network_range(address)
+        except ValueError:
+            network = None
+
+        if network is None:
+            # Endereços inválidos são aplicados como estão, sem agrupamento.
+            entries = []
+            old_entries = []
+
+            if address in self.rules:
+                entries.append((address, self.rules[address]))
+
+            if address in self.applied:
+                old_entries.append((address, self.applied[address]))
+        else:
+            if self.backend.ordered:
+                network, entries = self.get_nested_region(network, old_action)
+            else:
+                network, entries = self.get_flat_region(network)
+
+            old_entries = [
+                (prefix, self.applied[prefix])
+                for prefix in self.applied_index.iterate(network=network)
+            ]
+
+        desired = dict(entries)
+
+        for prefix, action in old_entries:
+            if desired.get(prefix) != action:
+                original.setdefault(prefix, action)
+                self.set_applied(prefix, None)
+
+        for prefix, action in entries:
+            if self.applied.get(prefix) != action:
+                original.setdefault(prefix, self.applied.get(prefix))
+                self.set_applied(prefix, action)
+
+    def apply_changes(
+        self,
+        added: List[AddressAction],
+        removed: List[AddressAction]
+    ) -> bool:
+        '''
+        Envia ao kernel somente os prefixos alterados pelas regras
+        incluídas e removidas. Cada regra reagrupa apenas a rede que a
+        contém; alterações em muitas regras de uma vez reagrupam todas.
+        '''
+
+        with self.lock:
+            if not self.is_running():
+                return True
+
+            removed = [r for r in removed if self.rules.get(r[0]) == r[1]]
+            added = [r for r in added if self.rules.get(r[0]) != r[1]]
+
+            if not (added or removed):
+                return True
+
+            changes = [(address, None) for address, _ in removed]
+            changes.extend(added)
+
+            if len(changes) * FULL_AGGREGATION_RATIO > len(self.rules):
+                rules = dict(self.rules)
+
+                for address, action in changes:
+                    if action is None:
+                        rules.pop(address, None)
+                    else:
+                        rules[address] = action
+
+                return self.apply_rules(rules) is not None
+
+            original_rules = {}
+            original_applied = {}
+
+            for address, action in changes:
+                old_action = self.rules.get(address)
+                original_rules.setdefault(address, old_action)
+
+                self.set_rule(address, action)
+                self.update_region(address, old_action, original_applied)
+
+            added = [
+                (prefix, self.applied[prefix])
+                for prefix, action in original_applied.items()
+                if self.applied.get(prefix) not in (None, action)
+            ]
+            removed = [
+                (prefix, action)
+                for prefix, action in original_applied.items()
+                if action is not None and self.applied.get(prefix) != action
+            ]
+
+            if self.send_changes(added, removed):
+                return True
+
+            for address, action in original_rules.items():
+                self.set_rule(address, action)
+
+            for prefix, action in original_applied.items():
+                self.set_applied(prefix, action)
+
+            return False
+
+    def sync(self, rules: List[AddressAction]):
+        '''
+        Reconcilia o kernel com todas as regras do dono. Retorna a
+        quantidade de prefixos adicionados e removidos, ou None em caso de
+        erro.
+        '''
+
+        with self.lock:
+            if not self.is_running():
+                return None
+
+            return self.apply_rules(dict(rules))
+
+
+_firewall = None
+
+
+def set_firewall(firewall: Firewall):
+    global _firewall
+    _firewall = firewall
+
+
+def get_firewall() -> Firewall:
+    global _firewall
+
+    if _firewall is None:
+        _firewall = Firewall()
+
+    return _firewall
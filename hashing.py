@@ -0,0 +1,148 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+
+from bcrypt import checkpw, gensalt, hashpw
+
+from tracing import trace_span
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_LIMIT = 16
+DEFAULT_ROUNDS = 12
+
+
+class HasherBusyError(Exception):
+    pass
+
+
+class PasswordHasher:
+    '''
+    Executa o bcrypt em um pool dedicado e limitado de threads, para que
+    rajadas de "user create"/"user login" não ocupem todos os núcleos. Se
+    já houver "queue_limit" requisições aguardando, novas requisições são
+    recusadas imediatamente com HasherBusyError.
+    '''
+
+    workers: int
+    queue_limit: int
+    rounds: int
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        queue_limit: int = DEFAULT_QUEUE_LIMIT,
+        rounds: int = DEFAULT_ROUNDS
+    ):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.rounds = rounds
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='bcrypt')
+        self.slots = BoundedSemaphore(workers + queue_limit)
+        self.lock = Lock()
+
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def run(self, function, *args):
+        '''
+        Envia a função ao pool e aguarda o resultado.
+        '''
+
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+
+            raise HasherBusyError()
+
+        with self.lock:
+            self.pending += 1
+
+        try:
+            with trace_span('bcrypt'):
+                future = self.executor.submit(
+                    self.measure, perf_counter(), function, args
+                )
+                return future.result()
+        finally:
+            self.slots.release()
+
+    def measure(self, submitted_at: float, function, args):
+        started_at = perf_counter()
+
+        try:
+            return function(*args)
+        finally:
+            finished_at = perf_counter()
+            latency = finished_at - started_at
+
+            with self.lock:
+                self.pending -= 1
+                self.completed += 1
+                self.total_wait += started_at - submitted_at
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+
+    def limit_callers(self, limit: int):
+        '''
+        Limita a "limit" as requisições admitidas (em execução e na fila).
+        Cada requisição admitida bloqueia a thread que a chamou; o servidor
+        async usa um limite menor que o seu pool de comandos, para que uma
+        rajada de logins não ocupe todas as threads. Deve ser chamado antes
+        de o servidor aceitar conexões.
+        '''
+
+        admitted = max(min(self.workers + self.queue_limit, limit), 1)
+        self.queue_limit = max(admitted - self.workers, 0)
+        self.slots = BoundedSemaphore(admitted)
+
+    def hash_password(self, password: str) -> bytes:
+        return self.run(hashpw, password.encode('utf8'), gensalt(self.rounds))
+
+    def check_password(self, password: str, hashed_password: str) -> bool:
+        return self.run(
+            checkpw,
+            password.encode('utf8'),
+            hashed_password.encode('utf8')
+        )
+
+    def get_metrics(self):
+        '''
+        Retorna a profundidade da fila e as latências acumuladas do hash.
+        '''
+
+        with self.lock:
+            completed = self.completed or 1
+
+            return {
+                'queue_depth': max(self.pending - self.workers, 0),
+                'pending': self.pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'average_wait': self.total_wait / completed,
+                'average_latency': self.total_latency / completed,
+                'max_latency': self.max_latency
+            }
+
+
+_password_hasher = None
+_password_hasher_lock = Lock()
+
+
+def set_password_hasher(password_hasher: PasswordHasher):
+    global _password_hasher
+    _password_hasher = password_hasher
+
+
+def get_password_hasher() -> PasswordHasher:
+    global _password_hasher
+
+    if _password_hasher is None:
+        with _password_hasher_lock:
+            if _password_hasher is None:
+                _password_hasher = PasswordHasher()
+
+    return _password_hasher
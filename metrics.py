@@ -0,0 +1,329 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import monotonic
+from typing import Dict, List, Tuple
+
+from hashing import get_password_hasher
+
+# Limites superiores (em segundos) dos intervalos dos histogramas.
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+METRICS_PREFIX = 'iptables_server'
+DEFAULT_METRICS_HOST = 'localhost'
+
+# Pares (comando, ação) usados como rótulos das requisições.
+RequestLabels = Tuple[str, str]
+
+
+class Histogram:
+    '''
+    Histograma cumulativo no formato do Prometheus: contagem por intervalo
+    de latência, soma e total de observações. Não é thread-safe: o
+    chamador deve sincronizar o acesso.
+    '''
+
+    counts: List[int]
+    total: float
+    count: int
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def get_cumulative_counts(self) -> List[Tuple[str, int]]:
+        result = []
+        cumulative = 0
+
+        for bound, count in zip((*LATENCY_BUCKETS, '+Inf'), self.counts):
+            cumulative += count
+            result.append((str(bound), cumulative))
+
+        return result
+
+    def get_quantile(self, quantile: float) -> float:
+        '''
+        Estima o quantil pelo limite superior do intervalo em que ele cai.
+        '''
+
+        target = quantile * self.count
+        cumulative = 0
+
+        for bound, count in zip((*LATENCY_BUCKETS, float('inf')), self.counts):
+            cumulative += count
+
+            if count and cumulative >= target:
+                return bound
+
+        return 0.0
+
+
+class RequestStats:
+    count: int
+    errors: int
+    latency: Histogram
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latency = Histogram()
+
+
+class Metrics:
+    '''
+    Contadores e histogramas do servidor: requisições por comando e ação,
+    conexões ativas, tempos do banco de dados e da aplicação das regras no
+    kernel. Cada observação custa uma busca binária sob um único lock.
+    '''
+
+    requests: Dict[RequestLabels, RequestStats]
+    database: Dict[str, Histogram]
+    firewall: Dict[str, Histogram]
+    active_connections: int
+
+    def __init__(self):
+        self.lock = Lock()
+        self.started_at = monotonic()
+        self.requests = {}
+        self.database = {}
+        self.firewall = {}
+        self.active_connections = 0
+
+    def observe_request(self, labels: RequestLabels, error: bool, elapsed: float):
+        with self.lock:
+            stats = self.requests.get(labels)
+
+            if stats is None:
+                stats = self.requests[labels] = RequestStats()
+
+            stats.count += 1
+            stats.errors += error
+            stats.latency.observe(elapsed)
+
+    def observe(
+        self,
+        histograms: Dict[str, Histogram],
+        operation: str,
+        elapsed: float
+    ):
+        with self.lock:
+            histogram = histograms.get(operation)
+
+            if histogram is None:
+                histogram = histograms[operation] = Histogram()
+
+            histogram.observe(elapsed)
+
+    def observe_database(self, operation: str, elapsed: float):
+        self.observe(self.database, operation, elapsed)
+
+    def observe_firewall(self, operation: str, elapsed: float):
+        self.observe(self.firewall, operation, elapsed)
+
+    def connection_opened(self):
+        with self.lock:
+            self.active_connections += 1
+
+    def connection_closed(self):
+        with self.lock:
+            self.active_connections -= 1
+
+    def summarize_histogram(self, histogram: Histogram):
+        count = histogram.count
+
+        return {
+            'count': count,
+            'average_ms': histogram.total / count * 1000 if count else 0.0,
+            'p50_ms': histogram.get_quantile(0.5) * 1000,
+            'p99_ms': histogram.get_quantile(0.99) * 1000
+        }
+
+    def get_stats(self) -> dict:
+        '''
+        Retorna um resumo das métricas, com latências médias e quantis
+        estimados pelos histogramas.
+        '''
+
+        with self.lock:
+            return {
+                'uptime': monotonic() - self.started_at,
+                'active_connections': self.active_connections,
+                'requests': [
+                    {
+                        'command': command,
+                        'action': action,
+                        'errors': stats.errors,
+                        **self.summarize_histogram(stats.latency)
+                    }
+                    for (command, action), stats in sorted(self.requests.items())
+                ],
+                'database': {
+                    operation: self.summarize_histogram(histogram)
+                    for operation, histogram in sorted(self.database.items())
+                },
+                'firewall': {
+                    operation: self.summarize_histogram(histogram)
+                    for operation, histogram in sorted(self.firewall.items())
+                },
+                'bcrypt': get_password_hasher().get_metrics()
+            }
+
+    def render_histogram(
+        self,
+        lines: List[str],
+        name: str,
+        labels: str,
+        histogram: Histogram
+    ):
+        for bound, count in histogram.get_cumulative_counts():
+            lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {count}')
+
+        lines.append(f'{name}_sum{{{labels.rstrip(",")}}} {histogram.total}')
+        lines.append(f'{name}_count{{{labels.rstrip(",")}}} {histogram.count}')
+
+    def render_header(self, lines: List[str], name: str, kind: str, description: str):
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    def render(self) -> str:
+        '''
+        Formata as métricas no formato de texto do Prometheus.
+        '''
+
+        prefix = METRICS_PREFIX
+        lines = []
+
+        with self.lock:
+            requests = sorted(self.requests.items())
+
+            self.render_header(
+                lines, f'{prefix}_requests_total', 'counter',
+                'Requisições por comando e ação.'
+            )
+            for (command, action), stats in requests:
+                labels = f'command="{command}",action="{action}"'
+                lines.append(f'{prefix}_requests_total{{{labels}}} {stats.count}')
+
+            self.render_header(
+                lines, f'{prefix}_request_errors_total', 'counter',
+                'Requisições com erro.'
+            )
+            for (command, action), stats in requests:
+                labels = f'command="{command}",action="{action}"'
+                lines.append(
+                    f'{prefix}_request_errors_total{{{labels}}} {stats.errors}'
+                )
+
+            self.render_header(
+                lines, f'{prefix}_request_duration_seconds', 'histogram',
+                'Tempo de execução e codificação das requisições.'
+            )
+            for (command, action), stats in requests:
+                self.render_histogram(
+                    lines,
+                    f'{prefix}_request_duration_seconds',
+                    f'command="{command}",action="{action}",',
+                    stats.latency
+                )
+
+            self.render_header(
+                lines, f'{prefix}_active_connections', 'gauge',
+                'Conexões abertas.'
+            )
+            lines.append(f'{prefix}_active_connections {self.active_connections}')
+
+            for name, histograms, description in [
+                (
+                    'database_duration_seconds', self.database,
+                    'Tempo de carga e gravação do banco de dados.'
+                ),
+                (
+                    'iptables_duration_seconds', self.firewall,
+                    'Tempo de aplicação das regras no kernel.'
+                )
+            ]:
+                self.render_header(
+                    lines, f'{prefix}_{name}', 'histogram', description
+                )
+
+                for operation, histogram in sorted(histograms.items()):
+                    self.render_histogram(
+                        lines,
+                        f'{prefix}_{name}',
+                        f'operation="{operation}",',
+                        histogram
+                    )
+
+        hasher_metrics = get_password_hasher().get_metrics()
+
+        for key in ('queue_depth', 'pending'):
+            self.render_header(
+                lines, f'{prefix}_bcrypt_{key}', 'gauge',
+                f'Hash de senhas: {key}.'
+            )
+            lines.append(f'{prefix}_bcrypt_{key} {hasher_metrics[key]}')
+
+        counters = {
+            'completed': 'Hashes de senha concluídos.',
+            'rejected': 'Hashes de senha recusados com a fila cheia.'
+        }
+
+        for key, description in counters.items():
+            self.render_header(
+                lines, f'{prefix}_bcrypt_{key}_total', 'counter', description
+            )
+            lines.append(f'{prefix}_bcrypt_{key}_total {hasher_metrics[key]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+
+        content = get_metrics().render().encode('utf8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(Thread):
+    '''
+    Expõe as métricas em GET /metrics, em uma porta separada da porta de
+    comandos.
+    '''
+
+    def __init__(self, port: int, host: str = DEFAULT_METRICS_HOST):
+        Thread.__init__(self, daemon=True)
+        self.http_server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+
+    def run(self):
+        self.http_server.serve_forever()
+
+
+_metrics = Metrics()
+
+
+def set_metrics(metrics: Metrics):
+    global _metrics
+    _metrics = metrics
+
+
+def get_metrics() -> Metrics:
+    return _metrics
@@ -1,12 +1,15 @@
-from bcrypt import gensalt, hashpw, checkpw
+from typing import Dict, Set, Tuple
 from uuid import uuid1
 
+from hashing import get_password_hasher
+
 
 class User:
     id: str
     name: str
     email: str
     password: bytes
+    dummy_password_hash: str = None
 
     def __init__(self, name: str = '', email: str = '', password: str = ''):
         self.id = str(uuid1())
@@ -16,7 +19,8 @@ class User:
 
     @staticmethod
     def new_from_dict(id, user_dict):
-        result = User()
+        # Evita o __init__, que calcularia um hash bcrypt desnecessário.
+        result = User.__new__(User)
 
         result.id = id
         result.email = user_dict['email']
@@ -26,17 +30,30 @@ class User:
         return result
 
     def encrypt_password(self, password: str):
-        return hashpw(password.encode('utf8'), gensalt())
+        return get_password_hasher().hash_password(password)
 
     @staticmethod
     def check_password(password: str, hashed_password: str):
-        validation = checkpw(
-            password.encode('utf8'),
-            hashed_password.encode('utf8')
+        validation = get_password_hasher().check_password(
+            password,
+            hashed_password
         )
 
         return validation
 
+    @classmethod
+    def get_dummy_password_hash(cls):
+        '''
+        Hash gerado uma única vez, usado para verificar senhas de e-mails
+        inexistentes com o mesmo custo de um usuário real.
+        '''
+
+        if cls.dummy_password_hash is None:
+            password_hash = get_password_hasher().hash_password('')
+            cls.dummy_password_hash = password_hash.decode('utf8')
+
+        return cls.dummy_password_hash
+
     def get(self):
         return {
             'name': self.name,
@@ -62,3 +79,23 @@ class Rule:
             'ip': self.ip,
             'action': self.action,
         }
+
+
+class RuleImport:
+    '''
+    Regras recebidas em uma importação em andamento, indexadas pelo
+    endereço junto ao número da linha de origem.
+    '''
+
+    user_id: str
+    existing_addresses: Set[str]
+    rules: Dict[str, Tuple[int, str]]
+    line_count: int
+    error_count: int
+
+    def __init__(self, user_id: str, existing_addresses: Set[str]):
+        self.user_id = user_id
+        self.existing_addresses = existing_addresses
+        self.rules = {}
+        self.line_count = 0
+        self.error_count = 0
@@ -0,0 +1,241 @@
+from asyncio import IncompleteReadError, StreamReader
+from json import dumps, loads
+from socket import IPPROTO_TCP, TCP_NODELAY, SocketType
+from struct import Struct
+from typing import Any, Callable, List, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Cabeçalho de cada quadro: tamanho do conteúdo e id da requisição.
+HEADER = Struct('!II')
+MAX_PAYLOAD_SIZE = 64 * 1024 * 1024
+
+# Codificações das respostas, negociadas por conexão com "encoding". Em
+# "text" a mensagem é formatada para leitura; nas demais os comandos que
+# retornam ResponseData enviam somente os dados.
+TEXT_ENCODING = 'text'
+RESPONSE_ENCODINGS = (TEXT_ENCODING, 'json', 'msgpack')
+
+Frame = Tuple[int, bytes]
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class ResponseData:
+    '''
+    Resposta com dados estruturados (ids, endereços, ações, tempos). O
+    texto para leitura só é gerado, pelo "formatter", quando a conexão usa
+    a codificação "text".
+    '''
+
+    data: Any
+    formatter: Callable[[Any], str]
+
+    def __init__(self, data, formatter: Callable[[Any], str]):
+        self.data = data
+        self.formatter = formatter
+
+    def __str__(self):
+        return self.formatter(self.data)
+
+
+def get_available_encodings() -> List[str]:
+    '''
+    Retorna as codificações suportadas; "msgpack" depende do pacote
+    opcional de mesmo nome.
+    '''
+
+    return [
+        encoding for encoding in RESPONSE_ENCODINGS
+        if encoding != 'msgpack' or msgpack is not None
+    ]
+
+
+def encode_response(code: int, message, encoding: str = TEXT_ENCODING) -> bytes:
+    '''
+    Codifica a resposta de um comando. Em "text" o código e a mensagem
+    formatada são enviados como texto; nas demais codificações o código é
+    numérico e, para ResponseData, os dados vão no campo "data".
+    '''
+
+    if encoding == TEXT_ENCODING:
+        response_object = {
+            "code": str(code),
+            "message": str(message)
+        }
+
+        return dumps(response_object).encode('utf8')
+
+    response_object = {'code': int(code)}
+
+    if isinstance(message, ResponseData):
+        response_object['data'] = message.data
+    else:
+        response_object['message'] = message
+
+    if encoding == 'msgpack':
+        return msgpack.packb(response_object)
+
+    return dumps(
+        response_object, ensure_ascii=False, separators=(',', ':')
+    ).encode('utf8')
+
+
+def decode_response(payload: bytes, encoding: str = TEXT_ENCODING) -> dict:
+    '''
+    Operação inversa de encode_response.
+    '''
+
+    if encoding == 'msgpack':
+        return msgpack.unpackb(payload)
+
+    return loads(payload.decode('utf8'))
+
+
+def encode_frame(request_id: int, payload: bytes) -> bytes:
+    '''
+    Monta um quadro com o cabeçalho seguido do conteúdo.
+    '''
+
+    if len(payload) > MAX_PAYLOAD_SIZE:
+        raise ProtocolError('Quadro excede o tamanho máximo permitido!')
+
+    return HEADER.pack(len(payload), request_id) + payload
+
+
+def parse_header(header: bytes) -> Tuple[int, int]:
+    size, request_id = HEADER.unpack(header)
+
+    if size > MAX_PAYLOAD_SIZE:
+        raise ProtocolError('Quadro excede o tamanho máximo permitido!')
+
+    return size, request_id
+
+
+def disable_nagle(conn: SocketType):
+    '''
+    Envia quadros pequenos imediatamente, evitando que respostas enviadas
+    em sequência aguardem o ACK da anterior.
+    '''
+
+    conn.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+
+def recv_exactly(conn: SocketType, size: int) -> Optional[bytes]:
+    '''
+    Lê exatamente "size" bytes do socket, retornando None se a conexão for
+    encerrada antes disso.
+    '''
+
+    buffer = bytearray()
+
+    while len(buffer) < size:
+        chunk = conn.recv(min(size - len(buffer), 65536))
+
+        if not chunk:
+            return None
+
+        buffer.extend(chunk)
+
+    return bytes(buffer)
+
+
+def recv_frame(conn: SocketType) -> Optional[Frame]:
+    '''
+    Lê um quadro completo do socket. Retorna None quando a conexão é
+    encerrada.
+    '''
+
+    header = recv_exactly(conn, HEADER.size)
+    if header is None:
+        return None
+
+    size, request_id = parse_header(header)
+
+    payload = recv_exactly(conn, size)
+    if payload is None:
+        return None
+
+    return request_id, payload
+
+
+async def read_frame(reader: StreamReader) -> Optional[Frame]:
+    '''
+    Versão assíncrona de recv_frame para uso com asyncio.
+    '''
+
+    try:
+        header = await reader.readexactly(HEADER.size)
+        size, request_id = parse_header(header)
+        payload = await reader.readexactly(size)
+    except IncompleteReadError:
+        return None
+
+    return request_id, payload
+
+
+class FramedConnection:
+    '''
+    Envia comandos e recebe respostas identificadas por id sobre um socket,
+    permitindo enviar vários comandos antes de ler as respostas.
+    '''
+
+    conn: SocketType
+    next_request_id: int
+    encoding: str
+
+    def __init__(self, conn: SocketType):
+        self.conn = conn
+        self.next_request_id = 1
+        self.encoding = TEXT_ENCODING
+
+        disable_nagle(conn)
+
+    def get_next_request_id(self) -> int:
+        request_id = self.next_request_id
+        self.next_request_id = (self.next_request_id + 1) % (1 << 32)
+
+        return request_id
+
+    def send(self, command: str) -> int:
+        request_id = self.get_next_request_id()
+        self.conn.sendall(encode_frame(request_id, command.encode('utf8')))
+        return request_id
+
+    def send_many(self, commands) -> list:
+        '''
+        Envia vários comandos de uma vez, sem aguardar as respostas.
+        '''
+
+        request_ids = []
+        frames = bytearray()
+
+        for command in commands:
+            request_id = self.get_next_request_id()
+            frames.extend(encode_frame(request_id, command.encode('utf8')))
+            request_ids.append(request_id)
+
+        self.conn.sendall(frames)
+        return request_ids
+
+    def receive(self) -> Optional[Frame]:
+        return recv_frame(self.conn)
+
+    def receive_response(self, request_id: int) -> Optional[dict]:
+        '''
+        Lê a resposta da requisição, decodificada conforme a codificação
+        em uso. Retorna None se a conexão for encerrada ou se o id não
+        corresponder ao esperado.
+        '''
+
+        frame = self.receive()
+
+        if not frame or frame[0] != request_id:
+            return None
+
+        return decode_response(frame[1], self.encoding)
@@ -0,0 +1,345 @@
+from bisect import bisect_left, bisect_right, insort
+from functools import lru_cache
+from ipaddress import IPv4Network
+from socket import AF_INET, inet_ntop, inet_pton
+from typing import Dict, Iterator, List, Optional, Tuple
+
+MAX_ADDRESS = (1 << 32) - 1
+# Faixa atribuída a regras com endereços inválidos, gravadas antes da
+# validação: ordenadas antes das demais e sem sobreposição com nenhuma.
+INVALID_RANGE = (-1, -1)
+
+# Tipos de conflito encontrados entre regras.
+SHADOWED = 'shadowed'
+CONFLICT = 'conflict'
+OVERLAP = 'overlap'
+
+# Trios (tipo, id da regra, id da regra que a contém).
+RuleConflict = Tuple[str, str, str]
+
+
+def parse_network(address: str) -> IPv4Network:
+    '''
+    Converte um endereço ("a.b.c.d") ou rede ("a.b.c.d/n") IPv4 em rede.
+    Lança ValueError se o texto não for válido.
+    '''
+
+    return IPv4Network(address, strict=False)
+
+
+def format_network(network: IPv4Network) -> str:
+    '''
+    Formata a rede como é gravada nas regras: endereços individuais sem o
+    sufixo "/32".
+    '''
+
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+
+    return str(network)
+
+
+@lru_cache(maxsize=1 << 18)
+def get_network_range(address: str) -> Tuple[int, int]:
+    '''
+    Retorna o primeiro e o último endereço da rede como inteiros. O
+    resultado fica em cache, já que as mesmas regras são reagrupadas a
+    cada alteração.
+
+    Endereços "a.b.c.d" e "a.b.c.d/n" são convertidos diretamente pelo
+    inet_pton, tão estrito quanto o ipaddress e muito mais rápido; as
+    demais formas são delegadas ao parse_network.
+    '''
+
+    host, separator, prefix = address.partition('/')
+
+    is_number = prefix.isascii() and prefix.isdigit() and str(int(prefix)) == prefix
+
+    if not separator or is_number:
+        try:
+            start = int.from_bytes(inet_pton(AF_INET, host), 'big')
+        except OSError:
+            start = None
+
+        length = int(prefix) if separator else 32
+
+        if start is not None and length <= 32:
+            host_mask = MAX_ADDRESS >> length
+            start &= ~host_mask
+            return start, start | host_mask
+
+    network = parse_network(address)
+    return int(network.network_address), int(network.broadcast_address)
+
+
+def normalize_network(address: str) -> str:
+    '''
+    Valida o endereço ou rede e o retorna no formato gravado nas regras,
+    o mesmo de format_network. Lança ValueError se não for válido.
+    '''
+
+    return format_range(*get_network_range(address))
+
+
+def get_prefix_length(start: int, end: int) -> int:
+    '''
+    Retorna o tamanho do prefixo da rede CIDR com a faixa passada.
+    '''
+
+    return 33 - (end - start + 1).bit_length()
+
+
+def format_range(start: int, end: int) -> str:
+    '''
+    Formata a faixa de uma rede CIDR como format_network, sem construir
+    um IPv4Network.
+    '''
+
+    host = inet_ntop(AF_INET, start.to_bytes(4, 'big'))
+
+    if start == end:
+        return host
+
+    return f'{host}/{get_prefix_length(start, end)}'
+
+
+def get_rule_range(address: str) -> Tuple[int, int]:
+    '''
+    Como get_network_range, mas retorna INVALID_RANGE para endereços
+    inválidos em vez de lançar ValueError.
+    '''
+
+    try:
+        return get_network_range(address)
+    except ValueError:
+        return INVALID_RANGE
+
+
+def get_supernet_ranges(start: int, end: int) -> List[Tuple[int, int]]:
+    '''
+    Retorna as faixas de todas as redes que contêm a faixa passada,
+    incluindo ela mesma: no máximo uma por tamanho de prefixo.
+    '''
+
+    prefixlen = get_prefix_length(start, end)
+    result = []
+
+    for length in range(prefixlen + 1):
+        host_mask = MAX_ADDRESS >> length
+        network_start = start & ~host_mask & MAX_ADDRESS
+        result.append((network_start, network_start | host_mask))
+
+    return result
+
+
+class SortedKeys:
+    '''
+    Lista ordenada de chaves. Inclusões individuais são feitas por busca
+    binária; inclusões em lote ("bulk") são acumuladas no fim da lista e
+    ordenadas somente na próxima consulta, com uma única ordenação.
+    '''
+
+    keys: list
+
+    def __init__(self):
+        self.keys = []
+        self.is_sorted = True
+
+    def __len__(self):
+        return len(self.keys)
+
+    def sort(self):
+        if not self.is_sorted:
+            self.keys.sort()
+            self.is_sorted = True
+
+    def add(self, key, bulk: bool = False):
+        if bulk:
+            if self.keys and key < self.keys[-1]:
+                self.is_sorted = False
+
+            self.keys.append(key)
+            return
+
+        self.sort()
+        insort(self.keys, key)
+
+    def remove(self, key):
+        self.sort()
+        index = bisect_left(self.keys, key)
+
+        if index < len(self.keys) and self.keys[index] == key:
+            del self.keys[index]
+
+    def iterate(self, after=None, start=None) -> Iterator:
+        '''
+        Percorre as chaves em ordem a partir de "start" (inclusive) ou
+        depois de "after" (exclusive), o que vier por último.
+        '''
+
+        self.sort()
+        index = 0
+
+        if start is not None:
+            index = bisect_left(self.keys, start)
+
+        if after is not None:
+            index = max(index, bisect_right(self.keys, after))
+
+        while index < len(self.keys):
+            yield self.keys[index]
+            index += 1
+
+
+class RuleIndex:
+    '''
+    Índice das regras pela faixa numérica de endereços. Como redes CIDR
+    são aninhadas ou disjuntas, as redes que contêm um endereço são
+    encontradas por busca exata em cada tamanho de prefixo, e as contidas
+    nele por busca binária no início das faixas.
+
+    Não é thread-safe: o chamador deve sincronizar o acesso.
+    '''
+
+    ranges: Dict[str, Tuple[int, int]]
+    ids_by_range: Dict[Tuple[int, int], set]
+    starts: SortedKeys
+
+    def __init__(self):
+        self.ranges = {}
+        self.ids_by_range = {}
+        self.starts = SortedKeys()
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def add(self, id: str, address: str, bulk: bool = False):
+        network_range = get_rule_range(address)
+
+        self.ranges[id] = network_range
+        self.ids_by_range.setdefault(network_range, set()).add(id)
+        self.starts.add((network_range[0], id), bulk)
+
+    def remove(self, id: str):
+        network_range = self.ranges.pop(id, None)
+
+        if network_range is None:
+            return
+
+        ids = self.ids_by_range[network_range]
+        ids.discard(id)
+
+        if not ids:
+            del self.ids_by_range[network_range]
+
+        self.starts.remove((network_range[0], id))
+
+    def iterate(
+        self,
+        after: Optional[Tuple[int, str]] = None,
+        network: Optional[Tuple[int, int]] = None
+    ) -> Iterator[str]:
+        '''
+        Percorre os ids das regras em ordem de endereço, a partir da
+        posição "after" (início da faixa, id), exclusive. Com "network",
+        somente as regras contidas na faixa passada.
+        '''
+
+        start = end = None
+
+        if network is not None:
+            start, end = network
+
+        first = (start, '') if network is not None else None
+
+        for range_start, id in self.starts.iterate(after, first):
+            if network is not None:
+                if range_start > end:
+                    break
+
+                if self.ranges[id][1] > end:
+                    continue
+
+            yield id
+
+    def find_overlapping(self, address: str) -> List[str]:
+        '''
+        Retorna os ids das regras cujas redes contêm ou estão contidas na
+        rede do endereço passado.
+        '''
+
+        try:
+            start, end = get_network_range(address)
+        except ValueError:
+            return []
+
+        result = []
+
+        for network_range in get_supernet_ranges(start, end):
+            result.extend(self.ids_by_range.get(network_range, ()))
+
+        for id in self.iterate(network=(start, end)):
+            if self.ranges[id] != (start, end):
+                result.append(id)
+
+        return result
+
+
+def find_rule_conflicts(rules: Dict[str, dict]) -> List[RuleConflict]:
+    '''
+    Percorre as regras ordenadas por endereço uma única vez, mantendo a
+    pilha das redes que contêm a regra atual, e aponta para cada regra a
+    regra mais próxima que a contém:
+
+    - SHADOWED: do mesmo usuário e com a mesma ação (a regra é redundante);
+    - CONFLICT: do mesmo usuário e com ação diferente (exceção à regra);
+    - OVERLAP: de outro usuário.
+
+    Regras com endereços inválidos são ignoradas.
+    '''
+
+    intervals = []
+
+    for id, rule in rules.items():
+        try:
+            start, end = get_network_range(rule['ip'])
+        except ValueError:
+            continue
+
+        intervals.append((start, -end, id))
+
+    intervals.sort()
+
+    result = []
+    stack = []
+
+    for start, negative_end, id in intervals:
+        end = -negative_end
+        rule = rules[id]
+
+        while stack and stack[-1][0] < start:
+            stack.pop()
+
+        same_user = other_user = None
+
+        for _, other_id in reversed(stack):
+            other = rules[other_id]
+
+            if other['user_id'] == rule['user_id']:
+                same_user = same_user or other_id
+            else:
+                other_user = other_user or other_id
+
+            if same_user and other_user:
+                break
+
+        if same_user:
+            same_action = rules[same_user]['action'] == rule['action']
+            result.append((SHADOWED if same_action else CONFLICT, id, same_user))
+
+        if other_user:
+            result.append((OVERLAP, id, other_user))
+
+        stack.append((end, id))
+
+    return result
@@ -0,0 +1,111 @@
+from asyncio import StreamReader, StreamWriter, get_running_loop, run, start_server
+from concurrent.futures import ThreadPoolExecutor
+
+from server import DEFAULT_BACKLOG, Server
+from server_handler import RequestHandler
+from hashing import get_password_hasher
+from metrics import get_metrics
+from protocol import ProtocolError, encode_frame, read_frame
+from session import DEFAULT_IDLE_TIMEOUT, Session
+
+DEFAULT_WORKERS = 8
+
+
+class AsyncServer(Server):
+    '''
+    Servidor que atende todas as conexões em um único event loop, executando
+    os comandos (bcrypt, iptables, banco de dados) em um pool limitado de
+    threads.
+    '''
+
+    workers: int
+    executor: ThreadPoolExecutor
+    handler: RequestHandler
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        backlog: int = DEFAULT_BACKLOG,
+        workers: int = DEFAULT_WORKERS,
+        storage_backend: str = 'json',
+        database_name: str = None,
+        session_timeout: float = DEFAULT_IDLE_TIMEOUT
+    ):
+        Server.__init__(
+            self,
+            host,
+            port,
+            backlog,
+            storage_backend,
+            database_name,
+            session_timeout
+        )
+        self.workers = workers
+        self.handler = RequestHandler()
+
+    async def handle_client(self, reader: StreamReader, writer: StreamWriter):
+        '''
+        Atende um client conectado até que ele encerre a conexão. Os quadros
+        enviados em sequência pelo client são processados na ordem de chegada
+        e cada resposta leva o id da requisição correspondente.
+        '''
+
+        addr = writer.get_extra_info('peername')
+        client_address = f'{addr[0]}:{addr[1]}'
+        print(f'[+] Novo client: {client_address}')
+
+        loop = get_running_loop()
+        session = Session()
+        get_metrics().connection_opened()
+
+        try:
+            while True:
+                frame = await read_frame(reader)
+
+                if frame is None:
+                    break
+
+                request_id, data = frame
+                command = data.decode('utf8')
+                response = await loop.run_in_executor(
+                    self.executor,
+                    self.handler.handle_request,
+                    command,
+                    session
+                )
+
+                writer.write(encode_frame(request_id, response))
+                await writer.drain()
+        except (ConnectionError, ProtocolError):
+            pass
+        finally:
+            get_metrics().connection_closed()
+            writer.close()
+
+        print(f'[-] Client desconectou: {client_address}')
+
+    async def serve(self):
+        host, port = self.addr
+
+        server = await start_server(
+            self.handle_client,
+            host,
+            port,
+            backlog=self.backlog
+        )
+
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        # Mantém ao menos uma thread de comandos livre durante rajadas de bcrypt.
+        get_password_hasher().limit_callers(self.workers - 1)
+
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix='command'
+        )
+
+        with self.executor:
+            run(self.serve())
@@ -1,7 +1,162 @@
-from server import Server
+from argparse import ArgumentParser
+
+from server import DEFAULT_BACKLOG, Server
+from async_server import DEFAULT_WORKERS, AsyncServer
+from command import set_admin_emails
+from firewall import FIREWALL_BACKENDS, Firewall, RecordingRunner, set_firewall
+from hashing import (
+    DEFAULT_QUEUE_LIMIT, DEFAULT_ROUNDS, PasswordHasher, set_password_hasher
+)
+from hashing import DEFAULT_WORKERS as DEFAULT_HASH_WORKERS
+from metrics import MetricsServer
+from session import DEFAULT_IDLE_TIMEOUT
+from storage import STORAGE_BACKENDS
+from tracing import DEFAULT_PROFILE_DIRECTORY, Tracer, set_tracer
+
+
+def parse_arguments():
+    parser = ArgumentParser(description='Servidor de regras do iptables')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument(
+        '--mode',
+        choices=['thread', 'async'],
+        default='thread',
+        help='modelo de atendimento das conexões'
+    )
+    parser.add_argument(
+        '--backlog',
+        type=int,
+        default=DEFAULT_BACKLOG,
+        help='tamanho da fila de conexões pendentes'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=DEFAULT_WORKERS,
+        help='threads para execução de comandos no modo async'
+    )
+    parser.add_argument(
+        '--storage',
+        choices=list(STORAGE_BACKENDS),
+        default='json',
+        help='backend de armazenamento de usuários e regras'
+    )
+    parser.add_argument(
+        '--database',
+        default=None,
+        help='arquivo do banco de dados (padrão depende do backend)'
+    )
+    parser.add_argument(
+        '--session-timeout',
+        type=float,
+        default=DEFAULT_IDLE_TIMEOUT,
+        help='segundos de inatividade até a sessão expirar'
+    )
+    parser.add_argument(
+        '--hash-workers',
+        type=int,
+        default=DEFAULT_HASH_WORKERS,
+        help='threads dedicadas ao bcrypt'
+    )
+    parser.add_argument(
+        '--hash-queue',
+        type=int,
+        default=DEFAULT_QUEUE_LIMIT,
+        help='requisições de hash em espera antes de recusar novas'
+    )
+    parser.add_argument(
+        '--bcrypt-rounds',
+        type=int,
+        default=DEFAULT_ROUNDS,
+        help='custo do bcrypt para novas senhas'
+    )
+    parser.add_argument(
+        '--firewall',
+        choices=list(FIREWALL_BACKENDS),
+        default='script',
+        help='forma de aplicar as regras no kernel'
+    )
+    parser.add_argument(
+        '--auto-apply',
+        action='store_true',
+        help='aplica inclusões e remoções de regras no firewall em execução'
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='registra os comandos do firewall sem executá-los'
+    )
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        default=None,
+        help='porta local para expor as métricas no formato do Prometheus'
+    )
+    parser.add_argument(
+        '--trace-threshold',
+        type=float,
+        default=None,
+        help='registra os trechos das requisições mais lentas que este limite (ms)'
+    )
+    parser.add_argument(
+        '--profile-directory',
+        default=DEFAULT_PROFILE_DIRECTORY,
+        help='diretório dos arquivos gerados pelo "admin profile"'
+    )
+    parser.add_argument(
+        '--admin',
+        action='append',
+        default=[],
+        metavar='EMAIL',
+        help='usuário autorizado a usar o comando "admin" (pode ser repetido); '
+             'sem nenhum, o comando fica desativado'
+    )
+
+    return parser.parse_args()
+
 
 if __name__ == '__main__':
+    args = parse_arguments()
     print('Inicializando o server...')
 
-    server = Server('localhost', 5000)
+    set_password_hasher(
+        PasswordHasher(args.hash_workers, args.hash_queue, args.bcrypt_rounds)
+    )
+    runner = RecordingRunner() if args.dry_run else None
+    backend = FIREWALL_BACKENDS[args.firewall](runner)
+    set_firewall(Firewall(backend, args.auto_apply))
+
+    threshold = None
+
+    if args.trace_threshold is not None:
+        threshold = args.trace_threshold / 1000
+
+    set_tracer(Tracer(threshold, args.profile_directory))
+    set_admin_emails(args.admin)
+
+    if args.metrics_port is not None:
+        MetricsServer(args.metrics_port).start()
+
+    if args.mode == 'async':
+        server = AsyncServer(
+            args.host,
+            args.port,
+            args.backlog,
+            args.workers,
+            args.storage,
+            args.database,
+            args.session_timeout
+        )
+    else:
+        server = Server(
+            args.host,
+            args.port,
+            args.backlog,
+            args.storage,
+            args.database,
+            args.session_timeout
+        )
+
     server.start()
+    server.join()
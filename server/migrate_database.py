@@ -0,0 +1,39 @@
+'''
+Importa um banco de dados database.json existente para o backend SQLite.
+
+$ python migrate_database.py database.json database.sqlite3
+'''
+
+from argparse import ArgumentParser
+from sys import path
+path.append('..')
+from storage import DATABASE_NAME, SQLITE_DATABASE_NAME, MemoryStorage, SQLiteStorage
+
+
+def migrate(source: str, destination: str):
+    '''
+    Carrega o banco .json (reaplicando o journal, se houver) e grava todo
+    o conteúdo no SQLite em uma única transação.
+    '''
+
+    source_storage = MemoryStorage(source)
+    database = source_storage.get_snapshot()
+    source_storage.close()
+
+    destination_storage = SQLiteStorage(destination)
+    destination_storage.replace(database)
+    destination_storage.close()
+
+    return {name: len(rows) for name, rows in database.items()}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Migra o database.json para SQLite')
+    parser.add_argument('source', nargs='?', default=DATABASE_NAME)
+    parser.add_argument('destination', nargs='?', default=SQLITE_DATABASE_NAME)
+    args = parser.parse_args()
+
+    counts = migrate(args.source, args.destination)
+
+    for table, count in counts.items():
+        print(f'{table}: {count} registros importados')
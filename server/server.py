@@ -1,20 +1,38 @@
-from socket import AF_INET, SOCK_STREAM, socket
+from socket import AF_INET, SO_REUSEADDR, SOCK_STREAM, SOL_SOCKET, socket
 from threading import Thread
 from typing import Union
 from os.path import isfile
 from json import dumps
 
 from server_handler import ServerHandler
+from session import DEFAULT_IDLE_TIMEOUT, SessionManager, set_session_manager
+from storage import STORAGE_BACKENDS, open_storage, set_storage
+
+DEFAULT_BACKLOG = 128
 
 
 class Server(Thread):
     addr: Union[str, int]
-    database_name = 'database.json'
+    backlog: int
+    storage_backend: str
+    database_name: str
 
-    def __init__(self, host: str, port: int):
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        backlog: int = DEFAULT_BACKLOG,
+        storage_backend: str = 'json',
+        database_name: str = None,
+        session_timeout: float = DEFAULT_IDLE_TIMEOUT
+    ):
         Thread.__init__(self)
         self.addr = (host, port)
-        self.create_database_if_not_exists()
+        self.backlog = backlog
+        self.storage_backend = storage_backend
+        self.database_name = database_name or STORAGE_BACKENDS[storage_backend][1]
+        self.open_database()
+        set_session_manager(SessionManager(session_timeout))
 
     def get_default_database_dict(self):
         db_dict = {
@@ -31,10 +49,21 @@ class Server(Thread):
             with open(file=self.database_name, mode='w') as file:
                 file.write(dumps(default_database))
 
+    def open_database(self):
+        '''
+        Abre o backend de armazenamento compartilhado por todas as conexões.
+        '''
+
+        if self.storage_backend == 'json':
+            self.create_database_if_not_exists()
+
+        set_storage(open_storage(self.storage_backend, self.database_name))
+
     def run(self):
         with socket(AF_INET, SOCK_STREAM) as s:
+            s.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
             s.bind(self.addr)
-            s.listen(1)
+            s.listen(self.backlog)
 
             while True:
                 conn, addr = s.accept()
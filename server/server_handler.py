@@ -1,56 +1,124 @@
 from threading import Thread
 from socket import socket
+from time import perf_counter
 from typing import Union
-from json import dumps
 from sys import path
 path.append('..')
 from command_response_type import CommandResponseType
-from command import get_server_commands
+from command import get_server_registry
+from metrics import RequestLabels, get_metrics
+from protocol import (
+    ProtocolError, disable_nagle, encode_frame, encode_response, recv_frame
+)
+from session import Session, get_session_manager
+from storage import get_storage
+from tracing import get_tracer, trace_span
 
 
-class ServerHandler(Thread):
+class RequestHandler:
+    '''
+    Lógica de tratamento de comandos compartilhada entre os modos de
+    servidor (threads e asyncio).
+    '''
+
+    def parse_response(self, code: CommandResponseType, message, encoding: str):
+        '''
+        Codifica a resposta na codificação em uso pela conexão quando o
+        comando foi recebido; assim a resposta do próprio "encoding" ainda
+        usa a codificação anterior.
+        '''
+
+        return encode_response(code, message, encoding)
+
+    def check_for_available_commands(self, command: str, session: Session):
+        get_session_manager().refresh(session)
+        return get_server_registry().dispatch(command, session)
+
+    def get_request_labels(self, command: str) -> RequestLabels:
+        '''
+        Retorna o comando e a ação da requisição para as métricas. Somente
+        nomes registrados são usados, para que textos arbitrários enviados
+        pelos clients não criem novas séries.
+        '''
+
+        tokens = command.split(maxsplit=2)
+        cmd = get_server_registry().get_command(command)
+
+        if cmd is None:
+            return ('invalid', '')
+
+        actions = getattr(cmd, 'available_actions', {})
+        action = tokens[1] if len(tokens) > 1 and tokens[1] in actions else ''
+
+        return (cmd.name, action)
+
+    def handle_request(self, command: str, session: Session) -> bytes:
+        '''
+        Executa o comando e codifica a resposta, registrando a latência
+        do conjunto nas métricas. Com o rastreamento ativo, requisições
+        acima do limite são registradas no log com a duração de cada trecho.
+        '''
+
+        start = perf_counter()
+        encoding = session.encoding
+        tracer = get_tracer()
+        trace = tracer.start_trace()
+
+        with trace_span('parse'):
+            labels = self.get_request_labels(command)
+
+        with trace_span('dispatch'):
+            code, message = tracer.run_profiled(
+                self.check_for_available_commands, command, session
+            )
+
+        with trace_span('encode'):
+            response = self.parse_response(code, message, encoding)
+
+        elapsed = perf_counter() - start
+        tracer.finish_trace(trace, labels, elapsed)
+        get_metrics().observe_request(labels, code != CommandResponseType.OK, elapsed)
+
+        return response
+
+
+class ServerHandler(RequestHandler, Thread):
     conn: socket
     client_address: str
+    session: Session
 
     def __init__(self, conn: socket, addr: Union[str, int]):
         Thread.__init__(self)
         self.conn = conn
         self.client_address = f'{addr[0]}:{addr[1]}'
-
-    def parse_response_code_as_json(self, code: CommandResponseType, message: str):
-        response_object = {
-            "code": code.__str__(),
-            "message": message
-        }
-
-        return dumps(response_object).encode('utf8')
-
-    def check_for_available_commands(self, command: str):
-        available_commands = get_server_commands()
-
-        for cmd in available_commands:
-            if cmd.check(command):
-                return cmd.run()
-
-        code = CommandResponseType.ERROR
-        message = "Comando inválido!"
-        return (code, message)
+        self.session = Session()
 
     def run(self):
         print(f'[+] Novo client: {self.client_address}')
 
-        with self.conn:
-            while True:
-                print(f'Aguardando comando de {self.client_address}')
-                data = self.conn.recv(1024)
+        disable_nagle(self.conn)
+        get_metrics().connection_opened()
+
+        try:
+            with self.conn:
+                while True:
+                    print(f'Aguardando comando de {self.client_address}')
+
+                    try:
+                        frame = recv_frame(self.conn)
+                    except (ConnectionError, ProtocolError):
+                        break
 
-                if not data:
-                    break
+                    if frame is None:
+                        break
 
-                command = data.decode('utf8')
-                code, message = self.check_for_available_commands(command)
-                response = self.parse_response_code_as_json(code, message)
+                    request_id, data = frame
+                    command = data.decode('utf8')
+                    response = self.handle_request(command, self.session)
 
-                self.conn.sendall(response)
+                    self.conn.sendall(encode_frame(request_id, response))
+        finally:
+            get_storage().release_connection()
+            get_metrics().connection_closed()
 
         print(f'[-] Client desconectou: {self.client_address}')
@@ -0,0 +1,152 @@
+from collections import OrderedDict
+from secrets import token_urlsafe
+from threading import Lock
+from time import monotonic
+from typing import Dict, Optional, Set
+
+from models import RuleImport, User
+from protocol import TEXT_ENCODING
+
+DEFAULT_IDLE_TIMEOUT = 30 * 60
+
+
+class Session:
+    '''
+    Estado de login de uma conexão. Após o login a sessão recebe um token
+    opaco, que permite retomá-la em outra conexão.
+    '''
+
+    token: Optional[str]
+    user: Optional[User]
+    last_seen: float
+    rule_import: Optional[RuleImport]
+    encoding: str
+
+    def __init__(self, user: User = None):
+        self.token = None
+        self.user = user
+        self.last_seen = monotonic()
+        self.rule_import = None
+        self.encoding = TEXT_ENCODING
+
+
+class SessionManager:
+    '''
+    Registra as sessões ativas por token. As sessões são mantidas em ordem
+    de último uso, de modo que as ociosas são expiradas a partir do início
+    da fila sem percorrer as demais.
+    '''
+
+    idle_timeout: float
+    sessions: Dict[str, Session]
+    tokens_by_user: Dict[str, Set[str]]
+
+    def __init__(self, idle_timeout: float = DEFAULT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.sessions = OrderedDict()
+        self.tokens_by_user = {}
+        self.lock = Lock()
+
+    def expire_idle_sessions(self):
+        '''
+        Remove as sessões ociosas. Deve ser chamado com o lock adquirido.
+        '''
+
+        deadline = monotonic() - self.idle_timeout
+
+        while self.sessions:
+            token, session = next(iter(self.sessions.items()))
+
+            if session.last_seen >= deadline:
+                break
+
+            self.remove(token)
+
+    def remove(self, token: str):
+        session = self.sessions.pop(token, None)
+        if not session:
+            return
+
+        tokens = self.tokens_by_user.get(session.user.id, set())
+        tokens.discard(token)
+
+        if not tokens:
+            self.tokens_by_user.pop(session.user.id, None)
+
+    def login(self, session: Session, user: User):
+        with self.lock:
+            self.expire_idle_sessions()
+
+            session.token = token_urlsafe(32)
+            session.user = user
+            session.last_seen = monotonic()
+
+            self.sessions[session.token] = session
+            self.tokens_by_user.setdefault(user.id, set()).add(session.token)
+
+    def resume(self, session: Session, token: str) -> bool:
+        '''
+        Associa a conexão a uma sessão existente e ainda não expirada.
+        '''
+
+        with self.lock:
+            self.expire_idle_sessions()
+
+            stored = self.sessions.get(token)
+            if not stored:
+                return False
+
+            stored.last_seen = monotonic()
+            self.sessions.move_to_end(token)
+
+            session.token = stored.token
+            session.user = stored.user
+
+        return True
+
+    def logout(self, session: Session):
+        with self.lock:
+            if session.token:
+                self.remove(session.token)
+
+        session.token = None
+        session.user = None
+
+    def refresh(self, session: Session):
+        '''
+        Marca o uso da sessão a cada requisição. Se ela tiver expirado (ou
+        sido encerrada em outra conexão), a conexão é deslogada.
+        '''
+
+        if not session.token:
+            return
+
+        with self.lock:
+            self.expire_idle_sessions()
+
+            stored = self.sessions.get(session.token)
+
+            if stored:
+                stored.last_seen = monotonic()
+                self.sessions.move_to_end(session.token)
+                return
+
+        session.token = None
+        session.user = None
+
+    def is_user_logged_in(self, user_id: str) -> bool:
+        with self.lock:
+            self.expire_idle_sessions()
+            return bool(self.tokens_by_user.get(user_id))
+
+
+_session_manager = SessionManager()
+
+
+def set_session_manager(session_manager: SessionManager):
+    global _session_manager
+    _session_manager = session_manager
+
+
+def get_session_manager() -> SessionManager:
+    return _session_manager
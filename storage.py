@@ -0,0 +1,929 @@
+from abc import ABC, abstractmethod
+from atexit import register
+from json import dumps, loads
+from os import fsync, remove, replace
+from os.path import isfile
+from sqlite3 import IntegrityError, Row, connect
+from threading import Event, Lock, RLock, Thread, local
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+from command_response_type import DatabaseTableType
+from metrics import get_metrics
+from rule_index import (
+    RuleIndex, SortedKeys, get_network_range, get_rule_range, get_supernet_ranges
+)
+from tracing import trace_span
+
+DATABASE_NAME = 'database.json'
+SQLITE_DATABASE_NAME = 'database.sqlite3'
+COMPACTION_THRESHOLD = 4 * 1024 * 1024
+TABLE_NAMES = {
+    DatabaseTableType.USER: 'users',
+    DatabaseTableType.RULE: 'rules'
+}
+TABLE_COLUMNS = {
+    'users': ('name', 'email', 'password'),
+    'rules': ('user_id', 'ip', 'action')
+}
+
+Record = Tuple[str, dict]
+# Posição de uma regra na listagem: (início da faixa de endereços, id).
+RuleCursor = Tuple[int, str]
+
+
+class DuplicateRecordError(Exception):
+    pass
+
+
+def get_default_database_dict():
+    return {name: {} for name in TABLE_NAMES.values()}
+
+
+class Storage(ABC):
+    '''
+    Interface comum aos backends de armazenamento usados pelo
+    DatabaseCommand.
+    '''
+
+    @abstractmethod
+    def get_table(self, table: DatabaseTableType) -> Optional[Dict[str, dict]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_record(self, table: DatabaseTableType, id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert_record(self, table: DatabaseTableType, id: str, record: dict):
+        '''
+        Insere ou atualiza um registro. Lança DuplicateRecordError se o
+        e-mail do usuário ou o endereço da regra do usuário já existirem.
+        '''
+
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert_records(self, table: DatabaseTableType, rows: List[Record]):
+        '''
+        Insere vários registros em uma única transação: se algum deles
+        violar a unicidade, DuplicateRecordError é lançado e nenhum é gravado.
+        '''
+
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_record(self, table: DatabaseTableType, id: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def replace(self, database_dict):
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_user_by_email(self, email: str) -> Optional[Record]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_rule_by_address(self, user_id: str, ip: str) -> Optional[Record]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_rules_by_user_id(self, user_id: str) -> Dict[str, dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_overlapping_rules(self, ip: str, user_id: str = None) -> Dict[str, dict]:
+        '''
+        Retorna as regras (do usuário, se passado) cujas redes contêm ou
+        estão contidas na rede do endereço passado.
+        '''
+
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_users(
+        self,
+        limit: int,
+        after: Optional[str] = None,
+        email: Optional[str] = None
+    ) -> List[Record]:
+        '''
+        Retorna até "limit" usuários em ordem de e-mail, a partir do e-mail
+        "after" (exclusive), filtrando pelos que contêm o trecho "email".
+        '''
+
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_rules(
+        self,
+        user_id: str,
+        limit: int,
+        after: Optional[RuleCursor] = None,
+        network: Optional[str] = None,
+        action: Optional[str] = None
+    ) -> List[Record]:
+        '''
+        Retorna até "limit" regras do usuário em ordem de endereço, a partir
+        da posição "after" (exclusive), filtrando pelas contidas na rede
+        "network" e pela ação.
+        '''
+
+        raise NotImplementedError
+
+    def release_connection(self):
+        '''
+        Libera os recursos usados pela thread atual; chamado quando a
+        thread que atende uma conexão termina.
+        '''
+
+    def close(self):
+        pass
+
+
+class MemoryStorage(Storage):
+    '''
+    Mantém o banco de dados carregado em memória, compartilhado entre as
+    conexões. Cada alteração é acrescentada a um journal antes de ser
+    aplicada e, quando o journal cresce além do limite, o estado é
+    compactado em um novo snapshot do arquivo .json em segundo plano.
+
+    Índices em memória por e-mail, por (user_id, ip) e pela faixa de
+    endereços das regras evitam percorrer as tabelas em buscas e
+    verificações de unicidade e de sobreposição.
+    '''
+
+    database_name: str
+    journal_name: str
+    compaction_threshold: int
+    sync: bool
+    tables: Dict[str, Dict[str, dict]]
+
+    def __init__(
+        self,
+        database_name: str = DATABASE_NAME,
+        compaction_threshold: int = COMPACTION_THRESHOLD,
+        sync: bool = True
+    ):
+        self.database_name = database_name
+        self.journal_name = f'{database_name}.journal'
+        self.compaction_threshold = compaction_threshold
+        self.sync = sync
+        self.lock = RLock()
+        self.compaction_lock = Lock()
+        self.compaction_needed = Event()
+
+        started = perf_counter()
+        self.tables = self.load()
+        self.build_indexes()
+        get_metrics().observe_database('load', perf_counter() - started)
+
+        self.finish_interrupted_compaction()
+        self.journal = open(file=self.journal_name, mode='a')
+
+        self.compactor = Thread(target=self.compact_in_background, daemon=True)
+        self.compactor.start()
+
+        if self.get_journal_size() > self.compaction_threshold:
+            self.compaction_needed.set()
+
+    def load(self):
+        '''
+        Lê o último snapshot e reaplica as alterações registradas nos
+        journals, recuperando o último estado confirmado.
+        '''
+
+        database = get_default_database_dict()
+
+        if isfile(self.database_name):
+            with open(file=self.database_name, mode='r') as file:
+                database.update(loads(file.read()))
+
+        for name in [f'{self.journal_name}.compacting', self.journal_name]:
+            if isfile(name):
+                self.replay_journal(database, name)
+
+        return database
+
+    def replay_journal(self, database, journal_name: str):
+        '''
+        Reaplica os registros do journal. Um registro incompleto no final
+        indica uma escrita interrompida antes de ser confirmada e é
+        descartado, para que novos registros não sejam gravados após ele.
+        '''
+
+        with open(file=journal_name, mode='rb+') as file:
+            committed_size = 0
+
+            for line in file:
+                try:
+                    entry = loads(line)
+                except ValueError:
+                    break
+
+                if not line.endswith(b'\n'):
+                    break
+
+                self.apply_entry(database, entry)
+                committed_size += len(line)
+
+            file.truncate(committed_size)
+
+    def apply_entry(self, database, entry: dict):
+        table = database[entry['table']]
+
+        if entry['op'] == 'put':
+            table[entry['id']] = entry['record']
+        elif entry['op'] == 'put_many':
+            table.update(entry['records'])
+        elif entry['op'] == 'delete':
+            table.pop(entry['id'], None)
+
+    def build_indexes(self):
+        self.users_by_email = {}
+        self.rules_by_address = {}
+        self.rules_by_user = {}
+        self.rule_indexes = {}
+        self.rule_index = RuleIndex()
+        self.user_emails = SortedKeys()
+
+        for name, rows in self.tables.items():
+            for id, record in rows.items():
+                self.update_indexes(name, id, None, record, bulk=True)
+
+    def update_indexes(
+        self,
+        table_name: str,
+        id: str,
+        old: dict,
+        new: dict,
+        bulk: bool = False
+    ):
+        '''
+        Atualiza os índices com a troca de "old" por "new". Com "bulk", as
+        chaves ordenadas só são reordenadas na próxima consulta, uma única
+        vez para todo o lote.
+        '''
+
+        if table_name == 'users':
+            if old:
+                self.users_by_email.pop(old['email'], None)
+                self.user_emails.remove(old['email'])
+            if new:
+                self.users_by_email[new['email']] = id
+                self.user_emails.add(new['email'], bulk)
+
+        elif table_name == 'rules':
+            if old:
+                self.rules_by_address.pop((old['user_id'], old['ip']), None)
+                user_rules = self.rules_by_user.get(old['user_id'], {})
+                user_rules.pop(id, None)
+                self.rule_indexes[old['user_id']].remove(id)
+                self.rule_index.remove(id)
+            if new:
+                self.rules_by_address[(new['user_id'], new['ip'])] = id
+                self.rules_by_user.setdefault(new['user_id'], {})[id] = new
+                user_index = self.rule_indexes.setdefault(new['user_id'], RuleIndex())
+                user_index.add(id, new['ip'], bulk)
+                self.rule_index.add(id, new['ip'], bulk)
+
+    def get_unique_key(self, table_name: str, record: dict):
+        if table_name == 'users':
+            return record['email']
+
+        if table_name == 'rules':
+            return (record['user_id'], record['ip'])
+
+        return None
+
+    def get_duplicate_id(self, table_name: str, record: dict) -> Optional[str]:
+        key = self.get_unique_key(table_name, record)
+
+        if table_name == 'users':
+            return self.users_by_email.get(key)
+
+        if table_name == 'rules':
+            return self.rules_by_address.get(key)
+
+        return None
+
+    def apply_mutation(self, entry: dict):
+        '''
+        Registra a alteração no journal e a aplica às tabelas e índices.
+        Deve ser chamado com o lock adquirido.
+        '''
+
+        table_name = entry['table']
+
+        if entry['op'] == 'put_many':
+            records = entry['records']
+        else:
+            records = {entry['id']: entry.get('record')}
+
+        table = self.tables[table_name]
+        old = {id: table.get(id) for id in records}
+
+        self.append_to_journal(entry)
+        self.apply_entry(self.tables, entry)
+
+        bulk = len(records) > 1
+
+        for id, record in records.items():
+            self.update_indexes(table_name, id, old[id], record, bulk)
+
+    def append_to_journal(self, entry: dict):
+        '''
+        Grava a alteração no journal. Deve ser chamado com o lock adquirido.
+        '''
+
+        started = perf_counter()
+
+        with trace_span('db_write'):
+            self.journal.write(dumps(entry, separators=(',', ':')) + '\n')
+            self.journal.flush()
+
+            if self.sync:
+                fsync(self.journal.fileno())
+
+        get_metrics().observe_database('journal', perf_counter() - started)
+
+        if self.journal.tell() > self.compaction_threshold:
+            self.compaction_needed.set()
+
+    def get_journal_size(self):
+        with self.lock:
+            return self.journal.tell()
+
+    def get_table(self, table: DatabaseTableType) -> Optional[Dict[str, dict]]:
+        '''
+        Retorna uma cópia rasa da tabela, segura para iteração enquanto
+        outras conexões alteram o banco.
+        '''
+
+        selected_table = TABLE_NAMES.get(table)
+        if not selected_table:
+            return None
+
+        with self.lock, trace_span('db_read'):
+            return dict(self.tables[selected_table])
+
+    def get_record(self, table: DatabaseTableType, id: str) -> Optional[dict]:
+        with self.lock:
+            return self.tables[TABLE_NAMES[table]].get(id)
+
+    def insert_record(self, table: DatabaseTableType, id: str, record: dict):
+        table_name = TABLE_NAMES[table]
+        entry = {'op': 'put', 'table': table_name, 'id': id, 'record': record}
+
+        with self.lock:
+            duplicate_id = self.get_duplicate_id(table_name, record)
+            if duplicate_id not in (None, id):
+                raise DuplicateRecordError(table_name, duplicate_id)
+
+            self.apply_mutation(entry)
+
+    def insert_records(self, table: DatabaseTableType, rows: List[Record]):
+        '''
+        Grava todos os registros em uma única entrada do journal, que na
+        reaplicação é aplicada por inteiro ou descartada junto com a cauda
+        incompleta do arquivo.
+        '''
+
+        table_name = TABLE_NAMES[table]
+        records = dict(rows)
+        entry = {'op': 'put_many', 'table': table_name, 'records': records}
+
+        with self.lock:
+            keys = {}
+
+            for id, record in records.items():
+                key = self.get_unique_key(table_name, record)
+                duplicate_id = keys.setdefault(key, id)
+
+                if duplicate_id == id:
+                    duplicate_id = self.get_duplicate_id(table_name, record)
+
+                if duplicate_id not in (None, id):
+                    raise DuplicateRecordError(table_name, duplicate_id)
+
+            self.apply_mutation(entry)
+
+    def remove_record(self, table: DatabaseTableType, id: str):
+        entry = {'op': 'delete', 'table': TABLE_NAMES[table], 'id': id}
+
+        with self.lock:
+            self.apply_mutation(entry)
+
+    def find_user_by_email(self, email: str) -> Optional[Record]:
+        with self.lock:
+            id = self.users_by_email.get(email)
+            if id is None:
+                return None
+
+            return id, self.tables['users'][id]
+
+    def find_rule_by_address(self, user_id: str, ip: str) -> Optional[Record]:
+        with self.lock:
+            id = self.rules_by_address.get((user_id, ip))
+            if id is None:
+                return None
+
+            return id, self.tables['rules'][id]
+
+    def get_rules_by_user_id(self, user_id: str) -> Dict[str, dict]:
+        with self.lock:
+            return dict(self.rules_by_user.get(user_id, {}))
+
+    def find_overlapping_rules(self, ip: str, user_id: str = None) -> Dict[str, dict]:
+        with self.lock:
+            if user_id is None:
+                index = self.rule_index
+            else:
+                index = self.rule_indexes.get(user_id, RuleIndex())
+
+            rules = self.tables['rules']
+
+            return {id: rules[id] for id in index.find_overlapping(ip)}
+
+    def list_users(
+        self,
+        limit: int,
+        after: Optional[str] = None,
+        email: Optional[str] = None
+    ) -> List[Record]:
+        with self.lock:
+            users = self.tables['users']
+            result = []
+
+            for user_email in self.user_emails.iterate(after):
+                if len(result) >= limit:
+                    break
+
+                if email and email not in user_email:
+                    continue
+
+                id = self.users_by_email[user_email]
+                result.append((id, users[id]))
+
+            return result
+
+    def list_rules(
+        self,
+        user_id: str,
+        limit: int,
+        after: Optional[RuleCursor] = None,
+        network: Optional[str] = None,
+        action: Optional[str] = None
+    ) -> List[Record]:
+        network_range = get_network_range(network) if network else None
+
+        with self.lock:
+            index = self.rule_indexes.get(user_id, RuleIndex())
+            rules = self.tables['rules']
+            result = []
+
+            for id in index.iterate(after, network_range):
+                if len(result) >= limit:
+                    break
+
+                rule = rules[id]
+
+                if action and rule['action'] != action:
+                    continue
+
+                result.append((id, rule))
+
+            return result
+
+    def get_snapshot(self):
+        with self.lock:
+            return {name: dict(rows) for name, rows in self.tables.items()}
+
+    def replace(self, database_dict):
+        '''
+        Substitui todo o conteúdo do banco de dados, gravando um novo
+        snapshot imediatamente.
+        '''
+
+        database = get_default_database_dict()
+        database.update(database_dict)
+
+        with self.lock:
+            self.tables = database
+            self.build_indexes()
+
+        self.compact()
+
+    def write_snapshot(self, snapshot):
+        '''
+        Grava o snapshot no arquivo, substituindo-o de forma atômica.
+        '''
+
+        started = perf_counter()
+        temporary_name = f'{self.database_name}.tmp'
+
+        with open(file=temporary_name, mode='w') as file:
+            file.write(dumps(snapshot, separators=(',', ':')))
+            file.flush()
+            fsync(file.fileno())
+
+        replace(temporary_name, self.database_name)
+        get_metrics().observe_database('snapshot', perf_counter() - started)
+
+    def finish_interrupted_compaction(self):
+        '''
+        Um journal .compacting restante de uma compactação interrompida já
+        foi reaplicado na carga, mas ainda não está no snapshot: grava o
+        snapshot antes de descartá-lo, para que uma nova compactação não o
+        substitua. Deve ser chamado com o lock de compactação adquirido ou
+        antes de iniciar a compactação em segundo plano.
+        '''
+
+        compacting_name = f'{self.journal_name}.compacting'
+
+        if isfile(compacting_name):
+            self.write_snapshot(self.get_snapshot())
+            remove(compacting_name)
+
+    def compact(self):
+        '''
+        Troca o journal atual por um novo, grava o snapshot correspondente e
+        descarta o journal antigo. Se o processo for interrompido no meio,
+        o journal antigo ainda é reaplicado na próxima carga.
+        '''
+
+        with self.compaction_lock:
+            self.compaction_needed.clear()
+            self.finish_interrupted_compaction()
+            compacting_name = f'{self.journal_name}.compacting'
+
+            with self.lock:
+                self.journal.close()
+                replace(self.journal_name, compacting_name)
+                self.journal = open(file=self.journal_name, mode='a')
+                snapshot = {name: dict(rows) for name, rows in self.tables.items()}
+
+            self.write_snapshot(snapshot)
+            remove(compacting_name)
+
+    def compact_in_background(self):
+        while True:
+            self.compaction_needed.wait()
+            self.compact()
+
+    def close(self):
+        with self.compaction_lock, self.lock:
+            self.journal.close()
+
+
+class SQLiteStorage(Storage):
+    '''
+    Armazena usuários e regras em um banco SQLite em modo WAL, com índices
+    únicos para o e-mail do usuário e para o par (user_id, ip) das regras.
+    As regras guardam também a faixa numérica de endereços, indexada para
+    as buscas de sobreposição. Cada thread utiliza sua própria conexão,
+    fechada por release_connection quando a thread termina.
+    '''
+
+    database_name: str
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            password TEXT NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS users_email ON users (email);
+
+        CREATE TABLE IF NOT EXISTS rules (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            ip TEXT NOT NULL,
+            action TEXT NOT NULL,
+            range_start INTEGER,
+            range_end INTEGER
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS rules_user_ip ON rules (user_id, ip);
+    '''
+    range_columns = ('range_start', 'range_end')
+
+    def __init__(self, database_name: str = SQLITE_DATABASE_NAME):
+        self.database_name = database_name
+        self.local = local()
+        self.connections = []
+        self.lock = Lock()
+
+        started = perf_counter()
+        connection = self.get_connection()
+        connection.executescript(self.schema)
+        self.add_range_columns(connection)
+        get_metrics().observe_database('load', perf_counter() - started)
+
+    def add_range_columns(self, connection):
+        '''
+        Inclui as colunas de faixa de endereços em bancos criados antes
+        delas, preenchendo-as a partir dos endereços já gravados.
+        '''
+
+        columns = {
+            row['name'] for row in connection.execute('PRAGMA table_info(rules)')
+        }
+
+        with connection:
+            if 'range_start' not in columns:
+                for column in self.range_columns:
+                    connection.execute(
+                        f'ALTER TABLE rules ADD COLUMN {column} INTEGER'
+                    )
+
+            rows = connection.execute(
+                'SELECT id, ip FROM rules WHERE range_start IS NULL'
+            ).fetchall()
+            connection.executemany(
+                'UPDATE rules SET range_start = ?, range_end = ? WHERE id = ?',
+                [(*get_rule_range(row['ip']), row['id']) for row in rows]
+            )
+
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS rules_range '
+                'ON rules (range_start, range_end)'
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS rules_user_range '
+                'ON rules (user_id, range_start, id)'
+            )
+
+    def get_connection(self):
+        connection = getattr(self.local, 'connection', None)
+
+        if connection is None:
+            connection = connect(self.database_name, check_same_thread=False)
+            connection.row_factory = Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+
+            self.local.connection = connection
+            with self.lock:
+                self.connections.append(connection)
+
+        return connection
+
+    def parse_rows(self, table_name: str, rows) -> Dict[str, dict]:
+        columns = TABLE_COLUMNS[table_name]
+        return {row['id']: {c: row[c] for c in columns} for row in rows}
+
+    def select(self, table_name: str, where: str = '', params=()) -> Dict[str, dict]:
+        columns = ', '.join(TABLE_COLUMNS[table_name])
+
+        with trace_span('db_read'):
+            rows = self.get_connection().execute(
+                f'SELECT id, {columns} FROM {table_name} {where}',
+                params
+            )
+
+            return self.parse_rows(table_name, rows)
+
+    def select_one(self, table_name: str, where: str, params) -> Optional[Record]:
+        records = self.select(table_name, f'{where} LIMIT 1', params)
+
+        for id, record in records.items():
+            return id, record
+
+        return None
+
+    def get_table(self, table: DatabaseTableType) -> Optional[Dict[str, dict]]:
+        table_name = TABLE_NAMES.get(table)
+        if not table_name:
+            return None
+
+        return self.select(table_name)
+
+    def get_record(self, table: DatabaseTableType, id: str) -> Optional[dict]:
+        result = self.select_one(TABLE_NAMES[table], 'WHERE id = ?', (id,))
+        return result[1] if result else None
+
+    def insert_rows(self, connection, table_name: str, rows):
+        columns = TABLE_COLUMNS[table_name]
+        values = [(id, *(record[c] for c in columns)) for id, record in rows]
+
+        if table_name == 'rules':
+            columns = (*columns, *self.range_columns)
+            values = [(*row, *get_rule_range(row[2])) for row in values]
+
+        placeholders = ', '.join('?' * (len(columns) + 1))
+        updates = ', '.join(f'{c} = excluded.{c}' for c in columns)
+
+        connection.executemany(
+            f'INSERT INTO {table_name} (id, {", ".join(columns)}) '
+            f'VALUES ({placeholders}) '
+            f'ON CONFLICT (id) DO UPDATE SET {updates}',
+            values
+        )
+
+    def insert_record(self, table: DatabaseTableType, id: str, record: dict):
+        self.insert_records(table, [(id, record)])
+
+    def insert_records(self, table: DatabaseTableType, rows: List[Record]):
+        table_name = TABLE_NAMES[table]
+        connection = self.get_connection()
+        started = perf_counter()
+
+        try:
+            with connection, trace_span('db_write'):
+                self.insert_rows(connection, table_name, rows)
+        except IntegrityError as error:
+            raise DuplicateRecordError(table_name) from error
+
+        get_metrics().observe_database('write', perf_counter() - started)
+
+    def remove_record(self, table: DatabaseTableType, id: str):
+        connection = self.get_connection()
+        started = perf_counter()
+
+        with connection, trace_span('db_write'):
+            connection.execute(
+                f'DELETE FROM {TABLE_NAMES[table]} WHERE id = ?',
+                (id,)
+            )
+
+        get_metrics().observe_database('write', perf_counter() - started)
+
+    def replace(self, database_dict):
+        '''
+        Substitui todo o conteúdo do banco em uma única transação.
+        '''
+
+        connection = self.get_connection()
+        started = perf_counter()
+
+        with connection, trace_span('db_write'):
+            for table_name in TABLE_COLUMNS:
+                connection.execute(f'DELETE FROM {table_name}')
+
+                rows = database_dict.get(table_name, {}).items()
+                self.insert_rows(connection, table_name, rows)
+
+        get_metrics().observe_database('snapshot', perf_counter() - started)
+
+    def find_user_by_email(self, email: str) -> Optional[Record]:
+        return self.select_one('users', 'WHERE email = ?', (email,))
+
+    def find_rule_by_address(self, user_id: str, ip: str) -> Optional[Record]:
+        return self.select_one(
+            'rules',
+            'WHERE user_id = ? AND ip = ?',
+            (user_id, ip)
+        )
+
+    def get_rules_by_user_id(self, user_id: str) -> Dict[str, dict]:
+        return self.select('rules', 'WHERE user_id = ?', (user_id,))
+
+    def find_overlapping_rules(self, ip: str, user_id: str = None) -> Dict[str, dict]:
+        try:
+            start, end = get_network_range(ip)
+        except ValueError:
+            return {}
+
+        supernets = get_supernet_ranges(start, end)
+        conditions = ['(range_start = ? AND range_end = ?)'] * len(supernets)
+        conditions.append('(range_start BETWEEN ? AND ? AND range_end <= ?)')
+        params = [value for network_range in supernets for value in network_range]
+        params.extend((start, end, end))
+
+        where = f'WHERE ({" OR ".join(conditions)})'
+
+        # O "+" impede o uso do índice (user_id, ip), que percorreria todas
+        # as regras do usuário, no lugar do índice de faixas.
+        if user_id is not None:
+            where += ' AND +user_id = ?'
+            params.append(user_id)
+
+        return self.select('rules', where, params)
+
+    def list_users(
+        self,
+        limit: int,
+        after: Optional[str] = None,
+        email: Optional[str] = None
+    ) -> List[Record]:
+        conditions, params = [], []
+
+        if after is not None:
+            conditions.append('email > ?')
+            params.append(after)
+
+        if email:
+            conditions.append('instr(email, ?) > 0')
+            params.append(email)
+
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+        params.append(limit)
+
+        users = self.select('users', f'{where} ORDER BY email LIMIT ?', params)
+        return list(users.items())
+
+    def list_rules(
+        self,
+        user_id: str,
+        limit: int,
+        after: Optional[RuleCursor] = None,
+        network: Optional[str] = None,
+        action: Optional[str] = None
+    ) -> List[Record]:
+        conditions, params = ['user_id = ?'], [user_id]
+
+        if network:
+            start, end = get_network_range(network)
+            conditions.append('range_start <= ? AND range_end <= ?')
+            params.extend((end, end))
+
+            # O início da rede vira o limite inferior da posição, para que
+            # o índice seja percorrido a partir de um único ponto.
+            if after is None or after < (start, ''):
+                after = (start, '')
+
+        if after is not None:
+            conditions.append('(range_start, id) > (?, ?)')
+            params.extend(after)
+
+        if action:
+            conditions.append('action = ?')
+            params.append(action)
+
+        params.append(limit)
+
+        rows = self.select(
+            'rules',
+            f'WHERE {" AND ".join(conditions)} ORDER BY range_start, id LIMIT ?',
+            params
+        )
+
+        return list(rows.items())
+
+    def release_connection(self):
+        connection = getattr(self.local, 'connection', None)
+
+        if connection is None:
+            return
+
+        self.local.connection = None
+
+        with self.lock:
+            self.connections.remove(connection)
+
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+
+            self.connections = []
+
+
+STORAGE_BACKENDS = {
+    'json': (MemoryStorage, DATABASE_NAME),
+    'sqlite': (SQLiteStorage, SQLITE_DATABASE_NAME)
+}
+
+
+def open_storage(backend: str = 'json', database_name: str = None) -> Storage:
+    storage_class, default_name = STORAGE_BACKENDS[backend]
+    return storage_class(database_name or default_name)
+
+
+_storage = None
+_storage_lock = RLock()
+
+
+def set_storage(storage):
+    global _storage
+
+    with _storage_lock:
+        if _storage is not None and _storage is not storage:
+            _storage.close()
+
+        _storage = storage
+
+
+def get_storage():
+    '''
+    Retorna o banco de dados compartilhado, carregando-o na primeira vez.
+    '''
+
+    global _storage
+
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = MemoryStorage()
+
+    return _storage
+
+
+@register
+def close_storage():
+    if _storage is not None:
+        _storage.close()
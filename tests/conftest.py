@@ -0,0 +1,5 @@
+from os.path import abspath, dirname, join
+from sys import path
+
+ROOT = join(dirname(abspath(__file__)), '..')
+path.insert(0, ROOT)
@@ -0,0 +1,206 @@
+from random import Random
+
+import pytest
+
+from firewall import (
+    FIREWALL_BACKENDS, Firewall, RecordingRunner, aggregate_nested_rules,
+    aggregate_rules
+)
+from rule_index import format_range, get_network_range
+
+BASE_ADDRESS = 10 << 24
+ADDRESS_COUNT = 1 << 10
+
+
+def most_specific_action(rules, address: int):
+    '''
+    Ação da regra mais específica que contém o endereço.
+    '''
+
+    matches = []
+
+    for network, action in rules:
+        start, end = get_network_range(network)
+
+        if start <= address <= end:
+            matches.append((end - start, action))
+
+    return min(matches)[1] if matches else None
+
+
+def first_match_action(rules, address: int):
+    '''
+    Ação da primeira regra que contém o endereço, como nas cadeias do
+    iptables.
+    '''
+
+    for network, action in rules:
+        start, end = get_network_range(network)
+
+        if start <= address <= end:
+            return action
+
+    return None
+
+
+def random_rules(random: Random, count: int):
+    rules = {}
+
+    for _ in range(count):
+        length = random.randint(22, 32)
+        host_mask = (1 << (32 - length)) - 1
+        start = (BASE_ADDRESS + random.randrange(ADDRESS_COUNT)) & ~host_mask
+        address = format_range(start, start | host_mask)
+        rules[address] = random.choice(['ACCEPT', 'DROP'])
+
+    return rules
+
+
+def test_aggregate_rules_splits_exceptions_without_overlap():
+    rules = [('10.0.0.0/30', 'DROP'), ('10.0.0.1', 'ACCEPT'), ('invalid', 'DROP')]
+
+    assert aggregate_rules(rules) == [
+        ('10.0.0.0', 'DROP'),
+        ('10.0.0.1', 'ACCEPT'),
+        ('10.0.0.2/31', 'DROP'),
+        ('invalid', 'DROP')
+    ]
+
+
+def test_aggregate_rules_merges_adjacent_networks():
+    rules = [('10.0.0.0/25', 'DROP'), ('10.0.0.128/25', 'DROP'), ('10.0.1.0', 'DROP')]
+
+    assert aggregate_rules(rules) == [
+        ('10.0.0.0/24', 'DROP'),
+        ('10.0.1.0', 'DROP')
+    ]
+
+
+def test_aggregate_nested_rules_keeps_exceptions_first():
+    rules = [('10.0.0.0/8', 'DROP'), ('10.1.2.3', 'ACCEPT')]
+
+    assert aggregate_nested_rules(rules) == [
+        ('10.1.2.3', 'ACCEPT'),
+        ('10.0.0.0/8', 'DROP')
+    ]
+    assert len(aggregate_rules(rules)) == 25
+
+
+def test_aggregate_nested_rules_merges_siblings_and_drops_covered_rules():
+    rules = [
+        ('10.0.0.0/24', 'ACCEPT'),
+        ('10.0.0.0/25', 'DROP'),
+        ('10.0.0.128/25', 'DROP'),
+        ('10.0.0.5', 'DROP'),
+        ('invalid', 'ACCEPT')
+    ]
+
+    assert aggregate_nested_rules(rules) == [
+        ('invalid', 'ACCEPT'),
+        ('10.0.0.0/24', 'DROP')
+    ]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_aggregation_keeps_most_specific_rule_semantics(seed):
+    random = Random(seed)
+    rules = list(random_rules(random, random.randint(1, 40)).items())
+
+    flat = aggregate_rules(rules)
+    nested = aggregate_nested_rules(rules)
+
+    assert len(nested) <= len(rules)
+
+    for address in range(BASE_ADDRESS, BASE_ADDRESS + ADDRESS_COUNT):
+        expected = most_specific_action(rules, address)
+
+        assert most_specific_action(flat, address) == expected
+        assert first_match_action(nested, address) == expected
+
+
+@pytest.mark.parametrize('backend_name', list(FIREWALL_BACKENDS))
+def test_incremental_changes_match_full_aggregation(backend_name):
+    random = Random(backend_name)
+    backend = FIREWALL_BACKENDS[backend_name](RecordingRunner())
+    firewall = Firewall(backend)
+    rules = random_rules(random, 100)
+
+    assert firewall.start('user-1', list(rules.items()))
+
+    for _ in range(100):
+        if random.random() < 0.4:
+            address = random.choice(list(rules))
+            assert firewall.apply_changes([], [(address, rules.pop(address))])
+        else:
+            address, action = random_rules(random, 1).popitem()
+            rules[address] = action
+            assert firewall.apply_changes([(address, action)], [])
+
+        assert firewall.applied == dict(backend.aggregate(list(rules.items())))
+
+
+def apply_restore_payload(chain: list, payload: str):
+    '''
+    Simula as inclusões, inserções e remoções de um payload do
+    iptables-restore na cadeia FORWARD, guardando uma regra por prefixo.
+    '''
+
+    for line in payload.splitlines():
+        tokens = line.split()
+
+        if len(tokens) < 2 or tokens[1] != 'FORWARD' or '-i enp0s8' not in line:
+            continue
+
+        address = tokens[tokens.index('-s') + 1]
+        action = tokens[tokens.index('-j') + 1]
+
+        if tokens[0] == '-A':
+            chain.append((address, action))
+        elif tokens[0] == '-I':
+            chain.insert((int(tokens[2]) - 1) // 2, (address, action))
+        else:
+            chain.remove((address, action))
+
+
+def test_restore_backend_inserts_exceptions_before_covering_prefixes():
+    random = Random(0)
+    runner = RecordingRunner()
+    firewall = Firewall(FIREWALL_BACKENDS['restore'](runner))
+    rules = random_rules(random, 50)
+
+    assert firewall.start('user-1', list(rules.items()))
+
+    for _ in range(50):
+        address, action = random_rules(random, 1).popitem()
+
+        if address in rules:
+            assert firewall.apply_changes([], [(address, rules.pop(address))])
+        else:
+            rules[address] = action
+            assert firewall.apply_changes([(address, action)], [])
+
+    chain = []
+
+    for payload in runner.get_inputs('iptables-restore'):
+        apply_restore_payload(chain, payload)
+
+    assert len(chain) == len(firewall.applied)
+
+    for address in range(BASE_ADDRESS, BASE_ADDRESS + ADDRESS_COUNT):
+        expected = most_specific_action(rules.items(), address)
+        assert first_match_action(chain, address) == expected
+
+
+def test_failed_changes_keep_applied_state():
+    runner = RecordingRunner()
+    firewall = Firewall(FIREWALL_BACKENDS['nftables'](runner))
+    rules = random_rules(Random(0), 100)
+
+    assert firewall.start('user-1', list(rules.items()))
+
+    applied = dict(firewall.applied)
+    runner.record = lambda *call: False
+
+    assert not firewall.apply_changes([('10.0.1.0/24', 'ACCEPT')], [])
+    assert firewall.applied == applied
+    assert firewall.rules == rules
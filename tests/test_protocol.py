@@ -0,0 +1,64 @@
+from asyncio import StreamReader, run
+from socket import create_connection, create_server
+
+import pytest
+
+from protocol import (
+    HEADER, MAX_PAYLOAD_SIZE, FramedConnection, ProtocolError, ResponseData,
+    decode_response, encode_frame, encode_response, get_available_encodings,
+    read_frame, recv_frame
+)
+
+
+def read_frames(data: bytes) -> list:
+    async def read_all():
+        reader = StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+
+        frames = []
+
+        while (frame := await read_frame(reader)) is not None:
+            frames.append(frame)
+
+        return frames
+
+    return run(read_all())
+
+
+def test_send_many_frames_commands_in_order():
+    with create_server(('127.0.0.1', 0)) as listener:
+        client = create_connection(listener.getsockname())
+        server, _ = listener.accept()
+
+    with client, server:
+        connection = FramedConnection(client)
+        request_ids = connection.send_many(['user list', 'rule list'])
+        client.shutdown(1)
+
+        assert recv_frame(server) == (request_ids[0], b'user list')
+        assert recv_frame(server) == (request_ids[1], b'rule list')
+        assert recv_frame(server) is None
+
+
+def test_read_frame_stops_at_truncated_frame():
+    data = encode_frame(1, b'first') + encode_frame(2, b'second')[:-1]
+
+    assert read_frames(data) == [(1, b'first')]
+
+
+def test_rejects_frames_above_maximum_size():
+    with pytest.raises(ProtocolError):
+        read_frames(HEADER.pack(MAX_PAYLOAD_SIZE + 1, 1))
+
+
+@pytest.mark.parametrize('encoding', get_available_encodings())
+def test_response_round_trip(encoding):
+    data = ResponseData({'ids': ['rule-1']}, lambda data: 'Regra rule-1')
+
+    response = decode_response(encode_response(0, data, encoding), encoding)
+
+    if encoding == 'text':
+        assert response == {'code': '0', 'message': 'Regra rule-1'}
+    else:
+        assert response == {'code': 0, 'data': {'ids': ['rule-1']}}
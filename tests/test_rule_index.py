@@ -0,0 +1,75 @@
+from rule_index import (
+    CONFLICT, OVERLAP, SHADOWED, RuleIndex, SortedKeys, find_rule_conflicts
+)
+
+
+def rule(ip: str, action: str = 'ACCEPT', user_id: str = 'user-1') -> dict:
+    return {'user_id': user_id, 'ip': ip, 'action': action}
+
+
+def test_find_rule_conflicts_points_to_nearest_containing_rule():
+    rules = {
+        'a': rule('10.0.0.0/8', 'DROP'),
+        'b': rule('10.1.0.0/16', 'DROP'),
+        'c': rule('10.1.1.1', 'ACCEPT'),
+        'd': rule('10.1.1.0/24', 'ACCEPT', 'user-2'),
+        'e': rule('192.168.0.0/16', 'DROP'),
+        'f': rule('invalid', 'DROP')
+    }
+
+    assert find_rule_conflicts(rules) == [
+        (SHADOWED, 'b', 'a'),
+        (OVERLAP, 'd', 'b'),
+        (CONFLICT, 'c', 'b'),
+        (OVERLAP, 'c', 'd')
+    ]
+
+
+def test_find_rule_conflicts_ignores_disjoint_networks():
+    rules = {
+        'a': rule('10.0.0.0/24'),
+        'b': rule('10.0.1.0/24', 'DROP'),
+        'c': rule('10.0.0.255', user_id='user-2')
+    }
+
+    assert find_rule_conflicts(rules) == [(OVERLAP, 'c', 'a')]
+
+
+def test_find_overlapping_returns_containing_and_contained_rules():
+    index = RuleIndex()
+
+    for id, address in [
+        ('network', '10.0.0.0/8'),
+        ('same', '10.1.0.0/16'),
+        ('host', '10.1.2.3'),
+        ('sibling', '10.2.0.0/16'),
+        ('invalid', 'invalid')
+    ]:
+        index.add(id, address, bulk=True)
+
+    assert sorted(index.find_overlapping('10.1.0.0/16')) == [
+        'host', 'network', 'same'
+    ]
+    assert index.find_overlapping('invalid') == []
+
+    index.remove('same')
+
+    assert sorted(index.find_overlapping('10.1.0.0/16')) == ['host', 'network']
+    assert list(index.iterate(network=(10 << 24, (11 << 24) - 1))) == [
+        'network', 'host', 'sibling'
+    ]
+
+
+def test_sorted_keys_sorts_bulk_additions_on_first_query():
+    keys = SortedKeys()
+
+    for key in [5, 1, 3]:
+        keys.add(key, bulk=True)
+
+    keys.add(4)
+    keys.remove(1)
+    keys.remove(2)
+
+    assert list(keys.iterate()) == [3, 4, 5]
+    assert list(keys.iterate(after=3, start=2)) == [4, 5]
+    assert list(keys.iterate(start=5)) == [5]
@@ -0,0 +1,57 @@
+from models import User
+from session import Session, SessionManager
+
+
+def create_user(id: str = 'user-1') -> User:
+    return User.new_from_dict(id, {
+        'name': 'User', 'email': 'user@example.com', 'password': b''
+    })
+
+
+def test_resumes_session_on_another_connection():
+    manager = SessionManager()
+    user = create_user()
+    session = Session()
+    manager.login(session, user)
+
+    other = Session()
+
+    assert manager.resume(other, session.token)
+    assert other.user is user and other.token == session.token
+    assert not manager.resume(Session(), 'invalid')
+
+    manager.logout(session)
+
+    assert not manager.is_user_logged_in(user.id)
+
+    manager.refresh(other)
+
+    assert other.user is None and other.token is None
+
+
+def test_expires_idle_sessions():
+    manager = SessionManager(idle_timeout=60)
+    user = create_user()
+    session = Session()
+    manager.login(session, user)
+    token = session.token
+
+    manager.sessions[token].last_seen -= 61
+
+    assert not manager.resume(Session(), token)
+    assert not manager.is_user_logged_in(user.id)
+
+
+def test_refresh_keeps_active_sessions():
+    manager = SessionManager(idle_timeout=60)
+    idle, active = Session(), Session()
+    manager.login(idle, create_user('user-1'))
+    manager.login(active, create_user('user-2'))
+
+    idle.last_seen -= 61
+    active.last_seen -= 59
+    manager.refresh(active)
+
+    assert manager.is_user_logged_in('user-2')
+    assert not manager.is_user_logged_in('user-1')
+    assert list(manager.sessions) == [active.token]
@@ -0,0 +1,189 @@
+from json import loads
+from os import replace
+from os.path import getsize, isfile
+
+import pytest
+
+from command_response_type import DatabaseTableType
+from rule_index import get_rule_range
+from storage import MemoryStorage, SQLiteStorage
+
+
+def rule(ip: str, action: str = 'ACCEPT', user_id: str = 'user-1') -> dict:
+    return {'user_id': user_id, 'ip': ip, 'action': action}
+
+
+@pytest.fixture
+def database_name(tmp_path):
+    return str(tmp_path / 'database.json')
+
+
+def open_storage(database_name: str) -> MemoryStorage:
+    return MemoryStorage(database_name, sync=False)
+
+
+def test_replays_journal_on_load(database_name):
+    storage = open_storage(database_name)
+    storage.insert_record(DatabaseTableType.RULE, 'rule-1', rule('10.0.0.1'))
+    storage.insert_records(DatabaseTableType.RULE, [
+        ('rule-2', rule('10.0.0.2')),
+        ('rule-3', rule('10.0.0.3', 'DENY'))
+    ])
+    storage.remove_record(DatabaseTableType.RULE, 'rule-1')
+    storage.close()
+
+    assert not isfile(database_name)
+
+    storage = open_storage(database_name)
+
+    assert storage.get_record(DatabaseTableType.RULE, 'rule-1') is None
+    record = storage.get_record(DatabaseTableType.RULE, 'rule-3')
+    assert record == rule('10.0.0.3', 'DENY')
+    assert set(storage.get_rules_by_user_id('user-1')) == {'rule-2', 'rule-3'}
+    assert storage.find_rule_by_address('user-1', '10.0.0.2')[0] == 'rule-2'
+
+    storage.close()
+
+
+@pytest.mark.parametrize('torn_tail', [
+    b'{"op":"put","table":"rules","id":"rule-2","rec',
+    b'{"op":"put","table":"rules","id":"rule-2","record":{}}'
+])
+def test_truncates_torn_journal_tail(database_name, torn_tail):
+    storage = open_storage(database_name)
+    storage.insert_record(DatabaseTableType.RULE, 'rule-1', rule('10.0.0.1'))
+    storage.close()
+
+    journal_name = f'{database_name}.journal'
+    committed_size = getsize(journal_name)
+
+    with open(journal_name, mode='ab') as file:
+        file.write(torn_tail)
+
+    storage = open_storage(database_name)
+
+    assert getsize(journal_name) == committed_size
+    assert storage.get_record(DatabaseTableType.RULE, 'rule-2') is None
+
+    # Novos registros não podem ser gravados depois da cauda descartada.
+    storage.insert_record(DatabaseTableType.RULE, 'rule-3', rule('10.0.0.3'))
+    storage.close()
+
+    storage = open_storage(database_name)
+
+    assert set(storage.get_rules_by_user_id('user-1')) == {'rule-1', 'rule-3'}
+
+    storage.close()
+
+
+def test_recovers_interrupted_compaction(database_name):
+    storage = open_storage(database_name)
+    storage.insert_record(DatabaseTableType.RULE, 'rule-1', rule('10.0.0.1'))
+    storage.compact()
+    storage.insert_record(DatabaseTableType.RULE, 'rule-2', rule('10.0.0.2'))
+    storage.close()
+
+    # Interrompe a compactação depois da troca do journal e antes do
+    # novo snapshot, como em uma queda do processo.
+    journal_name = f'{database_name}.journal'
+    replace(journal_name, f'{journal_name}.compacting')
+    open(journal_name, mode='w').close()
+
+    storage = open_storage(database_name)
+
+    assert not isfile(f'{journal_name}.compacting')
+    assert set(storage.get_rules_by_user_id('user-1')) == {'rule-1', 'rule-2'}
+
+    with open(database_name) as file:
+        assert set(loads(file.read())['rules']) == {'rule-1', 'rule-2'}
+
+    # Uma nova compactação não pode descartar as alterações recuperadas.
+    storage.insert_record(DatabaseTableType.RULE, 'rule-3', rule('10.0.0.3'))
+    storage.compact()
+    storage.close()
+
+    storage = open_storage(database_name)
+
+    rules = storage.get_rules_by_user_id('user-1')
+    assert set(rules) == {'rule-1', 'rule-2', 'rule-3'}
+
+    storage.close()
+
+
+@pytest.mark.parametrize('storage_class', [MemoryStorage, SQLiteStorage])
+def test_finds_overlapping_rules(tmp_path, storage_class):
+    storage = storage_class(str(tmp_path / 'database'))
+    storage.insert_records(DatabaseTableType.RULE, [
+        ('network', rule('10.0.0.0/8', 'DENY')),
+        ('host', rule('10.1.2.3')),
+        ('other', rule('192.168.0.0/16')),
+        ('other-user', rule('10.1.0.0/16', user_id='user-2'))
+    ])
+
+    assert set(storage.find_overlapping_rules('10.1.2.0/24', 'user-1')) == {
+        'network', 'host'
+    }
+    assert set(storage.find_overlapping_rules('10.1.2.0/24')) == {
+        'network', 'host', 'other-user'
+    }
+
+    storage.close()
+
+
+def read_pages(list_page, limit: int, get_cursor) -> list:
+    result = []
+    after = None
+
+    while True:
+        page = list_page(limit, after)
+        result.extend(id for id, _ in page)
+
+        if len(page) < limit:
+            return result
+
+        after = get_cursor(*page[-1])
+
+
+@pytest.mark.parametrize('storage_class', [MemoryStorage, SQLiteStorage])
+def test_lists_rules_and_users_by_pages(tmp_path, storage_class):
+    storage = storage_class(str(tmp_path / 'database'))
+    storage.insert_records(DatabaseTableType.RULE, [
+        ('network', rule('10.0.0.0/8', 'DENY')),
+        ('host-b', rule('10.1.2.2')),
+        ('host-a', rule('10.1.2.2/31')),
+        ('subnet', rule('10.1.0.0/16', 'DENY')),
+        ('outside', rule('192.168.0.1')),
+        ('other-user', rule('10.1.2.4', user_id='user-2'))
+    ])
+    storage.insert_records(DatabaseTableType.USER, [
+        (f'user-{index}', {
+            'name': 'User', 'email': f'{index}@example.com', 'password': ''
+        })
+        for index in range(5)
+    ])
+
+    def get_rule_cursor(id: str, record: dict) -> tuple:
+        return get_rule_range(record['ip'])[0], id
+
+    def list_rules(**filters):
+        return lambda limit, after: storage.list_rules(
+            'user-1', limit, after, **filters
+        )
+
+    for limit in (1, 2, 10):
+        assert read_pages(list_rules(), limit, get_rule_cursor) == [
+            'network', 'subnet', 'host-a', 'host-b', 'outside'
+        ]
+        assert read_pages(
+            list_rules(network='10.1.0.0/16'), limit, get_rule_cursor
+        ) == ['subnet', 'host-a', 'host-b']
+        assert read_pages(
+            list_rules(network='10.0.0.0/8', action='ACCEPT'), limit, get_rule_cursor
+        ) == ['host-a', 'host-b']
+        assert read_pages(
+            lambda limit, after: storage.list_users(limit, after),
+            limit,
+            lambda id, record: record['email']
+        ) == [f'user-{index}' for index in range(5)]
+
+    storage.close()
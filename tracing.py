@@ -0,0 +1,267 @@
+from cProfile import Profile
+from os import W_OK, access
+from os.path import isdir, join
+from pstats import Stats
+from tempfile import gettempdir
+from threading import Lock, Timer, local
+from time import monotonic, perf_counter, strftime
+from typing import List, Optional, Tuple
+
+DEFAULT_PROFILE_DIRECTORY = gettempdir()
+
+_local = local()
+
+
+class Trace:
+    '''
+    Trechos (spans) de uma requisição, como pares (nome, duração), na
+    ordem em que terminaram. Trechos aninhados aparecem separadamente.
+    '''
+
+    spans: List[Tuple[str, float]]
+
+    def __init__(self):
+        self.spans = []
+
+    def format(self) -> str:
+        totals = {}
+
+        for name, elapsed in self.spans:
+            totals[name] = totals.get(name, 0.0) + elapsed
+
+        return ', '.join(
+            f'{name} {elapsed * 1000:.2f}ms' for name, elapsed in totals.items()
+        )
+
+
+class Span:
+    '''
+    Mede um trecho da requisição em andamento na thread atual. Sem
+    rastreamento ativo, custa apenas a consulta ao thread-local.
+    '''
+
+    __slots__ = ('name', 'trace', 'started')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = getattr(_local, 'trace', None)
+
+        if self.trace is not None:
+            self.started = perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.trace is not None:
+            self.trace.spans.append((self.name, perf_counter() - self.started))
+
+
+def trace_span(name: str) -> Span:
+    return Span(name)
+
+
+class RequestProfiler:
+    '''
+    Executa as próximas "requests" requisições (ou as recebidas nos
+    próximos "seconds" segundos) sob o cProfile e grava as estatísticas
+    acumuladas em "filename", no formato lido por "python -m pstats".
+
+    Somente uma requisição é perfilada por vez: as que chegam enquanto
+    outra está sendo medida são executadas normalmente.
+    '''
+
+    filename: str
+    requests: Optional[int]
+    deadline: Optional[float]
+    stats: Optional[Stats]
+    profiled: int
+    finished: bool
+    error: Optional[str]
+
+    def __init__(self, filename: str, requests: int = None, seconds: float = None):
+        self.filename = filename
+        self.requests = requests
+        self.deadline = monotonic() + seconds if seconds is not None else None
+        self.stats = None
+        self.profiled = 0
+        self.finished = False
+        self.error = None
+        self.lock = Lock()
+        self.profile_lock = Lock()
+        self.timer = None
+
+        if seconds is not None:
+            self.timer = Timer(seconds, self.finish)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def is_active(self) -> bool:
+        if self.finished:
+            return False
+
+        return self.deadline is None or monotonic() < self.deadline
+
+    def run(self, function, *args):
+        if not self.is_active() or not self.profile_lock.acquire(blocking=False):
+            return function(*args)
+
+        profile = Profile()
+
+        try:
+            try:
+                profile.enable()
+            except ValueError:
+                # Outra ferramenta de profiling já está ativa no processo.
+                return function(*args)
+
+            try:
+                return function(*args)
+            finally:
+                profile.disable()
+                self.add(profile)
+        finally:
+            self.profile_lock.release()
+
+    def add(self, profile: Profile):
+        with self.lock:
+            if self.finished:
+                return
+
+            if self.stats is None:
+                self.stats = Stats(profile)
+            else:
+                self.stats.add(profile)
+
+            self.profiled += 1
+            done = self.requests is not None and self.profiled >= self.requests
+
+        if done:
+            self.finish()
+
+    def finish(self):
+        with self.lock:
+            if self.finished:
+                return
+
+            self.finished = True
+
+            if self.timer is not None:
+                self.timer.cancel()
+
+            if self.stats is None:
+                print('[profile] Nenhuma requisição perfilada.')
+                return
+
+            try:
+                self.stats.dump_stats(self.filename)
+            except OSError as error:
+                self.error = str(error)
+                print(f'[profile] Não foi possível gravar {self.filename}: {error}')
+                return
+
+        print(f'[profile] {self.profiled} requisição(ões) perfilada(s) em '
+              f'{self.filename}')
+
+
+class Tracer:
+    '''
+    Rastreamento das requisições: quando "threshold" (em segundos) está
+    definido, os trechos de cada requisição são medidos e registrados no
+    log se a requisição demorar mais que o limite. Também mantém o
+    profiler sob demanda iniciado pelo comando "admin profile".
+    '''
+
+    threshold: Optional[float]
+    profile_directory: str
+    profiler: Optional[RequestProfiler]
+
+    def __init__(
+        self,
+        threshold: float = None,
+        profile_directory: str = DEFAULT_PROFILE_DIRECTORY
+    ):
+        self.threshold = threshold
+        self.profile_directory = profile_directory
+        self.profiler = None
+        self.profiles = 0
+
+    def start_trace(self) -> Optional[Trace]:
+        trace = Trace() if self.threshold is not None else None
+        _local.trace = trace
+        return trace
+
+    def finish_trace(
+        self,
+        trace: Optional[Trace],
+        labels: Tuple[str, str],
+        elapsed: float
+    ):
+        _local.trace = None
+
+        if trace is None or self.threshold is None or elapsed < self.threshold:
+            return
+
+        name = ' '.join(label for label in labels if label)
+        print(f'[trace] {name} {elapsed * 1000:.2f}ms: {trace.format()}')
+
+    def run_profiled(self, function, *args):
+        profiler = self.profiler
+
+        if profiler is None:
+            return function(*args)
+
+        return profiler.run(function, *args)
+
+    def start_profiler(
+        self,
+        requests: int = None,
+        seconds: float = None
+    ) -> Optional[str]:
+        '''
+        Inicia um novo profiler, encerrando o anterior, e retorna o nome do
+        arquivo em que as estatísticas serão gravadas, ou None se o
+        diretório dos arquivos não existir ou não permitir escrita.
+        '''
+
+        directory = self.profile_directory
+
+        if not (isdir(directory) and access(directory, W_OK)):
+            return None
+
+        if self.profiler is not None:
+            self.profiler.finish()
+
+        self.profiles += 1
+        filename = join(
+            self.profile_directory,
+            f'profile-{strftime("%Y%m%d-%H%M%S")}-{self.profiles}.prof'
+        )
+        self.profiler = RequestProfiler(filename, requests, seconds)
+
+        return filename
+
+    def get_status(self) -> dict:
+        profiler = self.profiler
+        profiling = profiler is not None and profiler.is_active()
+
+        threshold = self.threshold
+
+        return {
+            'threshold_ms': threshold * 1000 if threshold is not None else None,
+            'profiling': profiling,
+            'profile_file': profiler.filename if profiler is not None else None,
+            'profiled': profiler.profiled if profiler is not None else 0,
+            'profile_error': profiler.error if profiler is not None else None
+        }
+
+
+_tracer = Tracer()
+
+
+def set_tracer(tracer: Tracer):
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer() -> Tracer:
+    return _tracer